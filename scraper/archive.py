@@ -0,0 +1,192 @@
+import gzip
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from config import ARCHIVE_SEGMENT_BYTES
+
+# Raw-page archive: every fetched response is appended as its own gzip member
+# to size-capped segment files under <root>/<run_id>/, and indexed in
+# <root>/index.sqlite by (url, run, segment, offset, length). Because each
+# record is an independent gzip member, a single page can be read back by
+# slicing the memory-mapped segment and decompressing just that range.
+
+INDEX_FILE = "index.sqlite"
+
+
+def _open_index(root):
+    index = sqlite3.connect(os.path.join(root, INDEX_FILE), check_same_thread=False)
+    index.executescript("""
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            started_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS pages (
+            url TEXT NOT NULL,
+            run_id TEXT NOT NULL,
+            segment TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            status INTEGER,
+            content_type TEXT,
+            fetched_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_pages_run ON pages (run_id);
+        CREATE INDEX IF NOT EXISTS idx_pages_url ON pages (url, fetched_at);
+    """)
+    return index
+
+
+def encode_record(url, status, body, content_type=None, fetched_at=None):
+    header = {
+        "url": url,
+        "status": status,
+        "content_type": content_type,
+        "fetched_at": fetched_at or datetime.now(timezone.utc).isoformat(),
+    }
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return gzip.compress(json.dumps(header).encode("utf-8") + b"\n" + body), header
+
+
+def decode_record(blob):
+    raw = gzip.decompress(blob)
+    header, _, body = raw.partition(b"\n")
+    return json.loads(header), body
+
+
+class PageArchive:
+    """Append-only writer for one scraper run. Safe to share between threads."""
+
+    def __init__(self, root, run_id, segment_bytes=ARCHIVE_SEGMENT_BYTES, commit_every=50):
+        self.root = root
+        self.run_id = str(run_id)
+        self.run_dir = os.path.join(root, self.run_id)
+        self.segment_bytes = segment_bytes
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        self.segment_no = -1
+        self.segment = None
+        self.pending = 0
+        self.pages = 0
+
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.index = _open_index(root)
+        self.index.execute(
+            "INSERT OR IGNORE INTO runs (run_id, started_at) VALUES (?, ?)",
+            (self.run_id, datetime.now(timezone.utc).isoformat()),
+        )
+        self.index.commit()
+        self._rotate()
+
+    def _rotate(self):
+        if self.segment:
+            self.segment.close()
+        self.segment_no += 1
+        self.segment_name = f"segment-{self.segment_no:05d}.warc.gz"
+        self.segment = open(os.path.join(self.run_dir, self.segment_name), "ab")
+
+    def append(self, url, status, body, content_type=None):
+        # Compress outside the lock; only the file append and index insert are serialized
+        blob, header = encode_record(url, status, body, content_type)
+        with self.lock:
+            if self.segment.tell() and self.segment.tell() + len(blob) > self.segment_bytes:
+                self._rotate()
+            offset = self.segment.tell()
+            self.segment.write(blob)
+            self.index.execute("""
+                INSERT INTO pages (url, run_id, segment, offset, length, status, content_type, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (url, self.run_id, self.segment_name, offset, len(blob),
+                  status, content_type, header["fetched_at"]))
+            self.pages += 1
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self._commit()
+
+    def _commit(self):
+        # Segment bytes must be on disk before the index points at them
+        self.segment.flush()
+        self.index.commit()
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.segment.close()
+            self.index.close()
+
+
+class ArchiveReader:
+    """Random access to archived pages through memory-mapped segments."""
+
+    def __init__(self, root):
+        self.root = root
+        self.index = _open_index(root)
+        self.maps = {}
+        self.lock = threading.Lock()
+
+    def runs(self):
+        rows = self.index.execute("SELECT run_id FROM runs ORDER BY started_at DESC").fetchall()
+        return [r[0] for r in rows]
+
+    def latest_run(self):
+        runs = self.runs()
+        return runs[0] if runs else None
+
+    def entries(self, run_id):
+        """(url, segment, offset, length) for every page archived in a run."""
+        return self.index.execute("""
+            SELECT url, segment, offset, length FROM pages
+            WHERE run_id = ? ORDER BY segment, offset
+        """, (str(run_id),)).fetchall()
+
+    def _map(self, run_id, segment):
+        key = (run_id, segment)
+        with self.lock:
+            if key not in self.maps:
+                with open(os.path.join(self.root, run_id, segment), "rb") as f:
+                    self.maps[key] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.maps[key]
+
+    def read(self, run_id, segment, offset, length):
+        """Returns (header, body bytes) for one record."""
+        mm = self._map(str(run_id), segment)
+        return decode_record(mm[offset:offset + length])
+
+    def get(self, url, run_id=None):
+        """Most recent archived copy of a URL (optionally within one run), or None."""
+        query = "SELECT run_id, segment, offset, length FROM pages WHERE url = ?"
+        params = [url]
+        if run_id:
+            query += " AND run_id = ?"
+            params.append(str(run_id))
+        row = self.index.execute(query + " ORDER BY fetched_at DESC LIMIT 1", params).fetchone()
+        return self.read(*row) if row else None
+
+    def close(self):
+        for mm in self.maps.values():
+            mm.close()
+        self.maps.clear()
+        self.index.close()
+
+
+def prune_runs(root, keep_runs):
+    """Retention: delete every archived run except the newest `keep_runs`."""
+    index = _open_index(root)
+    try:
+        rows = index.execute("SELECT run_id FROM runs ORDER BY started_at DESC").fetchall()
+        expired = [r[0] for r in rows[keep_runs:]]
+        for run_id in expired:
+            index.execute("DELETE FROM pages WHERE run_id = ?", (run_id,))
+            index.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            shutil.rmtree(os.path.join(root, run_id), ignore_errors=True)
+        index.commit()
+        if expired:
+            index.execute("VACUUM")
+        return expired
+    finally:
+        index.close()
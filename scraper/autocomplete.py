@@ -0,0 +1,233 @@
+import io
+import re
+import json
+import time
+import hashlib
+import argparse
+import unicodedata
+from collections import defaultdict
+
+import psycopg2.extras
+
+from db import get_connection
+from events import log
+from config import (
+    DEMAND_WINDOW_DAYS, AUTOCOMPLETE_PREFIX_MAX, AUTOCOMPLETE_SUGGESTIONS,
+    AUTOCOMPLETE_TYPO_MIN, AUTOCOMPLETE_TYPO_MAX,
+)
+
+# As-you-type suggestions for /api/search/autocomplete, compiled after each run
+# so keystrokes never touch products:
+#   search_autocomplete        prefix -> top suggestions (products, brands, SKUs,
+#                              tags) by popularity, one primary-key lookup
+#   search_autocomplete_typos  symmetric-delete index: every one-character
+#                              deletion of every indexed prefix -> that prefix
+# Names are indexed from the start of every word, so "chain" finds
+# "Galvanized Anchor Chain". Rebuilt only when the source terms change; when
+# only order demand moved, the prefixes whose ranking changed are rewritten in
+# place and the typo index (which depends on the prefixes alone) is kept.
+
+KINDS = ("product", "brand", "sku", "tag")
+
+
+def normalize(text):
+    """Lowercase ASCII words separated by single spaces (mirrored in the web route)."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+
+def word_starts(key):
+    """The key from the start of each of its words."""
+    words = key.split(" ")
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+def deletes(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def ensure_autocomplete_tables(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS search_autocomplete (
+                prefix TEXT PRIMARY KEY,
+                suggestions JSONB NOT NULL
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS search_autocomplete_typos (
+                variant TEXT NOT NULL,
+                prefix TEXT NOT NULL,
+                PRIMARY KEY (variant, prefix)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS search_autocomplete_builds (
+                version TEXT PRIMARY KEY,
+                built_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                prefixes INT NOT NULL,
+                typo_variants INT NOT NULL
+            )
+        """)
+    conn.commit()
+
+
+def load_entries(conn):
+    """Suggestion entries: (kind, display text, keys, weight, product id, slug).
+    Weight is 1 + units ordered recently, summed across products for brands and tags."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            WITH demand AS (
+                SELECT oi.product_id, SUM(oi.quantity) AS units
+                FROM order_items oi
+                JOIN orders o ON o.id = oi.order_id
+                WHERE o.created_at > NOW() - make_interval(days => %s)
+                GROUP BY oi.product_id
+            )
+            SELECT p.id::text, p.name, p.slug, p.brand, p.sku, p.tags, 1 + COALESCE(d.units, 0)
+            FROM products p
+            LEFT JOIN demand d ON d.product_id = p.id::text
+            WHERE p.available = TRUE AND p.price > 0
+        """, (DEMAND_WINDOW_DAYS,))
+        rows = cur.fetchall()
+
+    entries = []
+    brands = defaultdict(lambda: [None, 0])
+    tags = defaultdict(int)
+    for pid, name, slug, brand, sku, product_tags, weight in rows:
+        weight = int(weight)
+        key = normalize(name)
+        if key:
+            entries.append(("product", name, word_starts(key), weight, pid, slug))
+        if sku and normalize(sku):
+            entries.append(("sku", sku, [normalize(sku)], weight, pid, slug))
+        if brand and normalize(brand):
+            brands[normalize(brand)][0] = brand
+            brands[normalize(brand)][1] += weight
+        for tag in product_tags or []:
+            if normalize(tag):
+                tags[normalize(tag)] += weight
+    entries += [("brand", text, [key], weight, None, None) for key, (text, weight) in brands.items()]
+    entries += [("tag", key, [key], weight, None, None) for key, weight in tags.items()]
+    entries.sort(key=lambda e: (-e[3], KINDS.index(e[0]), e[1], e[4] or ""))
+    return entries
+
+
+def build_index(entries, prefix_max=AUTOCOMPLETE_PREFIX_MAX, per_prefix=AUTOCOMPLETE_SUGGESTIONS):
+    """{prefix: [suggestion, ...]} best first. `entries` must already be sorted by weight."""
+    index = defaultdict(list)
+    for kind, text, keys, weight, pid, slug in entries:
+        suggestion = {"text": text, "kind": kind, "weight": weight}
+        if pid:
+            suggestion["id"] = pid
+            suggestion["slug"] = slug
+        seen = set()
+        for key in keys:
+            for n in range(1, min(len(key), prefix_max) + 1):
+                prefix = key[:n].rstrip()
+                if prefix in seen:
+                    continue
+                seen.add(prefix)
+                bucket = index[prefix]
+                if len(bucket) < per_prefix:
+                    bucket.append(suggestion)
+    return index
+
+
+def build_typos(prefixes, shortest=AUTOCOMPLETE_TYPO_MIN, longest=AUTOCOMPLETE_TYPO_MAX):
+    """Set of (variant, prefix): one-character deletions of every indexed prefix
+    between `shortest` and `longest` characters."""
+    pairs = set()
+    for prefix in prefixes:
+        if shortest <= len(prefix) <= longest:
+            for variant in deletes(prefix):
+                pairs.add((variant, prefix))
+    return pairs
+
+
+def terms_version(entries):
+    """Hash of the terms behind the index, leaving out their demand weights."""
+    terms = sorted(json.dumps([kind, text, keys, pid, slug], separators=(",", ":"))
+                   for kind, text, keys, _, pid, slug in entries)
+    return hashlib.sha256("\n".join(terms).encode("utf-8")).hexdigest()[:16]
+
+
+def update_weights(conn, index):
+    """Rewrite the prefixes of an index over the same terms whose suggestions
+    (ranking or weights) changed. Returns the number rewritten."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT prefix, suggestions FROM search_autocomplete")
+        stored = dict(cur.fetchall())
+        changed = [
+            (prefix, json.dumps(suggestions, ensure_ascii=False, separators=(",", ":")))
+            for prefix, suggestions in index.items() if stored.get(prefix) != suggestions
+        ]
+        if changed:
+            psycopg2.extras.execute_values(cur, """
+                UPDATE search_autocomplete a SET suggestions = v.suggestions::jsonb
+                FROM (VALUES %s) AS v(prefix, suggestions)
+                WHERE a.prefix = v.prefix
+            """, changed, page_size=1000)
+    conn.commit()
+    return len(changed)
+
+
+def _copy(cur, table, columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        # COPY text format: only backslashes need escaping (prefixes are [a-z0-9 ]
+        # and json.dumps never emits a raw tab or newline)
+        buf.write("\t".join(value.replace("\\", "\\\\") for value in row) + "\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buf)
+
+
+def build_autocomplete(conn, force=False):
+    """Rebuild the autocomplete tables if the catalog's terms changed, otherwise
+    only refresh the prefixes whose demand ranking moved. Returns the version
+    that is live afterwards."""
+    ensure_autocomplete_tables(conn)
+    started = time.monotonic()
+    entries = load_entries(conn)
+    version = terms_version(entries)
+    index = build_index(entries)
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM search_autocomplete_builds ORDER BY built_at DESC LIMIT 1")
+        row = cur.fetchone()
+    if row and row[0] == version and not force:
+        updated = update_weights(conn, index)
+        log.info("autocomplete.reranked", "Autocomplete terms unchanged ({version}), re-ranked {prefixes} prefixes",
+                 version=version, prefixes=updated)
+        return version
+
+    typos = build_typos(index)
+    with conn.cursor() as cur:
+        # DELETE rather than TRUNCATE: readers keep the old index until the commit
+        cur.execute("DELETE FROM search_autocomplete")
+        cur.execute("DELETE FROM search_autocomplete_typos")
+        _copy(cur, "search_autocomplete", "prefix, suggestions", (
+            (prefix, json.dumps(suggestions, ensure_ascii=False, separators=(",", ":")))
+            for prefix, suggestions in index.items()
+        ))
+        _copy(cur, "search_autocomplete_typos", "variant, prefix", typos)
+        cur.execute("DELETE FROM search_autocomplete_builds")
+        cur.execute("""
+            INSERT INTO search_autocomplete_builds (version, prefixes, typo_variants)
+            VALUES (%s, %s, %s)
+        """, (version, len(index), len(typos)))
+    conn.commit()
+    log.info("autocomplete.built", "Built autocomplete index {version}: {terms} terms, {prefixes} prefixes, "
+             "{typos} typo variants in {seconds:.1f}s", version=version, terms=len(entries),
+             prefixes=len(index), typos=len(typos), seconds=time.monotonic() - started)
+    return version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the search autocomplete index")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the catalog's terms are unchanged")
+    args = parser.parse_args()
+    conn = get_connection()
+    build_autocomplete(conn, force=args.force)
+    conn.close()
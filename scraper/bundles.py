@@ -0,0 +1,242 @@
+import time
+import argparse
+
+import numpy as np
+import scipy.sparse as sp
+import psycopg2.extras
+
+from db import get_connection
+from events import log
+from config import (BUNDLE_TOP_K, BUNDLE_MIN_PAIR_ORDERS, BUNDLE_ORDER_BATCH, BUNDLE_SETTLE_SECONDS,
+                    BUNDLE_SKIP_STATUSES)
+
+# "Frequently bought together" from real orders. Running counts live in
+# copurchase_items (orders containing each product / category) and
+# copurchase_pairs (orders containing both of a pair, a < b), advanced past a
+# (created_at, id) watermark so each order is counted once. An order's
+# created_at is its transaction's start, so an order that commits late can land
+# behind a watermark that already moved on; the scan therefore stops
+# BUNDLE_SETTLE_SECONDS short of now, by which time every order up to the
+# cutoff has committed. Orders in BUNDLE_SKIP_STATUSES are never counted (one
+# cancelled after it was counted stays counted until --full). Pairs are scored by
+# lift = P(a, b) / (P(a) P(b)) and the best BUNDLE_TOP_K per anchor product and
+# per anchor category land in bundle_suggestions.
+#
+# Each update rescores the anchors that appeared in new orders plus the anchors
+# whose current suggestions include one of them. Growth in the order total alone
+# scales every lift by the same factor and reorders nothing, so other anchors'
+# stored lift values drift but their rankings hold; --full recounts everything.
+
+KINDS = ("product", "category")
+
+
+def ensure_bundle_tables(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS copurchase_watermark (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                last_created_at TIMESTAMP,
+                last_order_id TEXT,
+                orders BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS copurchase_items (
+                kind TEXT NOT NULL,
+                item TEXT NOT NULL,
+                orders INT NOT NULL,
+                PRIMARY KEY (kind, item)
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS copurchase_pairs (
+                kind TEXT NOT NULL,
+                a TEXT NOT NULL,
+                b TEXT NOT NULL,
+                orders INT NOT NULL,
+                PRIMARY KEY (kind, a, b)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_copurchase_pairs_b ON copurchase_pairs (kind, b)")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS bundle_suggestions (
+                kind TEXT NOT NULL,
+                anchor TEXT NOT NULL,
+                rank SMALLINT NOT NULL,
+                item TEXT NOT NULL,
+                orders INT NOT NULL,
+                lift REAL NOT NULL,
+                PRIMARY KEY (kind, anchor, rank)
+            )
+        """)
+        cur.execute("INSERT INTO copurchase_watermark (id) VALUES (TRUE) ON CONFLICT DO NOTHING")
+    conn.commit()
+
+
+def next_orders(conn, limit, settle_seconds=BUNDLE_SETTLE_SECONDS):
+    """Items of the next `limit` uncounted orders as (order_id, product_id,
+    category_id) rows, plus the new watermark (None when there are no new orders).
+    Orders younger than `settle_seconds` wait for a later run."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT last_created_at, last_order_id FROM copurchase_watermark")
+        last_created_at, last_order_id = cur.fetchone()
+        cur.execute("""
+            SELECT id, created_at, status::text NOT IN %(skip)s FROM orders
+            WHERE (%(at)s::timestamp IS NULL OR (created_at, id) > (%(at)s::timestamp, %(id)s))
+              AND created_at < NOW() - make_interval(secs => %(settle)s)
+            ORDER BY created_at, id
+            LIMIT %(limit)s
+        """, {"at": last_created_at, "id": last_order_id, "settle": settle_seconds,
+              "skip": tuple(BUNDLE_SKIP_STATUSES) or ("",), "limit": limit})
+        orders = cur.fetchall()
+        if not orders:
+            return [], None
+        cur.execute("""
+            SELECT oi.order_id, oi.product_id, p.category_id::text
+            FROM order_items oi
+            LEFT JOIN products p ON p.id::text = oi.product_id
+            WHERE oi.order_id = ANY(%s)
+        """, ([order_id for order_id, _, counted in orders if counted],))
+        items = cur.fetchall()
+    last_order_id, last_created_at, _ = orders[-1]
+    return items, (last_created_at, last_order_id, sum(counted for _, _, counted in orders))
+
+
+def cooccurrence(order_keys, item_keys):
+    """Vectorized counts over one batch: (items, orders containing each item,
+    upper-triangular COO matrix of orders containing both items of a pair)."""
+    _, order_index = np.unique(order_keys, return_inverse=True)
+    items, item_index = np.unique(item_keys, return_inverse=True)
+    incidence = sp.csr_matrix(
+        (np.ones(len(item_index), dtype=np.int32), (order_index, item_index)),
+        shape=(order_index.max() + 1, len(items)),
+    )
+    incidence.data[:] = 1  # the same item twice in one order counts once
+    item_counts = np.asarray(incidence.sum(axis=0)).ravel()
+    pairs = sp.triu(incidence.T @ incidence, k=1).tocoo()
+    return items, item_counts, pairs
+
+
+def add_counts(cur, kind, order_keys, item_keys):
+    """Add one batch's counts for `kind`. Returns the items seen."""
+    if len(item_keys) == 0:
+        return []
+    items, item_counts, pairs = cooccurrence(order_keys, item_keys)
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO copurchase_items (kind, item, orders) VALUES %s
+        ON CONFLICT (kind, item) DO UPDATE SET orders = copurchase_items.orders + EXCLUDED.orders
+    """, [(kind, str(item), int(n)) for item, n in zip(items, item_counts)], page_size=1000)
+    # np.unique sorts, so items[row] < items[col] in the upper triangle
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO copurchase_pairs (kind, a, b, orders) VALUES %s
+        ON CONFLICT (kind, a, b) DO UPDATE SET orders = copurchase_pairs.orders + EXCLUDED.orders
+    """, [
+        (kind, str(items[i]), str(items[j]), int(n))
+        for i, j, n in zip(pairs.row, pairs.col, pairs.data)
+    ], page_size=1000)
+    return [str(item) for item in items]
+
+
+def score_anchors(cur, kind, anchors, k=BUNDLE_TOP_K, min_orders=BUNDLE_MIN_PAIR_ORDERS):
+    """Rewrite bundle_suggestions for `anchors` from the running counts."""
+    cur.execute("DELETE FROM bundle_suggestions WHERE kind = %s AND anchor = ANY(%s)", (kind, anchors))
+    cur.execute("""
+        WITH total AS (SELECT orders FROM copurchase_watermark),
+        pairs AS (
+            SELECT a AS anchor, b AS item, orders FROM copurchase_pairs
+            WHERE kind = %(kind)s AND a = ANY(%(anchors)s) AND orders >= %(min)s
+            UNION ALL
+            SELECT b, a, orders FROM copurchase_pairs
+            WHERE kind = %(kind)s AND b = ANY(%(anchors)s) AND orders >= %(min)s
+        ),
+        scored AS (
+            SELECT pairs.anchor, pairs.item, pairs.orders,
+                   pairs.orders::float8 * total.orders / (ia.orders::float8 * ib.orders) AS lift
+            FROM pairs
+            CROSS JOIN total
+            JOIN copurchase_items ia ON ia.kind = %(kind)s AND ia.item = pairs.anchor
+            JOIN copurchase_items ib ON ib.kind = %(kind)s AND ib.item = pairs.item
+        ),
+        ranked AS (
+            SELECT *, row_number() OVER (PARTITION BY anchor ORDER BY lift DESC, orders DESC, item) AS rank
+            FROM scored
+            WHERE lift > 1
+        )
+        INSERT INTO bundle_suggestions (kind, anchor, rank, item, orders, lift)
+        SELECT %(kind)s, anchor, rank, item, orders, lift FROM ranked WHERE rank <= %(k)s
+    """, {"kind": kind, "anchors": anchors, "min": min_orders, "k": k})
+    return cur.rowcount
+
+
+def reset_counts(conn):
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM copurchase_pairs")
+        cur.execute("DELETE FROM copurchase_items")
+        cur.execute("DELETE FROM bundle_suggestions")
+        cur.execute("""
+            UPDATE copurchase_watermark SET
+                last_created_at = NULL, last_order_id = NULL, orders = 0, updated_at = NOW()
+        """)
+    conn.commit()
+
+
+def update_bundles(conn, full=False, batch_size=BUNDLE_ORDER_BATCH):
+    """Count orders placed since the last update and rescore the anchors they
+    touched. Returns the number of orders counted."""
+    ensure_bundle_tables(conn)
+    if full:
+        reset_counts(conn)
+    started = time.monotonic()
+    counted = 0
+    touched = {kind: set() for kind in KINDS}
+
+    while True:
+        items, watermark = next_orders(conn, batch_size)
+        if watermark is None:
+            break
+        last_created_at, last_order_id, n_orders = watermark
+        order_keys = np.array([order_id for order_id, _, _ in items], dtype=object)
+        product_keys = np.array([product_id for _, product_id, _ in items], dtype=object)
+        has_category = np.array([category_id is not None for _, _, category_id in items], dtype=bool)
+        category_keys = np.array([category_id for _, _, category_id in items], dtype=object)
+        with conn.cursor() as cur:
+            touched["product"].update(add_counts(cur, "product", order_keys, product_keys))
+            if has_category.any():
+                touched["category"].update(
+                    add_counts(cur, "category", order_keys[has_category], category_keys[has_category]))
+            cur.execute("""
+                UPDATE copurchase_watermark SET
+                    last_created_at = %s, last_order_id = %s, orders = orders + %s, updated_at = NOW()
+            """, (last_created_at, last_order_id, n_orders))
+        conn.commit()
+        counted += n_orders
+
+    if not counted:
+        return 0
+    written = {}
+    with conn.cursor() as cur:
+        for kind in KINDS:
+            anchors = sorted(touched[kind])
+            cur.execute("""
+                SELECT DISTINCT anchor FROM bundle_suggestions WHERE kind = %s AND item = ANY(%s)
+            """, (kind, anchors))
+            touched[kind].update(anchor for (anchor,) in cur.fetchall())
+            written[kind] = score_anchors(cur, kind, sorted(touched[kind]))
+    conn.commit()
+    log.info("bundles.done", "Bundles: counted {orders} new orders, rescored {products} products "
+             "({product_suggestions} suggestions) and {categories} categories "
+             "({category_suggestions} suggestions) in {seconds:.1f}s",
+             orders=counted, products=len(touched["product"]), product_suggestions=written["product"],
+             categories=len(touched["category"]), category_suggestions=written["category"],
+             seconds=time.monotonic() - started)
+    return counted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update co-purchase counts and precomputed bundles from orders")
+    parser.add_argument("--full", action="store_true", help="Recount every order from scratch")
+    args = parser.parse_args()
+    conn = get_connection()
+    update_bundles(conn, full=args.full)
+    conn.close()
@@ -0,0 +1,66 @@
+from sitemap import deepest_category
+from db import upsert_category
+from events import log
+
+CATEGORY_ICONS = {
+    "boat-engine":       "Ship",
+    "boat-engines":      "Ship",
+    "electronics":       "Monitor",
+    "navigation":        "Compass",
+    "safety":            "ShieldCheck",
+    "safety-equipment":  "ShieldCheck",
+    "deck-hardware":     "Anchor",
+    "deck":              "Anchor",
+    "hardware":          "Wrench",
+    "plumbing":          "Droplet",
+    "electrical":        "Zap",
+    "paint":             "Paintbrush",
+    "maintenance":       "Settings",
+    "cleaning":          "Sparkles",
+    "fishing":           "Fish",
+    "water-sports":      "Waves",
+    "clothing":          "Shirt",
+    "accessories":       "Package",
+    "lighting":          "Lightbulb",
+    "rigging":           "Cable",
+    "sails":             "Wind",
+    "trailer":           "Truck",
+    "fuel":              "Fuel",
+    "ventilation":       "Fan",
+    "comfort":           "Sofa",
+    "anchoring":         "Anchor",
+    "mooring":           "Anchor",
+}
+
+
+class CategoryResolver:
+    """Per-connection category id cache; upserts each category (with its icon) once."""
+
+    def __init__(self, conn, tree_index=None):
+        self.conn = conn
+        self.tree_index = tree_index
+        self.cache = {}
+
+    def id_for(self, cat, display_order=0):
+        if cat["slug"] not in self.cache:
+            icon = CATEGORY_ICONS.get(cat["slug"], "Package")
+            self.cache[cat["slug"]] = upsert_category(self.conn, cat["slug"], cat["name"], display_order, icon)
+        return self.cache[cat["slug"]]
+
+    def id_for_product(self, listed_in, data, display_order=0):
+        """The deepest category the product's breadcrumb reaches, else its listing's."""
+        cat = listed_in
+        if self.tree_index:
+            cat = deepest_category(self.tree_index, listed_in, data.get("categories", []))
+        return self.id_for(cat, display_order)
+
+
+def save_category_tree(conn, categories):
+    """Persist every menu category (parents included) with its parent link."""
+    db_ids = {}
+    for order, cat in enumerate(sorted(categories, key=lambda c: c["depth"])):
+        icon = CATEGORY_ICONS.get(cat["slug"], "Package")
+        db_ids[cat["id"]] = upsert_category(
+            conn, cat["slug"], cat["name"], order, icon, parent_id=db_ids.get(cat["parent_id"]),
+        )
+    log.info("categories.saved", "Saved category tree: {categories} categories", categories=len(db_ids))
@@ -0,0 +1,101 @@
+import json
+import select
+import argparse
+
+import psycopg2.extras
+from db import get_connection, ensure_tables
+from config import CHANGEFEED_RETENTION_DAYS
+
+# Consumer side of the product_changes outbox (filled by triggers, see
+# db.ensure_changefeed). Rows are read in (txid, seq) order and only from
+# transactions older than the oldest one still running, so a consumer that
+# resumes from its cursor never skips a change committed out of order. Cursors
+# are opaque "txid-seq" strings; "0-0" reads from the start.
+
+CHANNEL = "product_changes"
+START = "0-0"
+
+
+def parse_cursor(cursor):
+    txid, seq = (cursor or START).split("-")
+    return int(txid), int(seq)
+
+
+def read_changes(conn, after=START, limit=1000, fields=None):
+    """Up to `limit` changes after the cursor `after`. Returns (changes, cursor)."""
+    txid, seq = parse_cursor(after)
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            SELECT seq, txid::text, product_id, external_id, field, old_value, new_value, changed_at
+            FROM product_changes
+            WHERE (txid, seq) > (%(txid)s::text::xid8, %(seq)s)
+              AND txid < pg_snapshot_xmin(pg_current_snapshot())
+              AND (%(fields)s::text[] IS NULL OR field = ANY(%(fields)s::text[]))
+            ORDER BY txid, seq
+            LIMIT %(limit)s
+        """, {"txid": txid, "seq": seq, "fields": list(fields) if fields else None, "limit": limit})
+        changes = [dict(row) for row in cur.fetchall()]
+    conn.commit()
+    if changes:
+        after = f"{changes[-1]['txid']}-{changes[-1]['seq']}"
+    for change in changes:
+        del change["txid"]
+    return changes, after
+
+
+def price_drops(changes):
+    """The price changes in `changes` that lowered the price."""
+    return [
+        c for c in changes
+        if c["field"] == "price" and c["old_value"] is not None and c["new_value"] is not None
+        and float(c["new_value"]) < float(c["old_value"])
+    ]
+
+
+def follow(conn, after=START, fields=None, timeout=60):
+    """Yield (changes, cursor) batches forever, blocking on LISTEN between them."""
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {CHANNEL}")
+    while True:
+        changes, after = read_changes(conn, after, fields=fields)
+        if changes:
+            yield changes, after
+            continue
+        # Woken by the commit NOTIFY, or by the timeout to pick up changes held
+        # back behind a transaction that was still running at the last read
+        if select.select([conn], [], [], timeout) != ([], [], []):
+            conn.poll()
+            conn.notifies.clear()
+
+
+def prune_changes(conn, days=CHANGEFEED_RETENTION_DAYS):
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM product_changes WHERE changed_at < NOW() - make_interval(days => %s)
+        """, (days,))
+        pruned = cur.rowcount
+    conn.commit()
+    return pruned
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the product change feed as JSON lines")
+    parser.add_argument("--after", default=START, help="Cursor to resume from (default: the beginning)")
+    parser.add_argument("--field", action="append", choices=["price", "stock_status", "available", "images"],
+                        help="Only these fields (repeatable)")
+    parser.add_argument("--price-drops", action="store_true", help="Only price decreases")
+    parser.add_argument("--follow", action="store_true", help="Keep listening for new changes")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    ensure_tables(conn)
+    fields = ["price"] if args.price_drops else args.field
+    batches = follow(conn, args.after, fields) if args.follow else [read_changes(conn, args.after, fields=fields)]
+    for changes, cursor in batches:
+        if args.price_drops:
+            changes = price_drops(changes)
+        for change in changes:
+            print(json.dumps(change, default=str))
+        print(json.dumps({"cursor": cursor}), flush=True)
+    conn.close()
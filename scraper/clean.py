@@ -3,9 +3,15 @@ import html
 import argparse
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
+import psycopg2.extensions
 import requests
-from db import get_connection, ensure_tables
+from db import (
+    get_connection, ensure_tables, update_category_counts, refresh_search_vectors, set_bulk_load, column_type,
+)
+from events import log
+from config import LOG_FORMAT, BULK_LOAD
 
 
 def clean_html_entities(conn, dry_run=False):
@@ -37,7 +43,7 @@ def clean_html_entities(conn, dry_run=False):
 
     if not dry_run:
         conn.commit()
-    print(f"  [html] Cleaned {updated} products")
+    log.info("step.done", "  [html] Cleaned {count} products", step="html", count=updated)
     return updated
 
 
@@ -87,7 +93,7 @@ def clean_names(conn, dry_run=False):
 
     if not dry_run:
         conn.commit()
-    print(f"  [names] Normalized {updated} product names")
+    log.info("step.done", "  [names] Normalized {count} product names", step="names", count=updated)
     return updated
 
 
@@ -148,55 +154,78 @@ def deduplicate_products(conn, dry_run=False):
 
     if not dry_run:
         conn.commit()
-    print(f"  [dedup] Marked {dupes_removed} duplicate products as unavailable")
+    log.info("step.done", "  [dedup] Marked {count} duplicate products as unavailable", step="dedup",
+             count=dupes_removed)
     return dupes_removed
 
 
+def _clear_thumbnails(conn, ids):
+    """Null the thumbnails of `ids` and commit. A write that loses a deadlock to
+    a concurrent step is redone on its own; the checks behind it are kept."""
+    with conn.cursor() as cur:
+        id_type = column_type(cur, "products", "id")
+    for attempt in range(1, STEP_RETRIES + 1):
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"UPDATE products SET thumbnail = NULL WHERE id = ANY(%s::{id_type}[])", (ids,))
+            conn.commit()
+            return
+        except psycopg2.extensions.TransactionRollbackError:
+            conn.rollback()
+            if attempt == STEP_RETRIES:
+                raise
+            time.sleep(attempt)
+
+
 def validate_images(conn, dry_run=False, timeout=10, batch_size=50):
     with conn.cursor() as cur:
         cur.execute(
             "SELECT id, name, thumbnail FROM products WHERE available = TRUE AND thumbnail IS NOT NULL"
         )
         rows = cur.fetchall()
+    conn.commit()
 
     broken = 0
     checked = 0
+    # Broken ids are written in batches after the checks, so no row lock is
+    # held across the network-bound loop while other steps run in parallel
+    to_clear = []
     session = requests.Session()
     session.headers.update({
         "User-Agent": "YachtDrop-ImageValidator/1.0",
     })
 
+    progress = log.start_progress("images", total=len(rows))
     for pid, name, thumbnail in rows:
         checked += 1
-        if checked % 50 == 0:
-            print(f"    ... checked {checked}/{len(rows)} images")
 
         try:
             resp = session.head(thumbnail, timeout=timeout, allow_redirects=True)
             if resp.status_code >= 400:
                 broken += 1
-                print(f"    BROKEN ({resp.status_code}): {name[:50]} → {thumbnail[:80]}")
-                if not dry_run:
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            "UPDATE products SET thumbnail = NULL WHERE id = %s",
-                            (pid,),
-                        )
+                progress.error("images")
+                log.warning("image.broken", "    BROKEN ({status}): {name:.50} → {thumbnail:.80}",
+                            status=resp.status_code, name=name, thumbnail=thumbnail)
+                to_clear.append(pid)
         except requests.RequestException as e:
             broken += 1
-            print(f"    TIMEOUT: {name[:50]} → {str(e)[:60]}")
-            if not dry_run:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "UPDATE products SET thumbnail = NULL WHERE id = %s",
-                        (pid,),
-                    )
+            progress.error("images")
+            log.warning("image.timeout", "    TIMEOUT: {name:.50} → {error:.60}",
+                        name=name, thumbnail=thumbnail, error=str(e))
+            to_clear.append(pid)
+
+        if not dry_run and len(to_clear) >= batch_size:
+            _clear_thumbnails(conn, to_clear)
+            to_clear = []
 
+        progress.done("images")
         time.sleep(0.1)
 
-    if not dry_run:
-        conn.commit()
-    print(f"  [images] Checked {checked}, broken {broken}")
+    log.finish_progress()
+    if not dry_run and to_clear:
+        _clear_thumbnails(conn, to_clear)
+    log.info("step.done", "  [images] Checked {checked}, broken {count}", step="images", checked=checked,
+             count=broken)
     return broken
 
 
@@ -227,7 +256,7 @@ def standardize_categories(conn, dry_run=False):
                 continue
             src_id = cats[src_slug]["id"]
             merged += 1
-            print(f"    Merging '{src_slug}' → '{target_slug}'")
+            log.info("category.merge", "    Merging '{source}' → '{target}'", source=src_slug, target=target_slug)
 
             if not dry_run:
                 with conn.cursor() as cur:
@@ -239,7 +268,7 @@ def standardize_categories(conn, dry_run=False):
 
     if not dry_run:
         conn.commit()
-    print(f"  [categories] Merged {merged} duplicate categories")
+    log.info("step.done", "  [categories] Merged {count} duplicate categories", step="categories", count=merged)
     return merged
 
 
@@ -257,24 +286,18 @@ def flag_zero_price(conn, dry_run=False):
 
     if not dry_run:
         conn.commit()
-    print(f"  [zero-price] Flagged {count} zero/null-price products as unavailable")
+    log.info("step.done", "  [zero-price] Flagged {count} zero/null-price products as unavailable",
+             step="zero-price", count=count)
     return count
 
 
 def update_counts(conn, dry_run=False):
     if dry_run:
-        print("  [counts] Skipped (dry run)")
+        log.info("step.done", "  [counts] Skipped (dry run)", step="counts", count=0)
         return 0
-    with conn.cursor() as cur:
-        cur.execute("""
-            UPDATE categories c SET product_count = (
-                SELECT COUNT(*) FROM products p
-                WHERE p.category_id = c.id AND p.available = TRUE
-            )
-        """)
-    conn.commit()
-    print("  [counts] Updated category product counts")
-    return 0
+    updated = update_category_counts(conn)
+    log.info("step.done", "  [counts] Updated product counts for {count} categories", step="counts", count=updated)
+    return updated
 
 
 BRAND_ALIASES = {
@@ -307,21 +330,128 @@ def normalize_brands(conn, dry_run=False):
 
     if not dry_run:
         conn.commit()
-    print(f"  [brands] Normalized {updated} brand names")
+    log.info("step.done", "  [brands] Normalized {count} brand names", step="brands", count=updated)
     return updated
 
 
+# key -> (label, fn, dependencies). Steps whose dependencies have finished run
+# concurrently, each on its own connection. Steps that write the same columns
+# are chained so they keep their original relative order, and the image check
+# waits for dedup so it neither checks retired duplicates nor overlaps the
+# html/names/dedup chain's row locks.
 STEPS = {
-    "html":       ("Strip HTML entities", clean_html_entities),
-    "names":      ("Normalize names", clean_names),
-    "brands":     ("Normalize brands", normalize_brands),
-    "dedup":      ("Deduplicate products", deduplicate_products),
-    "images":     ("Validate images", validate_images),
-    "categories": ("Standardize categories", standardize_categories),
-    "zero-price": ("Flag zero-price", flag_zero_price),
-    "counts":     ("Update counts", update_counts),
+    "html":       ("Strip HTML entities", clean_html_entities, []),
+    "names":      ("Normalize names", clean_names, ["html"]),
+    "brands":     ("Normalize brands", normalize_brands, []),
+    "dedup":      ("Deduplicate products", deduplicate_products, ["names"]),
+    "images":     ("Validate images", validate_images, ["dedup"]),
+    "categories": ("Standardize categories", standardize_categories, []),
+    "zero-price": ("Flag zero-price", flag_zero_price, ["dedup"]),
+    "counts":     ("Update counts", update_counts,
+                   ["html", "names", "brands", "dedup", "images", "categories", "zero-price"]),
 }
 
+STEP_RETRIES = 3
+
+
+def run_step(key, dry_run=False):
+    """Run one step on a dedicated connection, retrying on deadlock/serialization
+    failures caused by a concurrently running step. Returns (result, seconds)."""
+    _, fn, _ = STEPS[key]
+    conn = get_connection()
+    started = time.monotonic()
+    try:
+        for attempt in range(1, STEP_RETRIES + 1):
+            try:
+                result = fn(conn, dry_run=dry_run)
+                return result, time.monotonic() - started
+            except psycopg2.extensions.TransactionRollbackError as e:
+                conn.rollback()
+                if attempt == STEP_RETRIES:
+                    raise
+                log.warning("step.retry", "  [{step}] Conflict with a concurrent step, retry {attempt}/{of}: {error}",
+                            step=key, attempt=attempt, of=STEP_RETRIES - 1, error=str(e))
+                time.sleep(attempt)
+    finally:
+        conn.close()
+
+
+def critical_path(keys, durations):
+    """Longest chain of dependent steps by duration — the lower bound on wall-clock time."""
+    best = {}
+
+    def visit(key):
+        if key not in best:
+            deps = [d for d in STEPS[key][2] if d in durations]
+            prev = max((visit(d) for d in deps), key=lambda p: p[0], default=(0.0, []))
+            best[key] = (prev[0] + durations[key], prev[1] + [key])
+        return best[key]
+
+    return max((visit(k) for k in keys if k in durations), key=lambda p: p[0], default=(0.0, []))
+
+
+def run_pipeline(keys, dry_run=False, jobs=4):
+    """Run the selected steps as a DAG: every step starts as soon as all of its
+    (selected) dependencies have finished. A failed step skips its dependents."""
+    pending = {k: {d for d in STEPS[k][2] if d in keys} for k in keys}
+    done, failed, skipped = set(), {}, []
+    timings = {}
+    pipeline_start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {}
+        while pending or running:
+            for key in [k for k, deps in pending.items() if deps & (set(failed) | set(skipped))]:
+                del pending[key]
+                skipped.append(key)
+                log.warning("step.skipped", "Skipping: {label} (dependency failed)", step=key, label=STEPS[key][0])
+
+            for key in [k for k, deps in pending.items() if deps <= done]:
+                del pending[key]
+                log.info("step.start", "Running: {label}", step=key, label=STEPS[key][0])
+                offset = time.monotonic() - pipeline_start
+                running[executor.submit(run_step, key, dry_run)] = (key, offset)
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Cyclic step dependencies: {sorted(pending)}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key, offset = running.pop(future)
+                try:
+                    _, seconds = future.result()
+                    timings[key] = (offset, seconds)
+                    done.add(key)
+                except Exception as e:
+                    failed[key] = e
+                    timings[key] = (offset, time.monotonic() - pipeline_start - offset)
+                    log.error("step.failed", "  [{step}] FAILED: {error}", step=key, error=str(e))
+
+    wall = time.monotonic() - pipeline_start
+    print_timing_summary(keys, timings, failed, skipped, wall)
+    return not failed
+
+
+def print_timing_summary(keys, timings, failed, skipped, wall):
+    log.info("pipeline.timings", "\nStep timings:")
+    for key in keys:
+        label = STEPS[key][0]
+        if key in skipped:
+            log.info("step.timing", "  {step:<12} {label:<26} skipped", step=key, label=label, status="skipped")
+            continue
+        offset, seconds = timings[key]
+        status = "FAILED" if key in failed else "ok"
+        log.info("step.timing", "  {step:<12} {label:<26} start +{offset:6.1f}s  took {seconds:7.1f}s  {status}",
+                 step=key, label=label, offset=offset, seconds=seconds, status=status)
+
+    durations = {k: t[1] for k, t in timings.items()}
+    path_seconds, path = critical_path(keys, durations)
+    log.info("pipeline.done", "  Wall clock {wall:.1f}s, sum of steps {total:.1f}s, "
+             "critical path {critical:.1f}s ({path})", wall=wall, total=sum(durations.values()),
+             critical=path_seconds, path=" → ".join(path))
+
 
 def main():
     parser = argparse.ArgumentParser(description="YachtDrop data cleaning pipeline")
@@ -336,28 +466,53 @@ def main():
         action="store_true",
         help="Skip image validation (slow network calls)",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Max steps to run concurrently (default: 4, 1 = sequential)",
+    )
+    parser.add_argument(
+        "--bulk-load",
+        action=argparse.BooleanOptionalAction,
+        default=BULK_LOAD,
+        help="Compute search vectors once after all steps instead of per updated row (default: on)",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=["text", "json"],
+        default=LOG_FORMAT,
+        help=f"Log lines as text or JSON (default: $LOG_FORMAT or {LOG_FORMAT})",
+    )
     args = parser.parse_args()
+    log.configure(fmt=args.log_format)
+    set_bulk_load(args.bulk_load and not args.dry_run)
 
     conn = get_connection()
     ensure_tables(conn)
+    conn.close()
 
-    print(f"{'DRY RUN — ' if args.dry_run else ''}Starting data cleaning pipeline\n")
+    log.info("pipeline.start", "{mode}Starting data cleaning pipeline\n",
+             mode="DRY RUN — " if args.dry_run else "", dry_run=args.dry_run)
 
     if args.step:
-        label, fn = STEPS[args.step]
-        print(f"Running: {label}")
-        fn(conn, dry_run=args.dry_run)
+        keys = [args.step]
     else:
-        for key, (label, fn) in STEPS.items():
-            if key == "images" and args.skip_images:
-                print(f"Skipping: {label}")
-                continue
-            print(f"Running: {label}")
-            fn(conn, dry_run=args.dry_run)
-            print()
-
-    conn.close()
-    print("\nCleaning complete.")
+        keys = list(STEPS.keys())
+        if args.skip_images:
+            log.info("step.skipped", "Skipping: {label}", step="images", label=STEPS["images"][0])
+            keys.remove("images")
+
+    ok = run_pipeline(keys, dry_run=args.dry_run, jobs=max(1, args.jobs))
+    if not args.dry_run:
+        conn = get_connection()
+        refreshed = refresh_search_vectors(conn)
+        conn.close()
+        if refreshed:
+            log.info("search.refreshed", "  [search] Recomputed search vectors for {count} products", count=refreshed)
+    if not ok:
+        raise SystemExit(1)
+    log.info("pipeline.complete", "\nCleaning complete.")
 
 
 if __name__ == "__main__":
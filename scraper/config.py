@@ -8,10 +8,115 @@ SITEMAP_URL = f"{BASE_URL}/1_en_0_sitemap.xml"
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 RATE_LIMIT_SECONDS = 3
+# Global budget for category listing pages, shared by all workers
+LISTING_REQUESTS_PER_SECOND = 2
+PAGINATION_WORKERS = 4
 MAX_RETRIES = 3
 REQUEST_TIMEOUT = 30
 BACKOFF_FACTOR = 2
 
+# Shared circuit breaker: a 429 or 403 pauses every worker for the cooldown
+# (doubling after each failed half-open probe, up to the max). After this many
+# blocked probes in a row the run is cancelled.
+BREAKER_RATE_LIMIT_SECONDS = 30
+BREAKER_BLOCK_SECONDS = 300
+BREAKER_MAX_SECONDS = 1800
+BREAKER_MAX_BLOCKED_PROBES = 3
+
+# Bulk-load mode for crawls, clean.py and load.py: search_vector is computed
+# once per run for the rows written instead of by a trigger on every write
+BULK_LOAD = os.getenv("BULK_LOAD", "1") != "0"
+
+# Raw-page archive (disabled unless ARCHIVE_DIR is set or --archive is passed)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+ARCHIVE_KEEP_RUNS = 7
+ARCHIVE_SEGMENT_BYTES = 64 * 1024 * 1024
+
+# Catalog snapshot for the web tier, published at the end of every run when
+# SNAPSHOT_DIR is set (or via snapshot.py)
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
+SNAPSHOT_KEEP = 5
+SNAPSHOT_LIST_SIZE = 12
+
+# "Similar products" (similar.py): neighbours kept per product, the lowest
+# cosine score worth keeping, products scored per matrix block, and how often
+# an incremental run turns into a full rescore (IDF weights drift in between)
+SIMILAR_TOP_K = 12
+SIMILAR_MIN_SCORE = 0.1
+SIMILAR_BLOCK_SIZE = 512
+SIMILAR_FULL_EVERY_DAYS = 7
+
+# Search autocomplete (autocomplete.py): longest indexed prefix, suggestions
+# kept per prefix, and the prefix lengths covered by the typo index
+AUTOCOMPLETE_PREFIX_MAX = 12
+AUTOCOMPLETE_SUGGESTIONS = 8
+AUTOCOMPLETE_TYPO_MIN = 4
+AUTOCOMPLETE_TYPO_MAX = 8
+
+# Co-purchase bundles (bundles.py): suggestions kept per anchor product or
+# category, orders a pair must share to count, orders counted per batch, how
+# old an order must be before it is counted (created_at is stamped when the
+# order's transaction starts, so younger ones may still be uncommitted), and
+# order statuses never counted
+BUNDLE_TOP_K = 6
+BUNDLE_MIN_PAIR_ORDERS = 2
+BUNDLE_ORDER_BATCH = 5000
+BUNDLE_SETTLE_SECONDS = 600
+BUNDLE_SKIP_STATUSES = ("CANCELLED",)
+
+# Days of product_changes (the change feed outbox) kept; pruned after each run
+CHANGEFEED_RETENTION_DAYS = 14
+
+# Local image derivatives (images.py), enabled when IMAGE_DIR is set: files are
+# stored content-addressed under IMAGE_DIR and served from IMAGE_BASE_URL
+IMAGE_DIR = os.getenv("IMAGE_DIR")
+IMAGE_BASE_URL = os.getenv("IMAGE_BASE_URL", "/images/products")
+IMAGE_WIDTHS = (320, 800)  # thumbnail, then the width used for `images`
+IMAGE_FORMATS = ("webp", "avif")
+IMAGE_QUALITY = 75
+IMAGE_DOWNLOAD_WORKERS = 4
+IMAGE_RESIZE_WORKERS = os.cpu_count() or 2
+
+# Price/stock history (product_price_history): monthly partitions created ahead
+# of time, and months kept row by row before history.py rolls them up to daily
+PRICE_HISTORY_MONTHS_AHEAD = 2
+PRICE_HISTORY_RAW_MONTHS = 6
+
+# Run log (events.py): "text" or "json" lines, the lowest level written, one
+# per-product line kept out of every LOG_SAMPLE_EVERY, seconds between progress
+# lines, and events buffered before new ones are dropped rather than waited on
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "10"))
+LOG_PROGRESS_SECONDS = 10
+LOG_QUEUE_SIZE = 10000
+
+# Distributed (--queue) mode: job lease length and attempts before a job fails
+JOB_LEASE_SECONDS = 120
+JOB_MAX_ATTEMPTS = 4
+
+# Demand-weighted refresh (--priority): (cumulative share of ranked products,
+# refresh interval in hours) per tier, and how far back order history counts
+REFRESH_TIERS = [(0.10, 6), (0.40, 24), (1.0, 72)]
+DEMAND_WINDOW_DAYS = 90
+REFRESH_BUDGET = 1000
+
+# Daemon (--daemon): per-product revisit interval bounds, adjusted after every
+# visit (shorter when the product changed, longer when it didn't)
+REVISIT_MIN_SECONDS = 2 * 3600
+REVISIT_MAX_SECONDS = 14 * 86400
+REVISIT_INITIAL_SECONDS = 86400
+REVISIT_CHANGED_FACTOR = 0.5
+REVISIT_UNCHANGED_FACTOR = 1.5
+DAEMON_MAX_REQUESTS_PER_SECOND = 0.5
+DAEMON_DISCOVERY_HOURS = 24
+# Discovery cycles a product may go unlisted before the daemon retires it
+DAEMON_RETIRE_AFTER_CYCLES = 3
+DAEMON_HEALTH_PORT = 8085
+
+# Products buffered per worker before a bulk upsert / last_seen_at update.
+INGEST_BATCH_SIZE = 100
+
 USER_AGENT = (
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
     "AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -0,0 +1,299 @@
+import json
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from product import scrape_product
+from sitemap import get_top_categories, get_product_urls_from_category, leaf_categories, breadcrumb_index
+from categories import CategoryResolver
+from ingest import ProductWriter
+from fetch import breaker, Cancelled, PermanentError
+from events import log
+from db import (
+    get_connection, ensure_tables, load_catalog_index, start_run, finish_run,
+    schedule_new_products, due_products, reschedule_products, visit_demand, mark_unavailable,
+    record_listings, record_run_scopes, retire_unlisted,
+)
+from config import (
+    REVISIT_MIN_SECONDS, REVISIT_MAX_SECONDS, REVISIT_INITIAL_SECONDS,
+    REVISIT_CHANGED_FACTOR, REVISIT_UNCHANGED_FACTOR,
+    DAEMON_MAX_REQUESTS_PER_SECOND, DAEMON_DISCOVERY_HOURS, DAEMON_RETIRE_AFTER_CYCLES, DAEMON_HEALTH_PORT,
+)
+
+VISIT_BATCH = 20
+
+
+def next_interval(current, changed):
+    """Multiplicative revisit schedule: halve after a change, stretch after a no-op visit."""
+    current = current or REVISIT_INITIAL_SECONDS
+    factor = REVISIT_CHANGED_FACTOR if changed else REVISIT_UNCHANGED_FACTOR
+    return int(min(REVISIT_MAX_SECONDS, max(REVISIT_MIN_SECONDS, current * factor)))
+
+
+class ScraperDaemon:
+    """Long-running scraper: revisits each product on its own adaptive schedule,
+    paced so requests are spread evenly over the day, and keeps crawling the leaf
+    listings to pick up new products and retire ones no longer listed. Stops
+    cleanly on SIGINT/SIGTERM."""
+
+    def __init__(self, health_port=DAEMON_HEALTH_PORT, max_requests_per_second=DAEMON_MAX_REQUESTS_PER_SECOND):
+        self.health_port = health_port
+        self.min_pace = 1.0 / max_requests_per_second
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.catalog_index = {}
+        self.run_id = None
+        self.stats = {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "visits": 0,
+            "changed": 0,
+            "gone": 0,
+            "unlisted": 0,
+            "discovered": 0,
+            "errors": 0,
+            "last_visit_at": None,
+            "last_loop_at": time.time(),
+            "pace_seconds": None,
+            "overdue": None,
+        }
+
+    def bump(self, **counts):
+        with self.lock:
+            for key, n in counts.items():
+                self.stats[key] += n
+
+    def request_stop(self, signum=None, frame=None):
+        log.info("daemon.stopping", "\nReceived signal {signal}, shutting down...", signal=signum)
+        self.stopping.set()
+        breaker.cancel()  # abandon in-flight requests
+
+    def pace(self, conn):
+        """Seconds between requests: the even spread implied by all revisit intervals,
+        sped up (to at most the max rate) while there's an overdue backlog to clear
+        within the hour."""
+        per_day, overdue = visit_demand(conn)
+        pace = 86400.0 / per_day if per_day else 60.0
+        if overdue:
+            pace = min(pace, 3600.0 / overdue)
+        pace = max(self.min_pace, pace)
+        with self.lock:
+            self.stats["pace_seconds"] = round(pace, 2)
+            self.stats["overdue"] = overdue
+        return pace
+
+    def visit_loop(self):
+        conn = get_connection()
+        writer = ProductWriter(conn, self.catalog_index)
+        try:
+            while not self.stopping.is_set():
+                with self.lock:
+                    self.stats["last_loop_at"] = time.time()
+                schedule_new_products(conn, REVISIT_INITIAL_SECONDS)
+                pace = self.pace(conn)
+                batch = due_products(conn, VISIT_BATCH)
+                if not batch:
+                    self.stopping.wait(min(60.0, pace))
+                    continue
+
+                intervals, gone = [], []
+                for external_id, url, category_id, interval in batch:
+                    if self.stopping.is_set():
+                        break
+                    started = time.monotonic()
+                    intervals.append((external_id, self.visit(writer, external_id, url, category_id, interval, gone)))
+                    self.stopping.wait(max(0.0, pace - (time.monotonic() - started)))
+
+                try:
+                    writer.flush()
+                except Exception as e:
+                    log.error("daemon.write_failed", "[daemon] ERROR writing batch: {error}", error=str(e))
+                    self.bump(errors=1)
+                reschedule_products(conn, intervals)
+                self.bump(gone=mark_unavailable(conn, gone))
+                self.forget(gone)
+        finally:
+            conn.close()
+
+    def visit(self, writer, external_id, url, category_id, interval, gone):
+        """Scrape one product and return its next revisit interval."""
+        try:
+            data = scrape_product(url, external_id)
+            changed = bool(data.get("price")) and writer.add(data, category_id)
+            self.bump(visits=1, changed=int(changed))
+            with self.lock:
+                self.stats["last_visit_at"] = datetime.now(timezone.utc).isoformat()
+            return next_interval(interval, changed)
+        except Cancelled:
+            # Shutting down, or the circuit breaker gave up on a persistent block
+            self.stopping.set()
+            return interval or REVISIT_INITIAL_SECONDS
+        except PermanentError as e:
+            if e.status in (404, 410):
+                # Availability is reconciled per product as soon as the page is gone
+                gone.append(external_id)
+                return REVISIT_MAX_SECONDS
+            self.bump(errors=1)
+            log.error("daemon.visit_failed", "[daemon] ERROR {url}: {error}", url=url, error=str(e))
+            return interval or REVISIT_INITIAL_SECONDS
+        except Exception as e:
+            writer.conn.rollback()
+            self.bump(errors=1)
+            # 429/403 also pause every fetch via the shared circuit breaker
+            log.error("daemon.visit_failed", "[daemon] ERROR {url}: {error}", url=url, error=str(e))
+            return interval or REVISIT_INITIAL_SECONDS
+
+    def forget(self, external_ids):
+        """Drop retired products' hashes so discovery scrapes them again if they
+        turn up in a listing."""
+        for external_id in external_ids:
+            if external_id in self.catalog_index:
+                self.catalog_index[external_id] = (self.catalog_index[external_id][0], None)
+
+    def discovery_loop(self):
+        """Read every leaf listing once per DAEMON_DISCOVERY_HOURS, spread evenly over
+        the cycle: ingest products we don't know (or had retired) and record what each
+        leaf lists. After each cycle, retire products no listing has shown for
+        DAEMON_RETIRE_AFTER_CYCLES cycles."""
+        cycle = DAEMON_DISCOVERY_HOURS * 3600
+        while not self.stopping.is_set():
+            cycle_started = time.monotonic()
+            conn = get_connection()
+            writer = ProductWriter(conn, self.catalog_index)
+            try:
+                tree = get_top_categories()
+                categories = CategoryResolver(conn, breadcrumb_index(tree))
+                leaves = leaf_categories(tree)
+                for n, cat in enumerate(leaves):
+                    if self.stopping.is_set():
+                        break
+                    self.discover(writer, categories, cat)
+                    self.stopping.wait(max(0.0, cycle_started + cycle * (n + 1) / len(leaves) - time.monotonic()))
+                if not self.stopping.is_set():
+                    retired = retire_unlisted(conn, self.run_id, DAEMON_RETIRE_AFTER_CYCLES * DAEMON_DISCOVERY_HOURS)
+                    self.forget(retired)
+                    self.bump(unlisted=len(retired))
+                    if retired:
+                        log.info("discovery.retired", "[discovery] Retired {count} products missing from every listing",
+                                 count=len(retired))
+            except Cancelled:
+                self.stopping.set()
+            except Exception as e:
+                log.error("discovery.failed", "[discovery] ERROR: {error}", error=str(e))
+                self.bump(errors=1)
+            finally:
+                conn.close()
+            self.stopping.wait(max(0.0, cycle_started + cycle - time.monotonic()))
+
+    def discover(self, writer, categories, cat):
+        """Read one leaf listing, record its membership and ingest the products
+        that are new or retired."""
+        conn = writer.conn
+        try:
+            failed_pages = []
+            urls = get_product_urls_from_category(cat["url"], failed_pages=failed_pages)
+            leaf_id = categories.id_for(cat)
+            record_listings(conn, self.run_id, [(leaf_id, external_id) for external_id, _ in urls])
+            # Only a completely read listing can vouch for what it doesn't show
+            if urls and not failed_pages:
+                record_run_scopes(conn, self.run_id, [leaf_id])
+            for external_id, url in urls:
+                known = self.catalog_index.get(external_id)
+                if self.stopping.is_set() or (known and known[1] is not None):
+                    continue
+                try:
+                    data = scrape_product(url, external_id)
+                    if data.get("price"):
+                        writer.add(data, categories.id_for_product(cat, data))
+                        self.bump(discovered=1)
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    conn.rollback()
+                    self.bump(errors=1)
+                    log.error("discovery.product_failed", "[discovery] ERROR {url}: {error}", url=url, error=str(e))
+                self.stopping.wait(self.min_pace)
+        except Cancelled:
+            raise
+        except Exception as e:
+            conn.rollback()
+            self.bump(errors=1)
+            log.error("discovery.listing_failed", "[discovery] ERROR {url}: {error}", url=cat["url"], error=str(e))
+        finally:
+            try:
+                writer.flush()
+            except Exception as e:
+                log.error("discovery.write_failed", "[discovery] ERROR writing batch: {error}", error=str(e))
+                self.bump(errors=1)
+
+    def health(self):
+        with self.lock:
+            stats = dict(self.stats)
+        # The visit loop wakes at least once a minute plus one request pace
+        stale_after = 120 + (stats["pace_seconds"] or 0) * (VISIT_BATCH + 1)
+        healthy = not self.stopping.is_set() and time.time() - stats["last_loop_at"] < stale_after
+        stats["status"] = "ok" if healthy else ("stopping" if self.stopping.is_set() else "stalled")
+        return healthy, stats
+
+    def serve_health(self):
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/health", "/healthz"):
+                    self.send_error(404)
+                    return
+                healthy, stats = daemon.health()
+                body = json.dumps(stats).encode("utf-8")
+                self.send_response(200 if healthy else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("", self.health_port), HealthHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGTERM, self.request_stop)
+
+        conn = get_connection()
+        ensure_tables(conn)
+        run_id = self.run_id = start_run(conn)
+        self.catalog_index.update(load_catalog_index(conn))
+        scheduled = schedule_new_products(conn, REVISIT_INITIAL_SECONDS)
+        log.info("daemon.start", "Daemon run started: {run_id} — {products} products, {scheduled} newly scheduled",
+                 run_id=run_id, products=len(self.catalog_index), scheduled=scheduled)
+
+        server = self.serve_health()
+        log.info("daemon.health", "Health endpoint on :{port}/healthz", port=self.health_port)
+
+        threads = [
+            threading.Thread(target=self.visit_loop, name="visits"),
+            threading.Thread(target=self.discovery_loop, name="discovery"),
+        ]
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=1)  # short joins keep the main thread responsive to signals
+            if not self.stopping.is_set() and not all(t.is_alive() for t in threads):
+                log.error("daemon.thread_died", "A daemon thread exited unexpectedly, shutting down")
+                self.stopping.set()
+
+        server.shutdown()
+        with self.lock:
+            visits, errors = self.stats["visits"] + self.stats["discovered"], self.stats["errors"]
+        finish_run(conn, run_id, visits, errors, "stopped")
+        conn.close()
+        log.info("daemon.stopped", "Daemon stopped. Visits: {visits}, Errors: {errors}", visits=visits, errors=errors)
+
+
+def run_daemon(health_port=DAEMON_HEALTH_PORT):
+    ScraperDaemon(health_port=health_port).run()
@@ -1,14 +1,32 @@
+import io
+import json
+import time
 import uuid
 import psycopg2
 import psycopg2.extras
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+from config import PRICE_HISTORY_MONTHS_AHEAD
 
 load_dotenv()
 
 
+# Bulk-load mode: connections opened while it is on flag rows search_vector_stale
+# (keeping their previous vector) instead of computing it per row (see the
+# defer_search_vector and search_vector_stale Prisma migrations);
+# refresh_search_vectors() recomputes the flagged rows before the run ends.
+_bulk_load = False
+
+
+def set_bulk_load(enabled):
+    global _bulk_load
+    _bulk_load = enabled
+
+
 def get_connection():
+    if _bulk_load:
+        return psycopg2.connect(os.getenv("DATABASE_URL"), options="-c yachtdrop.defer_search_vector=on")
     return psycopg2.connect(os.getenv("DATABASE_URL"))
 
 
@@ -64,6 +82,11 @@ def ensure_tables(conn):
             ("brand", "TEXT"),
             ("weight", "DECIMAL(8,3)"),
             ("tags", "TEXT[] DEFAULT '{}'"),
+            ("content_hash", "TEXT"),
+            ("price_stock_changes", "INT DEFAULT 0"),
+            ("revisit_interval", "INT"),
+            ("next_visit_at", "TIMESTAMPTZ"),
+            ("image_sources", "TEXT[]"),
         ]:
             cur.execute(f"""
                 DO $$ BEGIN
@@ -71,89 +94,504 @@ def ensure_tables(conn):
                 EXCEPTION WHEN duplicate_column THEN NULL;
                 END $$;
             """)
+        cur.execute("""
+            DO $$ BEGIN
+                ALTER TABLE scraper_runs ADD COLUMN stats JSONB;
+            EXCEPTION WHEN duplicate_column THEN NULL;
+            END $$;
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_next_visit
+            ON products (next_visit_at) WHERE source_url IS NOT NULL
+        """)
+        # categories.id is UUID when created here but TEXT under the Prisma schema
+        category_id_type = column_type(cur, "categories", "id")
+        cur.execute(f"""
+            DO $$ BEGIN
+                ALTER TABLE categories ADD COLUMN parent_id {category_id_type} REFERENCES categories(id);
+            EXCEPTION WHEN duplicate_column THEN NULL;
+            END $$;
+        """)
+        # Categories a run fully covered; only these are checked for stale products
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS scraper_run_scopes (
+                run_id TEXT NOT NULL,
+                category_id {category_id_type} NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+                covered_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (run_id, category_id)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_products_category_seen
+            ON products (category_id, last_seen_at) WHERE available = TRUE
+        """)
+        # The leaf listings each product was last found in, and by which run.
+        # products.category_id is the deepest breadcrumb category, which need not
+        # be a leaf that lists the product, so scoped retirement goes by these.
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS product_listings (
+                external_id TEXT NOT NULL,
+                category_id {category_id_type} NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+                run_id TEXT NOT NULL,
+                listed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (external_id, category_id)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_product_listings_category ON product_listings (category_id, run_id)")
+        ensure_changefeed(cur)
+        ensure_price_history(cur)
     conn.commit()
 
 
-def upsert_category(conn, slug, name, display_order=0):
+# Fields whose changes go to the product_changes outbox (see changefeed.py)
+CHANGEFEED_FIELDS = ("price", "stock_status", "available", "images")
+
+
+def ensure_changefeed(cur):
+    """Outbox of field-level product changes, filled by statement-level triggers
+    from the transition tables, so every write path (bulk upsert, COPY load,
+    soft delete) records its changes in its own transaction. Every transaction
+    that changed something sends one NOTIFY product_changes on commit."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS product_changes (
+            seq BIGSERIAL PRIMARY KEY,
+            product_id TEXT NOT NULL,
+            external_id TEXT,
+            field TEXT NOT NULL,
+            old_value JSONB,
+            new_value JSONB,
+            changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            txid XID8 NOT NULL DEFAULT pg_current_xact_id()
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_product_changes_txid ON product_changes (txid, seq)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_product_changes_product ON product_changes (product_id, seq)")
+    diffs = ",\n".join(f"('{f}', to_jsonb(o.{f}), to_jsonb(n.{f}))" for f in CHANGEFEED_FIELDS)
+    # Serialize concurrent workers replacing the function at startup
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('product_changes'))")
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION products_changefeed() RETURNS trigger AS $$
+        DECLARE
+            recorded BIGINT;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                WITH added AS (
+                    INSERT INTO product_changes (product_id, external_id, field, old_value, new_value)
+                    SELECT n.id::text, n.external_id, 'available', NULL, to_jsonb(n.available)
+                    FROM new_rows n
+                    RETURNING 1
+                )
+                SELECT count(*) INTO recorded FROM added;
+            ELSE
+                WITH changed AS (
+                    INSERT INTO product_changes (product_id, external_id, field, old_value, new_value)
+                    SELECT n.id::text, n.external_id, d.field, d.old_value, d.new_value
+                    FROM new_rows n
+                    JOIN old_rows o ON o.id = n.id
+                    CROSS JOIN LATERAL (VALUES {diffs}) AS d(field, old_value, new_value)
+                    WHERE d.old_value IS DISTINCT FROM d.new_value
+                    RETURNING 1
+                )
+                SELECT count(*) INTO recorded FROM changed;
+            END IF;
+            IF recorded > 0 THEN
+                -- Identical notifications are folded into one per transaction
+                PERFORM pg_notify('product_changes', '');
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    cur.execute("""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'products_changefeed_insert') THEN
+                CREATE TRIGGER products_changefeed_insert AFTER INSERT ON products
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION products_changefeed();
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'products_changefeed_update') THEN
+                CREATE TRIGGER products_changefeed_update AFTER UPDATE ON products
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION products_changefeed();
+            END IF;
+        END $$;
+    """)
+
+
+def ensure_price_history(cur, months_ahead=PRICE_HISTORY_MONTHS_AHEAD):
+    """Append-only price/stock history, range-partitioned by month. Rows come from
+    statement-level triggers: one per product when it is first inserted and one
+    whenever price, original_price or stock_status actually changes, written in
+    one INSERT per upsert batch. When the table is first created it is seeded with
+    one row per existing product, so their history starts now rather than at their
+    next change. Old months are rolled up into product_price_daily by history.py."""
+    id_type = column_type(cur, "products", "id")
+    cur.execute("SELECT to_regclass('product_price_history') IS NULL")
+    created = cur.fetchone()[0]
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS product_price_history (
+            product_id {id_type} NOT NULL,
+            recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            price DECIMAL(10,2),
+            original_price DECIMAL(10,2),
+            stock_status TEXT
+        ) PARTITION BY RANGE (recorded_at)
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS product_price_history_default
+        PARTITION OF product_price_history DEFAULT
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_price_history_product
+        ON product_price_history (product_id, recorded_at)
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_price_history_recorded ON product_price_history (recorded_at)")
+    ensure_history_partitions(cur, months_ahead)
+    if created:
+        cur.execute("""
+            INSERT INTO product_price_history (product_id, price, original_price, stock_status)
+            SELECT id, price, original_price, stock_status FROM products
+        """)
+    # Months older than PRICE_HISTORY_RAW_MONTHS, one row per product per day
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS product_price_daily (
+            product_id {id_type} NOT NULL,
+            day DATE NOT NULL,
+            open_price DECIMAL(10,2),
+            low_price DECIMAL(10,2),
+            high_price DECIMAL(10,2),
+            close_price DECIMAL(10,2),
+            close_original_price DECIMAL(10,2),
+            close_stock_status TEXT,
+            changes INT NOT NULL,
+            PRIMARY KEY (product_id, day)
+        )
+    """)
+    # Tables created before the key followed products.id were TEXT
+    if column_type(cur, "product_price_daily", "product_id") != id_type:
+        cur.execute(f"ALTER TABLE product_price_daily ALTER COLUMN product_id TYPE {id_type} USING product_id::{id_type}")
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION products_price_history() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO product_price_history (product_id, price, original_price, stock_status)
+                SELECT n.id, n.price, n.original_price, n.stock_status FROM new_rows n;
+            ELSE
+                INSERT INTO product_price_history (product_id, price, original_price, stock_status)
+                SELECT n.id, n.price, n.original_price, n.stock_status
+                FROM new_rows n
+                JOIN old_rows o ON o.id = n.id
+                WHERE (n.price, n.original_price, n.stock_status)
+                      IS DISTINCT FROM (o.price, o.original_price, o.stock_status);
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """)
+    cur.execute("""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'products_price_history_insert') THEN
+                CREATE TRIGGER products_price_history_insert AFTER INSERT ON products
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION products_price_history();
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'products_price_history_update') THEN
+                CREATE TRIGGER products_price_history_update AFTER UPDATE ON products
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION products_price_history();
+            END IF;
+        END $$;
+    """)
+
+
+def ensure_history_partitions(cur, months_ahead=PRICE_HISTORY_MONTHS_AHEAD):
+    """Monthly partitions from this month to `months_ahead` months out. Rows for a
+    month without a partition land in the default partition."""
+    today = datetime.now(timezone.utc)
+    for i in range(months_ahead + 1):
+        year, month = divmod(today.month - 1 + i, 12)
+        start = datetime(today.year + year, month + 1, 1)
+        year, month = divmod(start.month, 12)
+        end = datetime(start.year + year, month + 1, 1)
+        cur.execute(f"""
+            DO $$ BEGIN
+                CREATE TABLE IF NOT EXISTS product_price_history_{start:%Y%m}
+                PARTITION OF product_price_history
+                FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}');
+            EXCEPTION WHEN check_violation THEN
+                -- the default partition already holds rows for this month
+                NULL;
+            END $$;
+        """)
+
+
+def column_type(cur, table, column):
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cur.fetchone()[0]
+
+
+def upsert_category(conn, slug, name, display_order=0, icon=None, parent_id=None):
     with conn.cursor() as cur:
         cur.execute("""
-            INSERT INTO categories (id, slug, name, display_order)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (slug) DO UPDATE SET name = EXCLUDED.name
+            INSERT INTO categories (id, slug, name, display_order, icon, parent_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (slug) DO UPDATE SET
+                name = EXCLUDED.name,
+                icon = COALESCE(EXCLUDED.icon, categories.icon),
+                parent_id = COALESCE(EXCLUDED.parent_id, categories.parent_id)
             RETURNING id
-        """, (str(uuid.uuid4()), slug, name, display_order))
+        """, (str(uuid.uuid4()), slug, name, display_order, icon, parent_id))
         conn.commit()
         return cur.fetchone()[0]
 
 
-def upsert_product(conn, data, category_id=None):
+# Scraped-record fields _product_values() writes
+PRODUCT_FIELDS = (
+    "external_id", "sku", "name", "slug", "description", "short_desc",
+    "price", "original_price", "discount_percent", "currency",
+    "stock_status", "images", "thumbnail", "available", "source_url",
+    "brand", "weight", "tags",
+)
+
+PRODUCT_COLUMNS = """
+    id, external_id, sku, name, slug, description, short_desc,
+    price, original_price, discount_percent, currency,
+    stock_status, category_id, images, thumbnail,
+    available, source_url, brand, weight, tags, content_hash,
+    scraped_at, last_seen_at
+"""
+
+# One placeholder per _product_values() field; scraped_at/last_seen_at are NOW().
+PRODUCT_VALUES_TEMPLATE = "(" + ", ".join(["%s"] * 21) + ", NOW(), NOW())"
+
+# images/thumbnail keep their local variants (images.py) while the scraped
+# supplier URLs match the image_sources they were derived from.
+PRODUCT_CONFLICT_UPDATE = """
+    ON CONFLICT (external_id) DO UPDATE SET
+        name = EXCLUDED.name,
+        sku = EXCLUDED.sku,
+        slug = EXCLUDED.slug,
+        description = EXCLUDED.description,
+        short_desc = EXCLUDED.short_desc,
+        price = EXCLUDED.price,
+        original_price = EXCLUDED.original_price,
+        discount_percent = EXCLUDED.discount_percent,
+        stock_status = EXCLUDED.stock_status,
+        category_id = EXCLUDED.category_id,
+        images = CASE WHEN products.image_sources = EXCLUDED.images
+                      THEN products.images ELSE EXCLUDED.images END,
+        thumbnail = CASE WHEN products.image_sources = EXCLUDED.images
+                         THEN products.thumbnail ELSE EXCLUDED.thumbnail END,
+        available = EXCLUDED.available,
+        source_url = EXCLUDED.source_url,
+        brand = EXCLUDED.brand,
+        weight = EXCLUDED.weight,
+        tags = EXCLUDED.tags,
+        content_hash = EXCLUDED.content_hash,
+        price_stock_changes = COALESCE(products.price_stock_changes, 0) + (
+            products.price IS DISTINCT FROM EXCLUDED.price
+            OR products.stock_status IS DISTINCT FROM EXCLUDED.stock_status
+        )::int,
+        scraped_at = NOW(),
+        last_seen_at = NOW()
+"""
+
+
+def _product_values(data, category_id, content_hash):
+    return (
+        str(uuid.uuid4()), data["external_id"], data.get("sku"),
+        data["name"], data["slug"],
+        data.get("description"), data.get("short_desc"),
+        data.get("price", 0), data.get("original_price"),
+        data.get("discount_percent"), data.get("currency", "EUR"),
+        data.get("stock_status", "IN_STOCK"), category_id,
+        data.get("images", []), data.get("thumbnail"),
+        data.get("available", True), data.get("source_url"),
+        data.get("brand"), data.get("weight"), data.get("tags", []),
+        content_hash,
+    )
+
+
+def upsert_product(conn, data, category_id=None, content_hash=None):
     with conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO products (
-                id, external_id, sku, name, slug, description, short_desc,
-                price, original_price, discount_percent, currency,
-                stock_status, category_id, images, thumbnail,
-                available, source_url, brand, weight, tags,
-                scraped_at, last_seen_at
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s,
-                %s, %s, %s, %s,
-                %s, %s, %s, %s,
-                %s, %s, %s, %s, %s,
-                NOW(), NOW()
-            )
-            ON CONFLICT (external_id) DO UPDATE SET
-                name = EXCLUDED.name,
-                sku = EXCLUDED.sku,
-                slug = EXCLUDED.slug,
-                description = EXCLUDED.description,
-                short_desc = EXCLUDED.short_desc,
-                price = EXCLUDED.price,
-                original_price = EXCLUDED.original_price,
-                discount_percent = EXCLUDED.discount_percent,
-                stock_status = EXCLUDED.stock_status,
-                category_id = EXCLUDED.category_id,
-                images = EXCLUDED.images,
-                thumbnail = EXCLUDED.thumbnail,
-                available = EXCLUDED.available,
-                source_url = EXCLUDED.source_url,
-                brand = EXCLUDED.brand,
-                weight = EXCLUDED.weight,
-                tags = EXCLUDED.tags,
-                scraped_at = NOW(),
-                last_seen_at = NOW()
+        cur.execute(f"""
+            INSERT INTO products ({PRODUCT_COLUMNS})
+            VALUES {PRODUCT_VALUES_TEMPLATE}
+            {PRODUCT_CONFLICT_UPDATE}
             RETURNING id
-        """, (
-            str(uuid.uuid4()), data["external_id"], data.get("sku"),
-            data["name"], data["slug"],
-            data.get("description"), data.get("short_desc"),
-            data.get("price", 0), data.get("original_price"),
-            data.get("discount_percent"), data.get("currency", "EUR"),
-            data.get("stock_status", "IN_STOCK"), category_id,
-            data.get("images", []), data.get("thumbnail"),
-            data.get("available", True), data.get("source_url"),
-            data.get("brand"), data.get("weight"), data.get("tags", []),
-        ))
+        """, _product_values(data, category_id, content_hash))
         conn.commit()
         return cur.fetchone()[0]
 
 
-def update_category_counts(conn):
+def upsert_products(conn, rows):
+    """Bulk upsert of (data, category_id, content_hash) tuples in one statement.
+    Returns {external_id: id} for the written rows."""
+    if not rows:
+        return {}
+    # ON CONFLICT can't touch the same row twice in one statement — keep the last.
+    latest = {data["external_id"]: (data, cid, h) for data, cid, h in rows}
+    with conn.cursor() as cur:
+        written = psycopg2.extras.execute_values(cur, f"""
+            INSERT INTO products ({PRODUCT_COLUMNS})
+            VALUES %s
+            {PRODUCT_CONFLICT_UPDATE}
+            RETURNING external_id, id
+        """, [_product_values(*r) for r in latest.values()],
+            template=PRODUCT_VALUES_TEMPLATE,
+            page_size=len(latest), fetch=True)
+    conn.commit()
+    return dict(written)
+
+
+def copy_products(conn, rows):
+    """Bulk load of (data, category_id, content_hash) tuples: COPY into a JSONB
+    staging table, then one INSERT ... SELECT with the usual upsert. For
+    exported files, where batches run to thousands of rows. Returns rows written."""
+    if not rows:
+        return 0
+    buf = io.StringIO()
+    for data, category_id, content_hash in rows:
+        doc = {field: data.get(field) for field in PRODUCT_FIELDS}
+        doc["category_id"] = str(category_id) if category_id else None
+        doc["content_hash"] = content_hash
+        # COPY text format: only backslashes need escaping in json.dumps output
+        buf.write(json.dumps(doc, default=str).replace("\\", "\\\\") + "\n")
+    buf.seek(0)
     with conn.cursor() as cur:
+        id_type = column_type(cur, "products", "id")
+        category_id_type = column_type(cur, "products", "category_id")
         cur.execute("""
-            UPDATE categories c SET product_count = (
-                SELECT COUNT(*) FROM products p
-                WHERE p.category_id = c.id AND p.available = TRUE
+            CREATE TEMP TABLE IF NOT EXISTS products_staging (
+                n BIGSERIAL, doc JSONB NOT NULL
+            ) ON COMMIT DELETE ROWS
+        """)
+        cur.copy_expert("COPY products_staging (doc) FROM STDIN", buf)
+        cur.execute(f"""
+            INSERT INTO products ({PRODUCT_COLUMNS})
+            SELECT DISTINCT ON (doc->>'external_id')
+                gen_random_uuid()::text::{id_type}, doc->>'external_id', doc->>'sku',
+                doc->>'name', doc->>'slug',
+                doc->>'description', doc->>'short_desc',
+                COALESCE((doc->>'price')::numeric, 0), (doc->>'original_price')::numeric,
+                (doc->>'discount_percent')::int, COALESCE(doc->>'currency', 'EUR'),
+                COALESCE(doc->>'stock_status', 'IN_STOCK'), (doc->>'category_id')::{category_id_type},
+                ARRAY(SELECT jsonb_array_elements_text(COALESCE(doc->'images', '[]'))), doc->>'thumbnail',
+                COALESCE((doc->>'available')::boolean, TRUE), doc->>'source_url',
+                doc->>'brand', (doc->>'weight')::numeric,
+                ARRAY(SELECT jsonb_array_elements_text(COALESCE(doc->'tags', '[]'))),
+                doc->>'content_hash',
+                NOW(), NOW()
+            FROM products_staging
+            ORDER BY doc->>'external_id', n DESC
+            {PRODUCT_CONFLICT_UPDATE}
+        """)
+        written = cur.rowcount
+    conn.commit()
+    return written
+
+
+def load_catalog_index(conn):
+    """external_id -> (id, content_hash) for every known product."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT external_id, id, content_hash FROM products WHERE external_id IS NOT NULL")
+        return {ext_id: (pid, h) for ext_id, pid, h in cur.fetchall()}
+
+
+def fetch_products(conn, external_ids, columns):
+    """external_id -> {column: value} for the stored rows among external_ids."""
+    if not external_ids:
+        return {}
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT external_id, {", ".join(columns)} FROM products
+            WHERE external_id = ANY(%s)
+        """, (list(external_ids),))
+        return {row.pop("external_id"): row for row in cur.fetchall()}
+
+
+def update_reparsed_products(conn, rows):
+    """Rewrite the parsed fields of available products from (data, content_hash)
+    pairs re-parsed offline. Availability, category and the seen/scraped
+    timestamps belong to live crawls and are left alone, so soft-deleted
+    products stay retired. Returns rows updated."""
+    if not rows:
+        return 0
+    latest = {data["external_id"]: (data, h) for data, h in rows}
+    with conn.cursor() as cur:
+        psycopg2.extras.execute_values(cur, """
+            UPDATE products p SET
+                sku = v.sku, name = v.name, slug = v.slug, description = v.description,
+                short_desc = v.short_desc, price = v.price, original_price = v.original_price,
+                discount_percent = v.discount_percent, currency = v.currency,
+                stock_status = v.stock_status,
+                images = CASE WHEN p.image_sources = v.images THEN p.images ELSE v.images END,
+                thumbnail = CASE WHEN p.image_sources = v.images THEN p.thumbnail ELSE v.thumbnail END,
+                source_url = v.source_url, brand = v.brand, weight = v.weight, tags = v.tags,
+                content_hash = v.content_hash
+            FROM (VALUES %s) AS v(
+                external_id, sku, name, slug, description, short_desc, price, original_price,
+                discount_percent, currency, stock_status, images, thumbnail,
+                source_url, brand, weight, tags, content_hash
+            )
+            WHERE p.external_id = v.external_id AND p.available = TRUE
+        """, [
+            (
+                ext_id, data.get("sku"), data["name"], data["slug"],
+                data.get("description"), data.get("short_desc"),
+                data.get("price", 0), data.get("original_price"),
+                data.get("discount_percent"), data.get("currency", "EUR"),
+                data.get("stock_status", "IN_STOCK"), data.get("images", []), data.get("thumbnail"),
+                data.get("source_url"), data.get("brand"), data.get("weight"), data.get("tags", []),
+                h,
             )
+            for ext_id, (data, h) in latest.items()
+        ], template="(%s, %s, %s, %s, %s, %s, %s::numeric, %s::numeric, %s::int, %s, %s, "
+                    "%s::text[], %s, %s, %s, %s::numeric, %s::text[], %s)", page_size=len(latest))
+        updated = cur.rowcount
+    conn.commit()
+    return updated
+
+
+def touch_products(conn, external_ids):
+    """Mark unchanged products as seen without rewriting (or re-indexing) the row."""
+    if not external_ids:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE products SET last_seen_at = NOW()
+            WHERE external_id = ANY(%s)
+        """, (list(external_ids),))
+        touched = cur.rowcount
+    conn.commit()
+    return touched
+
+
+def update_category_counts(conn):
+    """Recount available products per category in one aggregate pass, only
+    writing categories whose count actually changed."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE categories c SET product_count = s.n
+            FROM (
+                SELECT c2.id, COUNT(p.id) AS n
+                FROM categories c2
+                LEFT JOIN products p ON p.category_id = c2.id AND p.available = TRUE
+                GROUP BY c2.id
+            ) s
+            WHERE s.id = c.id AND c.product_count IS DISTINCT FROM s.n
         """)
+        updated = cur.rowcount
     conn.commit()
+    return updated
 
 
 def soft_delete_unseen(conn, run_started_at):
     with conn.cursor() as cur:
         cur.execute("""
             UPDATE products
-            SET available = FALSE
+            SET available = FALSE, content_hash = NULL
             WHERE last_seen_at < %s AND available = TRUE
             RETURNING id, name
         """, (run_started_at,))
@@ -162,20 +600,246 @@ def soft_delete_unseen(conn, run_started_at):
     return stale
 
 
-def update_category_image(conn, category_id, image_url):
+def record_listings(conn, run_id, listings):
+    """Record (category_id, external_id) pairs a run found in leaf listings."""
+    if not listings:
+        return 0
+    with conn.cursor() as cur:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO product_listings (category_id, external_id, run_id) VALUES %s
+            ON CONFLICT (external_id, category_id) DO UPDATE SET
+                run_id = EXCLUDED.run_id,
+                listed_at = NOW()
+        """, [(str(category_id), external_id, str(run_id)) for category_id, external_id in set(listings)],
+            page_size=1000)
+    conn.commit()
+    return len(listings)
+
+
+def record_run_scopes(conn, run_id, category_ids, unfinished_external_ids=()):
+    """Record the categories a run fully listed and scraped. A category whose
+    listing in this run held any product the run failed to (or chose not to)
+    scrape is left out, since that product would otherwise look stale. Returns
+    the number of scopes recorded."""
+    if not category_ids:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO scraper_run_scopes (run_id, category_id)
+            SELECT %(run)s, c.id FROM categories c
+            WHERE c.id::text = ANY(%(categories)s)
+              AND NOT EXISTS (
+                  SELECT 1 FROM product_listings l
+                  WHERE l.category_id = c.id AND l.run_id = %(run)s AND l.external_id = ANY(%(unfinished)s)
+              )
+            ON CONFLICT (run_id, category_id) DO UPDATE SET covered_at = EXCLUDED.covered_at
+        """, {"run": str(run_id), "categories": [str(c) for c in category_ids],
+              "unfinished": list(unfinished_external_ids)})
+        recorded = cur.rowcount
+    conn.commit()
+    return recorded
+
+
+def soft_delete_unseen_in_scopes(conn, run_id, run_started_at):
+    """soft_delete_unseen limited to products whose known listings all lie in the
+    categories recorded for run_id and that the run did not list there. Products
+    with no recorded listing are left to a full run. The run's listing then
+    replaces the membership of its covered categories."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            WITH scope AS (SELECT category_id FROM scraper_run_scopes WHERE run_id = %(run)s)
+            UPDATE products p
+            SET available = FALSE, content_hash = NULL
+            WHERE p.available = TRUE AND p.last_seen_at < %(started)s
+              AND EXISTS (
+                  SELECT 1 FROM product_listings l
+                  WHERE l.external_id = p.external_id AND l.category_id IN (SELECT category_id FROM scope)
+              )
+              AND NOT EXISTS (
+                  SELECT 1 FROM product_listings l
+                  WHERE l.external_id = p.external_id
+                    AND (l.run_id = %(run)s OR l.category_id NOT IN (SELECT category_id FROM scope))
+              )
+            RETURNING p.id, p.name
+        """, {"run": str(run_id), "started": run_started_at})
+        stale = cur.fetchall()
+        cur.execute("""
+            DELETE FROM product_listings l
+            USING scraper_run_scopes s
+            WHERE s.run_id = %(run)s AND l.category_id = s.category_id AND l.run_id <> %(run)s
+        """, {"run": str(run_id)})
+    conn.commit()
+    return stale
+
+
+def prune_listings(conn, run_id):
+    """After a full run, drop every listing it did not see again."""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM product_listings WHERE run_id <> %s", (str(run_id),))
+        pruned = cur.rowcount
+    conn.commit()
+    return pruned
+
+
+def fill_category_images(conn):
+    """Give every category without an image the thumbnail of its most recently
+    scraped available product — one statement per run instead of per product."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE categories c SET image_url = p.thumbnail
+            FROM (
+                SELECT DISTINCT ON (category_id) category_id, thumbnail
+                FROM products
+                WHERE available = TRUE AND thumbnail IS NOT NULL AND category_id IS NOT NULL
+                ORDER BY category_id, scraped_at DESC
+            ) p
+            WHERE p.category_id = c.id AND c.image_url IS NULL
+        """)
+        updated = cur.rowcount
+    conn.commit()
+    return updated
+
+
+# Materialized views behind the web's listing routes (see the
+# add_listing_summaries Prisma migration); each has a unique index so it can be
+# refreshed CONCURRENTLY without blocking readers.
+SUMMARY_VIEWS = ("product_listing_trending", "product_listing_offers", "category_top_products")
+
+
+def refresh_summary_views(conn):
+    """Refresh every summary view that exists. Returns {view: milliseconds}."""
+    timings = {}
+    with conn.cursor() as cur:
+        for view in SUMMARY_VIEWS:
+            cur.execute("SELECT to_regclass(%s)", (view,))
+            if cur.fetchone()[0] is None:
+                continue
+            started = time.monotonic()
+            cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+            conn.commit()
+            timings[view] = round((time.monotonic() - started) * 1000)
+    return timings
+
+
+def refresh_search_vectors(conn):
+    """Recompute search_vector for every row a bulk load flagged stale (including
+    rows left over by a run that died first), in a single UPDATE. Returns the rows
+    updated."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'products'
+              AND column_name = 'search_vector_stale'
+        """)
+        if cur.fetchone() is None:
+            return 0
+        cur.execute("""
+            UPDATE products SET
+                search_vector = products_search_vector(name, brand, short_desc, sku, tags),
+                search_vector_stale = FALSE
+            WHERE search_vector_stale
+        """)
+        updated = cur.rowcount
+    conn.commit()
+    return updated
+
+
+def schedule_new_products(conn, initial_seconds):
+    """Give unscheduled products a revisit interval and a first visit spread
+    randomly over that interval, so a batch of new products isn't one burst."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE products SET
+                revisit_interval = %s,
+                next_visit_at = NOW() + random() * make_interval(secs => %s)
+            WHERE next_visit_at IS NULL AND source_url IS NOT NULL
+        """, (initial_seconds, initial_seconds))
+        scheduled = cur.rowcount
+    conn.commit()
+    return scheduled
+
+
+def due_products(conn, limit):
+    """(external_id, source_url, category_id, revisit_interval) of the most overdue
+    available products. Retired ones only come back through a listing."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT external_id, source_url, category_id, revisit_interval
+            FROM products
+            WHERE next_visit_at <= NOW() AND source_url IS NOT NULL AND available = TRUE
+            ORDER BY next_visit_at
+            LIMIT %s
+        """, (limit,))
+        return cur.fetchall()
+
+
+def reschedule_products(conn, intervals):
+    """Apply (external_id, revisit_interval_seconds) pairs and set the next visit."""
+    if not intervals:
+        return 0
+    with conn.cursor() as cur:
+        psycopg2.extras.execute_values(cur, """
+            UPDATE products p SET
+                revisit_interval = v.seconds,
+                next_visit_at = NOW() + make_interval(secs => v.seconds)
+            FROM (VALUES %s) AS v(external_id, seconds)
+            WHERE p.external_id = v.external_id
+        """, intervals)
+        updated = cur.rowcount
+    conn.commit()
+    return updated
+
+
+def visit_demand(conn):
+    """(visits per day implied by all revisit intervals, products overdue now)."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT COALESCE(SUM(86400.0 / NULLIF(revisit_interval, 0)), 0),
+                   COUNT(*) FILTER (WHERE next_visit_at <= NOW())
+            FROM products
+            WHERE next_visit_at IS NOT NULL AND source_url IS NOT NULL AND available = TRUE
+        """)
+        per_day, overdue = cur.fetchone()
+    return float(per_day), overdue
+
+
+def mark_unavailable(conn, external_ids):
+    """Retire products the site no longer serves (404/410) right away."""
+    if not external_ids:
+        return 0
     with conn.cursor() as cur:
         cur.execute("""
-            UPDATE categories SET image_url = %s WHERE id = %s AND image_url IS NULL
-        """, (image_url, str(category_id)))
+            UPDATE products SET available = FALSE, content_hash = NULL
+            WHERE external_id = ANY(%s) AND available = TRUE
+        """, (list(external_ids),))
+        updated = cur.rowcount
     conn.commit()
+    return updated
 
 
-def set_category_icon(conn, slug, icon_name):
+def retire_unlisted(conn, run_id, hours):
+    """Retire available products no listing has shown for `hours`, provided every
+    leaf they were last listed in has been read completely by run_id within that
+    time (so a failing listing retires nothing). Returns their external ids."""
     with conn.cursor() as cur:
         cur.execute("""
-            UPDATE categories SET icon = %s WHERE slug = %s
-        """, (icon_name, slug))
+            UPDATE products p
+            SET available = FALSE, content_hash = NULL
+            WHERE p.available = TRUE
+              AND EXISTS (SELECT 1 FROM product_listings l WHERE l.external_id = p.external_id)
+              AND NOT EXISTS (
+                  SELECT 1 FROM product_listings l
+                  LEFT JOIN scraper_run_scopes s ON s.run_id = %(run)s AND s.category_id = l.category_id
+                  WHERE l.external_id = p.external_id
+                    AND (l.listed_at >= NOW() - make_interval(hours => %(hours)s)
+                         OR s.covered_at IS NULL
+                         OR s.covered_at < NOW() - make_interval(hours => %(hours)s))
+              )
+            RETURNING p.external_id
+        """, {"run": str(run_id), "hours": hours})
+        retired = [row[0] for row in cur.fetchall()]
     conn.commit()
+    return retired
 
 
 def start_run(conn):
@@ -188,14 +852,16 @@ def start_run(conn):
         return cur.fetchone()[0]
 
 
-def finish_run(conn, run_id, products_scraped, errors, status="completed"):
+def finish_run(conn, run_id, products_scraped, errors, status="completed", stats=None):
     with conn.cursor() as cur:
         cur.execute("""
             UPDATE scraper_runs SET
                 finished_at = NOW(),
                 products_scraped = %s,
                 errors = %s,
-                status = %s
+                status = %s,
+                stats = COALESCE(%s, stats)
             WHERE id = %s
-        """, (products_scraped, errors, status, str(run_id)))
+        """, (products_scraped, errors, status,
+              psycopg2.extras.Json(stats) if stats is not None else None, str(run_id)))
     conn.commit()
\ No newline at end of file
@@ -0,0 +1,231 @@
+import sys
+import json
+import time
+import queue
+import atexit
+import itertools
+import threading
+from datetime import datetime, timezone
+
+from config import LOG_FORMAT, LOG_LEVEL, LOG_SAMPLE_EVERY, LOG_PROGRESS_SECONDS, LOG_QUEUE_SIZE
+
+# Structured run log for the worker hot paths. Callers only build a dict and
+# put it on a bounded queue (dropping it if the queue is full); one writer
+# thread formats events as text or JSON lines and writes them in batches, and
+# every LOG_PROGRESS_SECONDS adds one aggregated progress line. Per-product
+# lines go through sample(), which keeps every LOG_SAMPLE_EVERY-th one per
+# event; warnings and errors are never sampled.
+#
+# Text messages are str.format templates over the event's fields, so the
+# formatting happens on the writer thread, not in the worker.
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+
+class Progress:
+    """Per-worker done/error counters. Each worker only touches its own slot,
+    so counting takes no lock."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, label=None, total=None):
+        self.label = label
+        self.total = total
+        self.workers = {}
+        self.started = time.monotonic()
+        self.active = label is not None
+        self._last = (self.started, 0)
+
+    def add_total(self, n):
+        self.total = (self.total or 0) + n
+
+    def _slot(self, worker):
+        slot = self.workers.get(worker)
+        if slot is None:
+            slot = self.workers.setdefault(worker, [0, 0])
+        return slot
+
+    def done(self, worker, n=1):
+        self._slot(worker)[0] += n
+
+    def error(self, worker, n=1):
+        self._slot(worker)[1] += n
+
+    def snapshot(self):
+        now = time.monotonic()
+        slots = {w: tuple(s) for w, s in list(self.workers.items())}
+        done = sum(d for d, _ in slots.values())
+        last_at, last_done = self._last
+        self._last = (now, done)
+        rate = (done - last_done) / (now - last_at) if now > last_at else 0.0
+        average = done / (now - self.started) if now > self.started else 0.0
+        eta = None
+        if self.total is not None and (rate or average):
+            eta = max(self.total - done, 0) / (rate or average)
+        return {
+            "label": self.label, "done": done, "total": self.total,
+            "errors": sum(e for _, e in slots.values()),
+            "per_sec": round(rate, 2), "avg_per_sec": round(average, 2),
+            "eta_s": round(eta) if eta is not None else None,
+            "elapsed_s": round(now - self.started),
+            "workers": {str(w): {"done": d, "errors": e} for w, (d, e) in sorted(slots.items(), key=str)},
+        }
+
+
+def _progress_text(p):
+    total = f"/{p['total']}" if p["total"] is not None else ""
+    eta = f", ETA {p['eta_s'] // 60}m{p['eta_s'] % 60:02d}s" if p["eta_s"] is not None else ""
+    workers = " ".join(f"{w}:{s['done']}" + (f"/{s['errors']}err" if s["errors"] else "")
+                       for w, s in p["workers"].items())
+    return (f"[{p['label']}] {p['done']}{total} done, {p['errors']} errors, "
+            f"{p['per_sec']:.1f}/s (avg {p['avg_per_sec']:.1f}/s){eta}" + (f" | {workers}" if workers else ""))
+
+
+class EventLog:
+    def __init__(self, fmt=LOG_FORMAT, level=LOG_LEVEL, sample_every=LOG_SAMPLE_EVERY,
+                 progress_seconds=LOG_PROGRESS_SECONDS, queue_size=LOG_QUEUE_SIZE, stream=None):
+        self.configure(fmt, level, sample_every)
+        self.progress_seconds = progress_seconds
+        self.stream = stream or sys.stdout
+        self.progress = Progress()
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._counters = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def configure(self, fmt=None, level=None, sample_every=None):
+        if fmt:
+            self.fmt = fmt
+        if level:
+            self.level = LEVELS[level.lower()]
+        if sample_every:
+            self.sample_every = max(1, int(sample_every))
+
+    def emit(self, level, event, msg=None, **fields):
+        """Queue one event; never blocks."""
+        if LEVELS[level] < self.level:
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((time.time(), level, event, msg, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, event, msg=None, **fields):
+        self.emit("debug", event, msg, **fields)
+
+    def info(self, event, msg=None, **fields):
+        self.emit("info", event, msg, **fields)
+
+    def warning(self, event, msg=None, **fields):
+        self.emit("warning", event, msg, **fields)
+
+    def error(self, event, msg=None, **fields):
+        self.emit("error", event, msg, **fields)
+
+    def sample(self, event, msg=None, level="info", **fields):
+        """Like info(), but only every sample_every-th call per event is kept."""
+        counter = self._counters.get(event)
+        if counter is None:
+            counter = self._counters.setdefault(event, itertools.count())
+        if next(counter) % self.sample_every == 0 or LEVELS[level] >= LEVELS["warning"]:
+            self.emit(level, event, msg, **fields)
+
+    def start_progress(self, label, total=None):
+        """Reset the progress counters; the writer reports them until finish_progress()."""
+        self.progress.reset(label, total)
+        if self._thread is None:
+            self._start()
+        return self.progress
+
+    def finish_progress(self):
+        """Write the final progress line and stop reporting."""
+        if self.progress.active:
+            self._queue.put(("progress", None))
+            self.flush()
+            self.progress.active = False
+
+    def flush(self):
+        """Block until everything queued so far is written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        next_progress = time.monotonic() + self.progress_seconds
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=max(next_progress - time.monotonic(), 0.05)))
+                while len(batch) < 500:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = None in batch
+            # Nothing a caller logged may stop the writer: a batch that still
+            # fails is dropped, and every item is acknowledged so flush() returns
+            try:
+                lines = [self._format_event(item) for item in batch if item is not None]
+                if time.monotonic() >= next_progress:
+                    next_progress = time.monotonic() + self.progress_seconds
+                    if self.progress.active:
+                        lines.append(self._format_progress())
+                if self.dropped:
+                    dropped, self.dropped = self.dropped, 0
+                    lines.append(self._format((time.time(), "warning", "log.dropped",
+                                               "[log] dropped {count} events (queue full)", {"count": dropped})))
+                if lines:
+                    self.stream.write("".join(line + "\n" for line in lines))
+                    self.stream.flush()
+            except Exception:
+                pass
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _format_event(self, item):
+        if item[0] == "progress":
+            return self._format_progress()
+        return self._format(item)
+
+    def _format_progress(self):
+        p = self.progress.snapshot()
+        return self._format((time.time(), "info", "progress", None, p), text=_progress_text(p))
+
+    def _format(self, item, text=None):
+        ts, level, event, msg, fields = item
+        if self.fmt == "json":
+            record = {"ts": datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds"),
+                      "level": level, "event": event, **fields}
+            try:
+                return json.dumps(record, default=str, ensure_ascii=False)
+            except Exception:
+                return json.dumps({k: str(v) for k, v in record.items()}, ensure_ascii=False)
+        if text is not None:
+            return text
+        if msg is None:
+            return f"{event} " + " ".join(f"{k}={v}" for k, v in fields.items())
+        try:
+            return msg.format(**fields)
+        except Exception:
+            return f"{msg} {fields}"
+
+
+log = EventLog()
+atexit.register(log.close)
@@ -0,0 +1,244 @@
+import threading
+import time
+import requests
+from events import log
+from config import (
+    HEADERS, REQUEST_TIMEOUT, BREAKER_RATE_LIMIT_SECONDS, BREAKER_BLOCK_SECONDS,
+    BREAKER_MAX_SECONDS, BREAKER_MAX_BLOCKED_PROBES,
+)
+
+# How often waiting threads re-check cancellation and the breaker
+POLL_SECONDS = 0.25
+
+
+class FetchError(Exception):
+    """A classified fetch failure; `status` is the HTTP status when there was one."""
+
+    def __init__(self, message, url=None, status=None):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+
+
+class RateLimited(FetchError):
+    """429. `retry_after` is the server's Retry-After in seconds, if it sent one."""
+
+    def __init__(self, message, url=None, status=429, retry_after=None):
+        super().__init__(message, url, status)
+        self.retry_after = retry_after
+
+
+class Blocked(FetchError):
+    """403: the site is refusing us."""
+
+
+class TransientError(FetchError):
+    """5xx, timeouts and connection errors — worth retrying."""
+
+
+class Interrupted(TransientError):
+    """The request was abandoned because the circuit breaker tripped while it was in flight."""
+
+
+class PermanentError(FetchError):
+    """Any other 4xx; 404/410 mean the page is gone."""
+
+
+class Cancelled(FetchError):
+    """The run was cancelled; stop fetching."""
+
+
+class CircuitBreaker:
+    """Shared by every fetching thread in the process.
+
+    A 429 or 403 opens it: all threads' next requests wait out the cooldown, then a
+    single half-open probe goes out. A successful probe closes it again; a failed
+    one reopens it with a doubled cooldown. After BREAKER_MAX_BLOCKED_PROBES blocked
+    probes in a row the run is cancelled. Requests in flight when it trips are
+    abandoned, so nothing keeps hitting the site while it is pushing back.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.state = "closed"
+            self.open_until = 0.0
+            self.tripped_at = 0.0
+            self.cooldown = 0.0
+            self.probing = False
+            self.blocked_probes = 0
+        self.cancelled.clear()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def acquire(self):
+        """Wait until a request may go out. Returns True if it is the half-open probe."""
+        while True:
+            if self.cancelled.is_set():
+                raise Cancelled("run cancelled")
+            with self.lock:
+                now = time.monotonic()
+                if self.state == "closed":
+                    return False
+                if self.state == "open" and now >= self.open_until:
+                    self.state = "half_open"
+                if self.state == "half_open" and not self.probing:
+                    self.probing = True
+                    return True
+                delay = self.open_until - now if self.state == "open" else POLL_SECONDS
+            self.cancelled.wait(min(max(delay, 0.01), POLL_SECONDS))
+
+    def tripped_since(self, started):
+        return self.tripped_at > started
+
+    def record(self, probe, error=None):
+        with self.lock:
+            if probe:
+                self.probing = False
+            if isinstance(error, (RateLimited, Blocked)):
+                self._trip(error, probe)
+            elif probe and (error is None or isinstance(error, PermanentError)):
+                # The site answered normally again
+                self.state = "closed"
+                self.cooldown = 0.0
+                self.blocked_probes = 0
+                log.info("breaker.closed", "Circuit breaker closed, resuming")
+
+    def _trip(self, error, probe):
+        if self.state != "closed" and not probe:
+            return  # a straggler from before the trip; the pause is already running
+        if isinstance(error, Blocked):
+            base = BREAKER_BLOCK_SECONDS
+            if probe:
+                self.blocked_probes += 1
+        else:
+            base = error.retry_after or BREAKER_RATE_LIMIT_SECONDS
+        self.cooldown = min(BREAKER_MAX_SECONDS, max(base, self.cooldown * 2))
+        now = time.monotonic()
+        self.state = "open"
+        self.tripped_at = now
+        self.open_until = now + self.cooldown
+        if self.blocked_probes >= BREAKER_MAX_BLOCKED_PROBES:
+            log.error("breaker.cancelled", "Circuit breaker: still blocked after {probes} probes, cancelling the run",
+                      probes=self.blocked_probes)
+            self.cancelled.set()
+        else:
+            log.warning("breaker.open", "Circuit breaker open for {cooldown:.0f}s after {status}",
+                        cooldown=self.cooldown, status=error.status)
+
+
+breaker = CircuitBreaker()
+
+
+def pause(seconds):
+    """time.sleep that ends early (raising Cancelled) when the run is cancelled."""
+    if breaker.cancelled.wait(seconds):
+        raise Cancelled("run cancelled")
+
+
+# Optional archive.PageArchive that every successful response is appended to
+_archive = None
+
+
+def set_archive(archive):
+    global _archive
+    _archive = archive
+
+
+def _retry_after(resp):
+    try:
+        return float(resp.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _check_status(url, resp):
+    status = resp.status_code
+    if status < 400:
+        return
+    message = f"{status} {resp.reason} for url: {url}"
+    if status == 429:
+        raise RateLimited(message, url, retry_after=_retry_after(resp))
+    if status == 403:
+        raise Blocked(message, url, status)
+    if status >= 500 or status == 408:
+        raise TransientError(message, url, status)
+    raise PermanentError(message, url, status)
+
+
+def _get(url, started, headers=None):
+    """requests.get on a helper thread, so the caller can walk away from it within
+    POLL_SECONDS of a cancellation or a breaker trip."""
+    result = {}
+    done = threading.Event()
+
+    def run():
+        try:
+            result["resp"] = requests.get(url, headers={**HEADERS, **(headers or {})}, timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            result["error"] = e
+        done.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    while not done.wait(POLL_SECONDS):
+        if breaker.cancelled.is_set():
+            raise Cancelled(f"cancelled: {url}", url)
+        if breaker.tripped_since(started):
+            raise Interrupted(f"interrupted by circuit breaker: {url}", url)
+    if "error" in result:
+        raise TransientError(str(result["error"]), url) from result["error"]
+    return result["resp"]
+
+
+def fetch_page(url):
+    probe = breaker.acquire()
+    started = time.monotonic()
+    try:
+        resp = _get(url, started)
+        _check_status(url, resp)
+    except FetchError as e:
+        breaker.record(probe, e)
+        raise
+    breaker.record(probe)
+    if _archive is not None:
+        _archive.append(url, resp.status_code, resp.content, resp.headers.get("Content-Type"))
+    return resp.text
+
+
+def fetch_asset(url, etag=None):
+    """Binary GET through the circuit breaker, conditional on `etag` when given.
+    Returns (content, etag), with content None when the server answered 304."""
+    probe = breaker.acquire()
+    started = time.monotonic()
+    try:
+        resp = _get(url, started, {"If-None-Match": etag} if etag else None)
+        _check_status(url, resp)
+    except FetchError as e:
+        breaker.record(probe, e)
+        raise
+    breaker.record(probe)
+    if resp.status_code == 304:
+        return None, etag
+    return resp.content, resp.headers.get("ETag")
+
+
+class RateLimiter:
+    """Spaces calls to wait() at least 1/per_second apart across all threads."""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_at)
+            self.next_at = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
@@ -0,0 +1,151 @@
+import json
+import argparse
+from datetime import datetime, timezone
+
+import psycopg2.extras
+from db import get_connection, ensure_tables, ensure_history_partitions
+from events import log
+from config import PRICE_HISTORY_RAW_MONTHS
+
+# Queries and upkeep for product_price_history (see db.ensure_price_history).
+# Monthly partitions older than PRICE_HISTORY_RAW_MONTHS are rolled up into one
+# row per product per day in product_price_daily, then dropped.
+
+PARTITION_PREFIX = "product_price_history_"
+
+
+def monthly_partitions(cur):
+    """{first day of month: partition name} for the attached monthly partitions."""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'product_price_history'::regclass
+    """)
+    partitions = {}
+    for (name,) in cur.fetchall():
+        suffix = name[len(PARTITION_PREFIX):]
+        if name.startswith(PARTITION_PREFIX) and suffix.isdigit():
+            partitions[datetime.strptime(suffix, "%Y%m")] = name
+    return partitions
+
+
+def rollup_history(conn, keep_months=PRICE_HISTORY_RAW_MONTHS):
+    """Roll up and drop monthly partitions older than `keep_months`, and create
+    the upcoming ones. Returns the partitions rolled up."""
+    today = datetime.now(timezone.utc)
+    year, month = divmod(today.year * 12 + today.month - 1 - keep_months, 12)
+    cutoff = datetime(year, month + 1, 1)
+    rolled = []
+    with conn.cursor() as cur:
+        ensure_history_partitions(cur)
+        conn.commit()
+        for start, name in sorted(monthly_partitions(cur).items()):
+            if start >= cutoff:
+                continue
+            # One transaction per partition: the rollup and the drop land together
+            days = _rollup(cur, name)
+            cur.execute(f"DROP TABLE {name}")
+            conn.commit()
+            rolled.append(name)
+            log.info("history.rolled_up", "  [history] rolled up {partition} into {days} product-days",
+                     partition=name, days=days)
+        # Rows that arrived while their month had no partition of its own
+        days = _rollup(cur, PARTITION_PREFIX + "default", cutoff)
+        cur.execute(f"DELETE FROM {PARTITION_PREFIX}default WHERE recorded_at < %s", (cutoff,))
+        conn.commit()
+        if days:
+            rolled.append(PARTITION_PREFIX + "default")
+            log.info("history.rolled_up", "  [history] rolled up {days} product-days from the default partition",
+                     partition=PARTITION_PREFIX + "default", days=days)
+    return rolled
+
+
+def _rollup(cur, table, before=None):
+    cur.execute(f"""
+        INSERT INTO product_price_daily (
+            product_id, day, open_price, low_price, high_price,
+            close_price, close_original_price, close_stock_status, changes
+        )
+        SELECT product_id, recorded_at::date,
+               (array_agg(price ORDER BY recorded_at))[1],
+               MIN(price), MAX(price),
+               (array_agg(price ORDER BY recorded_at DESC))[1],
+               (array_agg(original_price ORDER BY recorded_at DESC))[1],
+               (array_agg(stock_status ORDER BY recorded_at DESC))[1],
+               COUNT(*)
+        FROM {table}
+        WHERE %(before)s::timestamptz IS NULL OR recorded_at < %(before)s::timestamptz
+        GROUP BY product_id, recorded_at::date
+        ON CONFLICT (product_id, day) DO NOTHING
+    """, {"before": before})
+    return cur.rowcount
+
+
+def product_history(conn, product_id, days=90):
+    """One product's price/stock changes over the last `days`, oldest first:
+    raw changes where they are still kept, daily closes before that."""
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            SELECT day::timestamptz AS at, close_price AS price,
+                   close_original_price AS original_price, close_stock_status AS stock_status
+            FROM product_price_daily
+            WHERE product_id = %(id)s AND day > (NOW() - make_interval(days => %(days)s))::date
+            UNION ALL
+            SELECT recorded_at, price, original_price, stock_status
+            FROM product_price_history
+            WHERE product_id = %(id)s AND recorded_at > NOW() - make_interval(days => %(days)s)
+            ORDER BY 1
+        """, {"id": str(product_id), "days": days})
+        return [dict(row) for row in cur.fetchall()]
+
+
+def price_drops(conn, days=7, min_percent=0, limit=100):
+    """Products whose price now is lower than it was `days` ago, biggest drop first."""
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            WITH changed AS (
+                SELECT DISTINCT ON (product_id) product_id, price
+                FROM product_price_history
+                WHERE recorded_at > NOW() - make_interval(days => %(days)s)
+                ORDER BY product_id, recorded_at DESC
+            )
+            SELECT c.product_id::text AS product_id, b.price AS price_before, c.price AS price_now,
+                   ROUND(100 * (b.price - c.price) / b.price, 1) AS drop_percent
+            FROM changed c
+            CROSS JOIN LATERAL (
+                SELECT h.price FROM product_price_history h
+                WHERE h.product_id = c.product_id
+                  AND h.recorded_at <= NOW() - make_interval(days => %(days)s)
+                ORDER BY h.recorded_at DESC
+                LIMIT 1
+            ) b
+            WHERE b.price > 0 AND c.price < b.price
+              AND 100 * (b.price - c.price) / b.price >= %(min)s
+            ORDER BY drop_percent DESC
+            LIMIT %(limit)s
+        """, {"days": days, "min": min_percent, "limit": limit})
+        return [dict(row) for row in cur.fetchall()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Price/stock history: queries and partition rollup")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rollup", help=f"Roll up partitions older than {PRICE_HISTORY_RAW_MONTHS} months")
+    show = sub.add_parser("product", help="One product's history")
+    show.add_argument("product_id")
+    show.add_argument("--days", type=int, default=90)
+    drops = sub.add_parser("drops", help="Products whose price dropped recently")
+    drops.add_argument("--days", type=int, default=7)
+    drops.add_argument("--min-percent", type=float, default=0)
+    args = parser.parse_args()
+
+    conn = get_connection()
+    ensure_tables(conn)
+    if args.command == "rollup":
+        rollup_history(conn)
+    else:
+        rows = product_history(conn, args.product_id, args.days) if args.command == "product" \
+            else price_drops(conn, args.days, args.min_percent)
+        for row in rows:
+            print(json.dumps(row, default=str))
+    conn.close()
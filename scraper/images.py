@@ -0,0 +1,268 @@
+import io
+import os
+import time
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import psycopg2.extras
+from PIL import Image, ImageOps
+
+from fetch import fetch_asset, FetchError, Cancelled
+from db import get_connection, ensure_tables
+from events import log
+from config import (
+    IMAGE_DIR, IMAGE_BASE_URL, IMAGE_WIDTHS, IMAGE_FORMATS, IMAGE_QUALITY,
+    IMAGE_DOWNLOAD_WORKERS, IMAGE_RESIZE_WORKERS,
+)
+
+# Localizes product images: each supplier image is downloaded once (conditional
+# on its ETag), deduplicated by SHA-256 and resized into WebP/AVIF variants
+# stored content-addressed as <sha[:2]>/<sha>-<width>.<format> under IMAGE_DIR.
+# Products then point at the variants: `images` at the widest WebP, `thumbnail`
+# at the narrowest; the AVIF files sit next to them under the same name.
+# image_sources keeps the supplier URLs they came from, and the product upsert
+# leaves the local URLs alone while a re-scrape finds the same supplier images.
+#
+# Image bytes only live between download and resize, so both stages keep a
+# small window of work in flight (twice their worker count) instead of queueing
+# the whole backlog in memory.
+
+
+def ensure_image_tables(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS image_assets (
+                source_url TEXT PRIMARY KEY,
+                etag TEXT,
+                sha256 TEXT,
+                fetched_at TIMESTAMPTZ,
+                error TEXT
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS image_blobs (
+                sha256 TEXT PRIMARY KEY,
+                width INT NOT NULL,
+                height INT NOT NULL,
+                variants JSONB NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+    conn.commit()
+
+
+def variant_path(sha, width, fmt):
+    return f"{sha[:2]}/{sha}-{width}.{fmt}"
+
+
+def _save_atomic(image, path, fmt, quality):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, format=fmt.upper(), quality=quality)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def make_variants(sha, data, image_dir, widths=IMAGE_WIDTHS, formats=IMAGE_FORMATS, quality=IMAGE_QUALITY):
+    """Process-pool worker: write every missing variant of one image.
+    Returns (sha, width, height, {width: {format: relative path}})."""
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        variants = {}
+        for width in widths:
+            resized = image
+            if image.width > width:
+                resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+            variants[str(width)] = {}
+            for fmt in formats:
+                rel = variant_path(sha, width, fmt)
+                if not os.path.exists(os.path.join(image_dir, rel)):
+                    _save_atomic(resized, os.path.join(image_dir, rel), fmt, quality)
+                variants[str(width)][fmt] = rel
+        return sha, image.width, image.height, variants
+
+
+def pending_products(conn, base_url, revalidate=False):
+    """(id, supplier URLs) of products whose images aren't localized yet; with
+    `revalidate`, also every localized product, from its image_sources."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id::text, images FROM products
+            WHERE available = TRUE AND cardinality(images) > 0
+              AND EXISTS (SELECT 1 FROM unnest(images) AS u WHERE left(u, length(%(base)s)) <> %(base)s)
+        """, {"base": base_url})
+        pending = cur.fetchall()
+        if revalidate:
+            cur.execute("""
+                SELECT id::text, image_sources FROM products
+                WHERE available = TRUE AND cardinality(image_sources) > 0
+                  AND NOT EXISTS (SELECT 1 FROM unnest(images) AS u WHERE left(u, length(%(base)s)) <> %(base)s)
+            """, {"base": base_url})
+            pending += cur.fetchall()
+    return pending
+
+
+def download(urls, known, revalidate):
+    """Fetch `urls` with at most IMAGE_DOWNLOAD_WORKERS running and twice that
+    submitted. Yields (url, content or None if unchanged, etag, error)."""
+    def get(url):
+        asset = known.get(url)
+        if asset and asset["sha256"] and not revalidate:
+            return url, None, asset["etag"], None  # already have it
+        try:
+            content, etag = fetch_asset(url, asset["etag"] if asset and asset["sha256"] else None)
+            return url, content, etag, None
+        except Cancelled:
+            raise
+        except FetchError as e:
+            return url, None, None, str(e)
+
+    remaining = iter(urls)
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=IMAGE_DOWNLOAD_WORKERS) as pool:
+        while True:
+            for url in remaining:
+                in_flight.add(pool.submit(get, url))
+                if len(in_flight) >= IMAGE_DOWNLOAD_WORKERS * 2:
+                    break
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def _collect_resized(done, resizing, blobs, errors):
+    """Move finished resize futures out of `resizing` into `blobs`, or into
+    `errors` by sha. Returns the number resized."""
+    resized = 0
+    for future in done:
+        sha = resizing.pop(future)
+        try:
+            blobs.append(future.result())
+            resized += 1
+        except Exception as e:
+            log.warning("images.resize_failed", "  [images] could not resize {sha:.12}: {error}", sha=sha, error=str(e))
+            errors[sha] = str(e)
+    return resized
+
+
+def localize_images(conn, image_dir=IMAGE_DIR, base_url=IMAGE_BASE_URL, revalidate=False):
+    """Download, dedupe and resize the images of every product that still points
+    at the supplier, then rewrite its images/thumbnail. Returns products rewritten."""
+    ensure_image_tables(conn)
+    started = time.monotonic()
+    base_url = base_url.rstrip("/") + "/"
+    products = pending_products(conn, base_url, revalidate)
+    if not products:
+        return 0
+    urls = sorted({url for _, sources in products for url in sources})
+
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("SELECT source_url, etag, sha256 FROM image_assets WHERE source_url = ANY(%s)", (urls,))
+        known = {row["source_url"]: dict(row) for row in cur.fetchall()}
+        cur.execute("SELECT sha256 FROM image_blobs")
+        have_blob = {row["sha256"] for row in cur.fetchall()}
+
+    fetched = skipped = failed = resized = 0
+    assets = []
+    blobs = []
+    errors = {}
+    resizing = {}  # future -> sha
+    submitted = set()
+    with ProcessPoolExecutor(max_workers=IMAGE_RESIZE_WORKERS) as pool:
+        for url, content, etag, error in download(urls, known, revalidate):
+            if error:
+                failed += 1
+                assets.append((url, None, None, error))
+                continue
+            if content is None:
+                skipped += 1
+                assets.append((url, etag, known[url]["sha256"], None))
+                continue
+            fetched += 1
+            sha = hashlib.sha256(content).hexdigest()
+            assets.append((url, etag, sha, None))
+            if sha not in have_blob and sha not in submitted:
+                if len(resizing) >= IMAGE_RESIZE_WORKERS * 2:
+                    done, _ = wait(resizing, return_when=FIRST_COMPLETED)
+                    resized += _collect_resized(done, resizing, blobs, errors)
+                submitted.add(sha)
+                resizing[pool.submit(make_variants, sha, content, image_dir)] = sha
+        resized += _collect_resized(list(resizing), resizing, blobs, errors)
+    if errors:
+        assets = [(u, t, None, errors[s]) if s in errors else (u, t, s, err) for u, t, s, err in assets]
+
+    with conn.cursor() as cur:
+        if blobs:
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO image_blobs (sha256, width, height, variants) VALUES %s
+                ON CONFLICT (sha256) DO NOTHING
+            """, [(sha, w, h, psycopg2.extras.Json(v)) for sha, w, h, v in blobs])
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO image_assets (source_url, etag, sha256, fetched_at, error) VALUES %s
+            ON CONFLICT (source_url) DO UPDATE SET
+                etag = COALESCE(EXCLUDED.etag, image_assets.etag),
+                sha256 = COALESCE(EXCLUDED.sha256, image_assets.sha256),
+                fetched_at = CASE WHEN EXCLUDED.error IS NULL THEN NOW() ELSE image_assets.fetched_at END,
+                error = EXCLUDED.error
+        """, assets, template="(%s, %s, %s, NOW(), %s)")
+        conn.commit()
+
+        # Rewrite products whose every source now has variants
+        cur.execute("""
+            SELECT a.source_url, b.variants FROM image_assets a
+            JOIN image_blobs b ON b.sha256 = a.sha256
+            WHERE a.source_url = ANY(%s)
+        """, (urls,))
+        variants = dict(cur.fetchall())
+        widest, narrowest = str(max(IMAGE_WIDTHS)), str(min(IMAGE_WIDTHS))
+        rewrites = []
+        for pid, sources in products:
+            if all(url in variants for url in sources):
+                images = [base_url + variants[url][widest]["webp"] for url in sources]
+                thumbnail = base_url + variants[sources[0]][narrowest]["webp"]
+                rewrites.append((pid, images, thumbnail, sources))
+        if rewrites:
+            psycopg2.extras.execute_values(cur, """
+                UPDATE products p SET
+                    images = v.images,
+                    thumbnail = v.thumbnail,
+                    image_sources = v.sources
+                FROM (VALUES %s) AS v(id, images, thumbnail, sources)
+                WHERE p.id::text = v.id
+                  AND (p.images = v.sources OR p.image_sources = v.sources)
+            """, rewrites, template="(%s, %s::text[], %s, %s::text[])")
+        rewritten = cur.rowcount if rewrites else 0
+    conn.commit()
+    log.info("images.done", "  [images] {sources} source images: {fetched} downloaded, {skipped} unchanged, "
+             "{failed} failed, {resized} resized; {rewritten} products rewritten in {seconds:.1f}s",
+             sources=len(urls), fetched=fetched, skipped=skipped, failed=failed, resized=resized,
+             rewritten=rewritten, seconds=time.monotonic() - started)
+    return rewritten
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download product images and store resized WebP/AVIF variants")
+    parser.add_argument("--out", metavar="DIR", default=IMAGE_DIR, help="Image directory (default: $IMAGE_DIR)")
+    parser.add_argument("--base-url", default=IMAGE_BASE_URL,
+                        help=f"URL prefix the directory is served from (default: {IMAGE_BASE_URL})")
+    parser.add_argument("--revalidate", action="store_true",
+                        help="Re-check already localized images against the supplier by ETag")
+    args = parser.parse_args()
+    if not args.out:
+        parser.error("--out or IMAGE_DIR is required")
+    conn = get_connection()
+    ensure_tables(conn)
+    localize_images(conn, args.out, args.base_url, revalidate=args.revalidate)
+    conn.close()
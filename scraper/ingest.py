@@ -0,0 +1,93 @@
+import hashlib
+import json
+from db import upsert_products, touch_products, PRODUCT_FIELDS
+from config import INGEST_BATCH_SIZE
+
+# Everything upsert_product writes from a scraped record. category_id is hashed
+# alongside so a product moving category still counts as a change.
+HASHED_FIELDS = PRODUCT_FIELDS
+
+
+def content_hash(data, category_id=None):
+    payload = {field: data.get(field) for field in HASHED_FIELDS}
+    payload["category_id"] = str(category_id) if category_id else None
+    encoded = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+class ProductWriter:
+    """Per-worker write buffer in front of the products table.
+
+    Records whose content hash matches the preloaded catalog index are only
+    marked as seen (bulk last_seen_at update); everything else is upserted in
+    batches. `catalog_index` is shared between workers and updated in place.
+    """
+
+    def __init__(self, conn, catalog_index, batch_size=INGEST_BATCH_SIZE):
+        self.conn = conn
+        self.catalog_index = catalog_index
+        self.batch_size = batch_size
+        self.changed = []
+        self.unchanged = []
+        self.written = 0
+        self.touched = 0
+        self.failed = 0  # records dropped by a failed batch write
+
+    def add(self, data, category_id):
+        """Queue a scraped product. Returns True if it differs from the stored row."""
+        h = content_hash(data, category_id)
+        known = self.catalog_index.get(data["external_id"])
+        if known and known[1] == h:
+            self.unchanged.append(data["external_id"])
+            is_changed = False
+        else:
+            self.changed.append((data, category_id, h))
+            is_changed = True
+        if len(self.changed) + len(self.unchanged) >= self.batch_size:
+            self.flush()
+        return is_changed
+
+    def _upsert_one_by_one(self, rows):
+        """Returns ({external_id: id} written, [(external_id, error)] dropped)."""
+        ids, dropped = {}, []
+        for row in rows:
+            try:
+                ids.update(upsert_products(self.conn, [row]))
+            except Exception as e:
+                self.conn.rollback()
+                dropped.append((row[0]["external_id"], e))
+        return ids, dropped
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def flush(self):
+        """Write the buffer. A failed batch is retried row by row so only the rows
+        that fail on their own are dropped; if any were, raises after the rest
+        are written."""
+        if self.changed:
+            # The buffer is only cleared once the rows are committed
+            try:
+                ids = upsert_products(self.conn, self.changed)
+                dropped = []
+            except Exception:
+                self.conn.rollback()
+                ids, dropped = self._upsert_one_by_one(self.changed)
+            rows, self.changed = self.changed, []
+            for data, _, h in rows:
+                ext_id = data["external_id"]
+                if ext_id in ids:
+                    self.catalog_index[ext_id] = (ids[ext_id], h)
+            self.written += len(ids)
+            if dropped:
+                self.failed += len(dropped)
+                raise RuntimeError(f"{len(dropped)} of {len(rows)} products could not be written "
+                                   f"(first: {dropped[0][0]}: {dropped[0][1]})")
+        if self.unchanged:
+            ext_ids, self.unchanged = self.unchanged, []
+            try:
+                self.touched += touch_products(self.conn, ext_ids)
+            except Exception:
+                self.conn.rollback()
+                self.failed += len(ext_ids)
+                raise
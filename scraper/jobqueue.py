@@ -0,0 +1,348 @@
+import os
+import sys
+import uuid
+import socket
+import argparse
+import threading
+from collections import Counter
+import psycopg2.extras
+from db import get_connection
+from events import log
+from config import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS
+
+# Postgres-backed work queue for multi-process / multi-machine runs. Category
+# listings and product pages are rows in scrape_jobs; any number of workers
+# claim them with FOR UPDATE SKIP LOCKED under a time-limited lease that a
+# heartbeat keeps extending. A job whose lease expires (worker died) becomes
+# claimable again until it has used up JOB_MAX_ATTEMPTS.
+
+
+def ensure_job_tables(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS scrape_jobs (
+                id BIGSERIAL PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                job_key TEXT NOT NULL,
+                payload JSONB NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INT NOT NULL DEFAULT 0,
+                leased_by TEXT,
+                lease_expires_at TIMESTAMPTZ,
+                available_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                last_error TEXT,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                finished_at TIMESTAMPTZ,
+                UNIQUE (run_id, kind, job_key)
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_scrape_jobs_claimable
+            ON scrape_jobs (run_id, available_at, id)
+            WHERE status IN ('pending', 'running')
+        """)
+    conn.commit()
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def enqueue_jobs(conn, run_id, kind, jobs):
+    """Insert (job_key, payload) pairs; keys already queued for the run are ignored."""
+    if not jobs:
+        return 0
+    with conn.cursor() as cur:
+        # rowcount would only cover execute_values' last page
+        inserted = psycopg2.extras.execute_values(cur, """
+            INSERT INTO scrape_jobs (run_id, kind, job_key, payload)
+            VALUES %s
+            ON CONFLICT (run_id, kind, job_key) DO NOTHING
+            RETURNING 1
+        """, [(str(run_id), kind, key, psycopg2.extras.Json(payload)) for key, payload in jobs], fetch=True)
+    conn.commit()
+    return len(inserted)
+
+
+def claim_jobs(conn, run_id, worker, limit=10, lease_seconds=JOB_LEASE_SECONDS):
+    """Lease up to `limit` pending (or lease-expired) jobs. Category jobs go first
+    so product jobs get queued early for other workers."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE scrape_jobs j SET
+                status = 'running',
+                leased_by = %s,
+                lease_expires_at = NOW() + make_interval(secs => %s),
+                attempts = j.attempts + 1
+            WHERE j.id IN (
+                SELECT id FROM scrape_jobs
+                WHERE run_id = %s
+                  AND available_at <= NOW()
+                  AND attempts < %s
+                  AND (status = 'pending' OR (status = 'running' AND lease_expires_at < NOW()))
+                ORDER BY kind <> 'category', id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING j.id, j.kind, j.payload, j.attempts
+        """, (worker, lease_seconds, str(run_id), JOB_MAX_ATTEMPTS, limit))
+        jobs = cur.fetchall()
+    conn.commit()
+    return jobs
+
+
+def heartbeat(conn, job_ids, worker, lease_seconds=JOB_LEASE_SECONDS):
+    """Extend the lease on jobs this worker still holds."""
+    if not job_ids:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE scrape_jobs SET lease_expires_at = NOW() + make_interval(secs => %s)
+            WHERE id = ANY(%s) AND leased_by = %s AND status = 'running'
+        """, (lease_seconds, list(job_ids), worker))
+        extended = cur.rowcount
+    conn.commit()
+    return extended
+
+
+def complete_jobs(conn, job_ids, worker):
+    if not job_ids:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE scrape_jobs SET status = 'done', finished_at = NOW(), lease_expires_at = NULL
+            WHERE id = ANY(%s) AND leased_by = %s AND status = 'running'
+        """, (list(job_ids), worker))
+        done = cur.rowcount
+    conn.commit()
+    return done
+
+
+def fail_job(conn, job_id, worker, error, retry_in=None):
+    """Record a failure. With retry_in (seconds) the job goes back to pending after
+    that delay unless it has run out of attempts; otherwise it fails for good."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE scrape_jobs SET
+                status = CASE WHEN %s AND attempts < %s THEN 'pending' ELSE 'failed' END,
+                available_at = NOW() + make_interval(secs => %s),
+                finished_at = CASE WHEN %s AND attempts < %s THEN NULL ELSE NOW() END,
+                lease_expires_at = NULL,
+                last_error = %s
+            WHERE id = %s AND leased_by = %s
+        """, (retry_in is not None, JOB_MAX_ATTEMPTS, retry_in or 0,
+              retry_in is not None, JOB_MAX_ATTEMPTS, str(error)[:500], job_id, worker))
+    conn.commit()
+
+
+def release_jobs(conn, job_ids, worker):
+    """Hand leased jobs back untouched (e.g. when the worker is shutting down)."""
+    if not job_ids:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE scrape_jobs SET
+                status = 'pending', lease_expires_at = NULL, attempts = GREATEST(attempts - 1, 0)
+            WHERE id = ANY(%s) AND leased_by = %s AND status = 'running'
+        """, (list(job_ids), worker))
+        released = cur.rowcount
+    conn.commit()
+    return released
+
+
+def fail_exhausted_jobs(conn, run_id):
+    """Expired leases on jobs with no attempts left can never be claimed again."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE scrape_jobs SET status = 'failed', finished_at = NOW(),
+                last_error = COALESCE(last_error, 'lease expired')
+            WHERE run_id = %s AND status = 'running'
+              AND lease_expires_at < NOW() AND attempts >= %s
+        """, (str(run_id), JOB_MAX_ATTEMPTS))
+        failed = cur.rowcount
+    conn.commit()
+    return failed
+
+
+def run_progress(conn, run_id):
+    """{(kind, status): count} for a run."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT kind, status, COUNT(*) FROM scrape_jobs
+            WHERE run_id = %s GROUP BY kind, status
+        """, (str(run_id),))
+        return {(kind, status): n for kind, status, n in cur.fetchall()}
+
+
+def run_coverage(conn, run_id):
+    """(category payloads fully listed in the run, external ids of failed product jobs).
+    A listing counts when its job finished without a page limit and queued at least
+    one product job under its own key."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.payload->'category' FROM scrape_jobs c
+            WHERE c.run_id = %s AND c.kind = 'category' AND c.status = 'done'
+              AND c.payload->>'max_pages' IS NULL
+              AND EXISTS (
+                  SELECT 1 FROM scrape_jobs p
+                  WHERE p.run_id = c.run_id AND p.kind = 'product'
+                    AND p.payload->'category'->>'id' = c.job_key
+              )
+        """, (str(run_id),))
+        categories = [row[0] for row in cur.fetchall()]
+        cur.execute("""
+            SELECT payload->>'external_id' FROM scrape_jobs
+            WHERE run_id = %s AND kind = 'product' AND status = 'failed'
+        """, (str(run_id),))
+        failed = [row[0] for row in cur.fetchall()]
+    return categories, failed
+
+
+def latest_queued_run(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT j.run_id FROM scrape_jobs j
+            WHERE j.status IN ('pending', 'running')
+            ORDER BY j.created_at DESC LIMIT 1
+        """)
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+class Heartbeat:
+    """Background thread that keeps extending leases on the jobs a worker holds."""
+
+    def __init__(self, worker, lease_seconds=JOB_LEASE_SECONDS):
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def hold(self, job_ids):
+        with self.lock:
+            self.held.update(job_ids)
+
+    def drop(self, job_ids):
+        with self.lock:
+            self.held.difference_update(job_ids)
+
+    def _run(self):
+        conn = get_connection()
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                with self.lock:
+                    held = list(self.held)
+                try:
+                    heartbeat(conn, held, self.worker, self.lease_seconds)
+                except Exception as e:
+                    conn.rollback()
+                    log.warning("queue.heartbeat_failed", "[{worker}] heartbeat failed: {error}",
+                                worker=self.worker, error=str(e))
+        finally:
+            conn.close()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def check_queue(jobs=2000, workers=8, claim_batch=10):
+    """Exercise the queue against the configured database with a throwaway run:
+    concurrent claiming, lease expiry and reclaim, retries, exhausted attempts
+    and heartbeats. No scraping. Returns the list of failed checks."""
+    conn = get_connection()
+    ensure_job_tables(conn)
+    run_id = f"check-{uuid.uuid4()}"
+    problems = []
+
+    def check(ok, what):
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            problems.append(what)
+
+    try:
+        queued = enqueue_jobs(conn, run_id, "category", [(f"c{i}", {"n": i}) for i in range(10)])
+        queued += enqueue_jobs(conn, run_id, "product", [(f"p{i}", {"n": i}) for i in range(jobs)])
+        again = enqueue_jobs(conn, run_id, "product", [(f"p{i}", {"n": i}) for i in range(jobs)])
+        check(queued == jobs + 10 and again == 0, f"enqueue {queued} jobs, re-enqueue is a no-op ({again})")
+
+        # Concurrent workers, each on its own connection: every job exactly once
+        claimed = Counter()
+        first_kinds = []
+        lock = threading.Lock()
+
+        def work(n):
+            wconn = get_connection()
+            name = f"check-worker-{n}"
+            try:
+                while True:
+                    batch = claim_jobs(wconn, run_id, name, claim_batch)
+                    if not batch:
+                        return
+                    with lock:
+                        claimed.update(job_id for job_id, *_ in batch)
+                        first_kinds.append(batch[0][1])
+                    complete_jobs(wconn, [job_id for job_id, *_ in batch], name)
+            finally:
+                wconn.close()
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        progress = run_progress(conn, run_id)
+        check(len(claimed) == jobs + 10 and max(claimed.values()) == 1,
+              f"{workers} workers claimed {sum(claimed.values())} jobs, none twice")
+        check(progress == {("category", "done"): 10, ("product", "done"): jobs}, f"all jobs done: {progress}")
+        check(first_kinds[0] == "category", "category jobs are claimed first")
+
+        # A lease that expires (worker died) is reclaimed by another worker
+        enqueue_jobs(conn, run_id, "product", [("lease", {})])
+        (job_id, _, _, attempts), = claim_jobs(conn, run_id, "dead", 1, lease_seconds=0)
+        reclaimed = claim_jobs(conn, run_id, "alive", 1)
+        check([j[0] for j in reclaimed] == [job_id] and reclaimed[0][3] == attempts + 1,
+              "expired lease is reclaimed with attempts + 1")
+        check(complete_jobs(conn, [job_id], "dead") == 0, "the old lease holder can no longer complete it")
+        check(heartbeat(conn, [job_id], "alive") == 1, "heartbeat extends the current holder's lease")
+        check(claim_jobs(conn, run_id, "other", 1) == [], "a held lease is not claimable")
+        check(complete_jobs(conn, [job_id], "alive") == 1, "the current holder completes it")
+
+        # Retries go back to pending until attempts run out
+        enqueue_jobs(conn, run_id, "product", [("retry", {})])
+        for attempt in range(JOB_MAX_ATTEMPTS):
+            (job_id, *_), = claim_jobs(conn, run_id, "w", 1)
+            fail_job(conn, job_id, "w", "boom", retry_in=0)
+        check(claim_jobs(conn, run_id, "w", 1) == [], f"no claims after {JOB_MAX_ATTEMPTS} attempts")
+        check(run_progress(conn, run_id).get(("product", "failed")) == 1, "the exhausted job is failed")
+        coverage = run_coverage(conn, run_id)
+        check(coverage[1] == [None], "run_coverage reports the failed product job")
+
+        # Released jobs keep their attempt
+        enqueue_jobs(conn, run_id, "product", [("release", {})])
+        (job_id, _, _, attempts), = claim_jobs(conn, run_id, "w", 1)
+        release_jobs(conn, [job_id], "w")
+        check(claim_jobs(conn, run_id, "w", 1)[0][3] == attempts, "a released job is claimable without losing an attempt")
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM scrape_jobs WHERE run_id = %s", (run_id,))
+        conn.commit()
+        conn.close()
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the job queue against $DATABASE_URL (no scraping)")
+    parser.add_argument("--jobs", type=int, default=2000, help="Product jobs to queue (default: 2000)")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent claiming workers (default: 8)")
+    args = parser.parse_args()
+    problems = check_queue(args.jobs, args.workers)
+    print(f"\n{len(problems)} checks failed" if problems else "\nQueue checks passed")
+    sys.exit(1 if problems else 0)
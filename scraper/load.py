@@ -0,0 +1,94 @@
+import gzip
+import json
+import argparse
+import time
+
+from categories import CategoryResolver
+from config import BULK_LOAD
+from ingest import content_hash
+from db import (
+    get_connection, ensure_tables, copy_products, update_category_counts, fill_category_images,
+    refresh_search_vectors, set_bulk_load, load_catalog_index, touch_products,
+)
+
+# Streams an export written by `main.py --sink jsonl|parquet` into Postgres in
+# COPY-sized batches, so a crawl can run without the database and be loaded later.
+
+LOAD_BATCH_SIZE = 5000
+
+
+def read_jsonl(path, batch_size):
+    opener = gzip.open if path.endswith(".gz") else open
+    batch = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def read_parquet(path, batch_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Loading Parquet needs pyarrow: pip install pyarrow")
+    for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield record_batch.to_pylist()
+
+
+def read_export(path, batch_size=LOAD_BATCH_SIZE):
+    if path.endswith(".parquet"):
+        return read_parquet(path, batch_size)
+    return read_jsonl(path, batch_size)
+
+
+def load_export(path, batch_size=LOAD_BATCH_SIZE):
+    conn = get_connection()
+    ensure_tables(conn)
+    categories = CategoryResolver(conn)
+    # Like ProductWriter: products whose content hash is unchanged are only marked seen
+    catalog_index = load_catalog_index(conn)
+    started = time.monotonic()
+    loaded = touched = 0
+
+    for records in read_export(path, batch_size):
+        rows = []
+        unchanged = []
+        for data in records:
+            category_id = None
+            if data.get("category_slug"):
+                category_id = categories.id_for({"slug": data["category_slug"], "name": data["category_name"]})
+            h = content_hash(data, category_id)
+            known = catalog_index.get(data["external_id"])
+            if known and known[1] == h:
+                unchanged.append(data["external_id"])
+            else:
+                rows.append((data, category_id, h))
+        loaded += copy_products(conn, rows)
+        touched += touch_products(conn, unchanged)
+        for data, _, h in rows:
+            catalog_index[data["external_id"]] = (None, h)
+        print(f"  ... {loaded} products written, {touched} unchanged")
+
+    refreshed = refresh_search_vectors(conn)
+    update_category_counts(conn)
+    fill_category_images(conn)
+    conn.close()
+    print(f"\nLoaded {path} in {time.monotonic() - started:.1f}s: {loaded} products written, "
+          f"{touched} unchanged ({refreshed} search vectors computed)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load a scraper export (JSONL or Parquet) into Postgres")
+    parser.add_argument("path", help="File written by main.py --sink jsonl|parquet")
+    parser.add_argument("--batch-size", type=int, default=LOAD_BATCH_SIZE,
+                        help=f"Rows per COPY (default: {LOAD_BATCH_SIZE})")
+    parser.add_argument("--bulk-load", action=argparse.BooleanOptionalAction, default=BULK_LOAD,
+                        help="Compute search vectors once after the load instead of per row (default: on)")
+    args = parser.parse_args()
+    set_bulk_load(args.bulk_load)
+    load_export(args.path, batch_size=args.batch_size)
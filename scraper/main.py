@@ -1,165 +1,243 @@
 import sys
 import time
+import uuid
 import argparse
 import traceback
+from collections import Counter
 from datetime import datetime, timezone
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from product import scrape_product, slugify
-from sitemap import get_all_product_urls, get_product_urls_from_category, get_top_categories
+from sitemap import (
+    get_all_product_urls, get_product_urls_from_category, get_top_categories,
+    leaf_categories, breadcrumb_index,
+)
+from categories import CategoryResolver, save_category_tree
+from daemon import run_daemon
+from similar import update_similar_products
+from autocomplete import build_autocomplete
+from bundles import update_bundles
+from changefeed import prune_changes
+from images import localize_images
+from history import rollup_history
 from db import (
-    get_connection, ensure_tables, upsert_category, upsert_product,
+    get_connection, ensure_tables,
     update_category_counts, start_run, finish_run,
-    soft_delete_unseen, update_category_image, set_category_icon,
+    soft_delete_unseen, fill_category_images, load_catalog_index,
+    record_run_scopes, soft_delete_unseen_in_scopes, refresh_summary_views, record_listings, prune_listings,
+    refresh_search_vectors, set_bulk_load,
 )
-from config import RATE_LIMIT_SECONDS, MAX_RETRIES, BACKOFF_FACTOR
-
-CATEGORY_ICONS = {
-    "boat-engine":       "Ship",
-    "boat-engines":      "Ship",
-    "electronics":       "Monitor",
-    "navigation":        "Compass",
-    "safety":            "ShieldCheck",
-    "safety-equipment":  "ShieldCheck",
-    "deck-hardware":     "Anchor",
-    "deck":              "Anchor",
-    "hardware":          "Wrench",
-    "plumbing":          "Droplet",
-    "electrical":        "Zap",
-    "paint":             "Paintbrush",
-    "maintenance":       "Settings",
-    "cleaning":          "Sparkles",
-    "fishing":           "Fish",
-    "water-sports":      "Waves",
-    "clothing":          "Shirt",
-    "accessories":       "Package",
-    "lighting":          "Lightbulb",
-    "rigging":           "Cable",
-    "sails":             "Wind",
-    "trailer":           "Truck",
-    "fuel":              "Fuel",
-    "ventilation":       "Fan",
-    "comfort":           "Sofa",
-    "anchoring":         "Anchor",
-    "mooring":           "Anchor",
-}
-
-
-def scrape_category_chunk(category_chunk, worker_id, max_pages_per_cat, limit_per_worker):
-    """Worker function: each worker processes its assigned categories independently."""
-    conn = get_connection()
-    category_cache = {}
-    scraped = 0
+from ingest import ProductWriter
+from sinks import SINKS, open_sink
+from snapshot import publish_snapshot
+from events import log
+from fetch import (
+    set_archive, breaker, pause, Cancelled, RateLimited, Blocked, PermanentError, TransientError,
+)
+from archive import PageArchive, prune_runs
+from priority import load_candidates, select_due
+from jobqueue import (
+    ensure_job_tables, enqueue_jobs, claim_jobs, complete_jobs, fail_job, release_jobs,
+    fail_exhausted_jobs, run_progress, run_coverage, latest_queued_run, worker_name, Heartbeat,
+)
+from config import (
+    RATE_LIMIT_SECONDS, MAX_RETRIES, BACKOFF_FACTOR, ARCHIVE_DIR, ARCHIVE_KEEP_RUNS, REFRESH_BUDGET,
+    DAEMON_HEALTH_PORT, SNAPSHOT_DIR, IMAGE_DIR, LOG_FORMAT, LOG_SAMPLE_EVERY, BULK_LOAD,
+)
+
+def scrape_category_chunk(category_chunk, worker_id, max_pages_per_cat, limit_per_worker, sink):
+    """Worker function: each worker processes its assigned categories independently,
+    writing through its own writer from `sink`.
+
+    Also reports the categories it covered completely (every listing page read,
+    every listed product scraped and written) and the products it left unscraped,
+    so a partial run can still retire stale products within those categories."""
+    writer = sink.open_writer()
+
     errors = 0
     product_count = 0
+    listed = []
+    listings = []
+    unfinished = []
     
-    print(f"[Worker {worker_id}] Starting: {len(category_chunk)} categories assigned")
+    log.info("worker.start", "[Worker {worker}] Starting: {categories} categories assigned",
+             worker=worker_id, categories=len(category_chunk))
     
     # Step 1: Crawl all categories assigned to this worker
     all_product_urls = []
     for cat_idx, cat in enumerate(category_chunk):
         try:
-            print(f"[Worker {worker_id}] [{cat_idx+1}/{len(category_chunk)}] Crawling: {cat['name']}")
-            urls = get_product_urls_from_category(cat["url"], max_pages=max_pages_per_cat)
+            log.info("category.crawl", "[Worker {worker}] [{n}/{of}] Crawling: {category}",
+                     worker=worker_id, n=cat_idx + 1, of=len(category_chunk), category=cat["name"])
+            failed_pages = []
+            urls = get_product_urls_from_category(cat["url"], max_pages=max_pages_per_cat,
+                                                  failed_pages=failed_pages)
             
             for ext_id, url in urls:
                 all_product_urls.append((ext_id, url, cat))
+                listings.append((writer.category_id(cat), ext_id))
                 product_count += 1
+            # An empty listing is more likely a bad response than an empty category
+            if urls and not max_pages_per_cat and not failed_pages:
+                listed.append(cat)
             
-            print(f"[Worker {worker_id}]   {len(urls)} products found (total: {product_count})")
+            log.progress.add_total(len(urls))
+            log.info("category.listed", "[Worker {worker}]   {found} products found (total: {total})",
+                     worker=worker_id, category=cat["name"], found=len(urls), total=product_count)
             time.sleep(0.1)  # Minimal delay between categories within worker
+        except Cancelled:
+            writer.close()
+            return {"status": "blocked", "scraped": 0, "errors": errors, "worker": worker_id}
         except Exception as e:
-            print(f"[Worker {worker_id}] ERROR crawling {cat['name']}: {e}")
+            log.error("category.error", "[Worker {worker}] ERROR crawling {category}: {error}",
+                      worker=worker_id, category=cat["name"], error=str(e))
             errors += 1
     
-    print(f"[Worker {worker_id}] Crawl complete: {product_count} products to scrape")
+    log.info("worker.crawled", "[Worker {worker}] Crawl complete: {products} products to scrape",
+             worker=worker_id, products=product_count)
     
     # Step 2: Scrape products assigned to this worker
     if limit_per_worker:
+        unfinished = [ext_id for ext_id, _, _ in all_product_urls[limit_per_worker:]]
         all_product_urls = all_product_urls[:limit_per_worker]
     
-    for i, (external_id, url, cat_info) in enumerate(all_product_urls):
-        print(f"[Worker {worker_id}] [{i+1}/{len(all_product_urls)}] {url}")
-        
-        cat_slug = cat_info["slug"]
-        if cat_slug not in category_cache:
-            try:
-                cid = upsert_category(conn, cat_slug, cat_info["name"], i)
-                category_cache[cat_slug] = cid
-                icon = CATEGORY_ICONS.get(cat_slug, "Package")
-                set_category_icon(conn, cat_slug, icon)
-            except Exception as e:
-                print(f"[Worker {worker_id}] ERROR upserting category {cat_slug}: {e}")
-                conn.rollback()
-                errors += 1
-                continue
-        
-        category_id = category_cache[cat_slug]
-        
+    status, scraped, scrape_errors = scrape_product_list(
+        all_product_urls, worker_id, writer, writer.category_for, failed=unfinished,
+    )
+    errors += scrape_errors + flush_writer(writer, worker_id)
+    covered = []
+    if not writer.failed:
+        covered = [writer.category_id(cat) for cat in listed]
+    writer.close()
+    if status == "blocked":
+        return {"status": "blocked", "scraped": scraped, "errors": errors, "worker": worker_id}
+    log.info("worker.done", "[Worker {worker}] Complete: scraped {scraped} "
+             "({written} written, {unchanged} unchanged), errors {errors}",
+             worker=worker_id, scraped=scraped, written=writer.written, unchanged=writer.touched, errors=errors)
+    return {"status": "ok", "scraped": scraped, "errors": errors, "worker": worker_id,
+            "covered": covered, "unfinished": unfinished, "listings": listings}
+
+
+def scrape_product_list(items, worker_id, writer, category_for, failed=None):
+    """Scrape (external_id, url, category) items with retries and queue them on
+    `writer`. category_for(category, data, index) gives the category id to store.
+    External ids that could not be scraped are appended to `failed` if given.
+    Per-product lines are sampled; every product counts towards log.progress.
+    Returns (status, scraped, errors); status is "blocked" once the run is cancelled."""
+    scraped = 0
+    errors = 0
+    
+    for i, (external_id, url, cat_info) in enumerate(items):
         retries = 0
+        finished = False
         while retries <= MAX_RETRIES:
             try:
                 data = scrape_product(url, external_id)
                 
                 if not data.get("price"):
-                    print(f"[Worker {worker_id}]   SKIP: no price found")
+                    log.sample("product.skip", "[Worker {worker}] [{n}/{of}] SKIP: no price found: {url}",
+                               worker=worker_id, n=i + 1, of=len(items), url=url)
+                    finished = True
                     break
                 
-                upsert_product(conn, data, category_id)
+                changed = writer.add(data, category_for(cat_info, data, i))
                 scraped += 1
-                print(f"[Worker {worker_id}]   OK: {data['name'][:50]} | {data['price']} EUR | {data['stock_status']}")
-                
-                if data.get("thumbnail"):
-                    try:
-                        update_category_image(conn, category_id, data["thumbnail"])
-                    except:
-                        pass
-                
+                finished = True
+                log.sample("product.ok" if changed else "product.unchanged",
+                           "[Worker {worker}] [{n}/{of}] " + ("OK" if changed else "UNCHANGED")
+                           + ": {name:.50} | {price} EUR | {stock_status}",
+                           worker=worker_id, n=i + 1, of=len(items), url=url, name=data["name"],
+                           price=data["price"], stock_status=data["stock_status"])
                 break
             
+            except Cancelled:
+                log.warning("worker.cancelled", "[Worker {worker}]   CANCELLED (site kept blocking us). Worker stopping.",
+                            worker=worker_id)
+                return "blocked", scraped, errors
+            except PermanentError as e:
+                errors += 1
+                log.error("product.fail", "[Worker {worker}]   FAIL: {url}: {error}",
+                          worker=worker_id, url=url, error=str(e))
+                break
             except Exception as e:
-                conn.rollback()
-                if "429" in str(e) or "Too Many" in str(e):
-                    retries += 1
-                    wait = RATE_LIMIT_SECONDS * (BACKOFF_FACTOR ** retries)
-                    print(f"[Worker {worker_id}]   RATE LIMITED, retry {retries}/{MAX_RETRIES} in {wait:.0f}s")
-                    time.sleep(wait)
-                elif "403" in str(e):
-                    print(f"[Worker {worker_id}]   BLOCKED (403). Worker stopping.")
-                    conn.close()
-                    return {"status": "blocked", "scraped": scraped, "errors": errors, "worker": worker_id}
+                writer.rollback()
+                retries += 1
+                if retries > MAX_RETRIES:
+                    errors += 1
+                    log.error("product.fail", "[Worker {worker}]   FAIL after {retries} retries: {url}: {error}",
+                              worker=worker_id, url=url, retries=MAX_RETRIES, error=str(e))
+                elif isinstance(e, (RateLimited, Blocked)):
+                    # The shared circuit breaker pauses every worker; the retry waits for it
+                    kind = "RATE LIMITED" if isinstance(e, RateLimited) else "BLOCKED (403)"
+                    log.warning("product.retry", "[Worker {worker}]   {kind}, retry {retry}/{retries} once the breaker closes",
+                                worker=worker_id, url=url, kind=kind, retry=retries, retries=MAX_RETRIES)
                 else:
-                    retries += 1
-                    if retries > MAX_RETRIES:
-                        errors += 1
-                        print(f"[Worker {worker_id}]   FAIL after {MAX_RETRIES} retries: {e}")
-                    else:
-                        wait = RATE_LIMIT_SECONDS * (BACKOFF_FACTOR ** (retries - 1))
-                        print(f"[Worker {worker_id}]   ERROR, retry {retries}/{MAX_RETRIES} in {wait:.0f}s")
-                        time.sleep(wait)
+                    wait = RATE_LIMIT_SECONDS * (BACKOFF_FACTOR ** (retries - 1))
+                    log.warning("product.retry", "[Worker {worker}]   ERROR, retry {retry}/{retries} in {wait:.0f}s: {error}",
+                                worker=worker_id, url=url, retry=retries, retries=MAX_RETRIES, wait=wait, error=str(e))
+                    pause(wait)
         
+        if finished:
+            log.progress.done(worker_id)
+        else:
+            log.progress.error(worker_id)
+            if failed is not None:
+                failed.append(external_id)
         # No sleep here - let workers maximize throughput with concurrent requests
     
-    conn.close()
-    print(f"[Worker {worker_id}] Complete: scraped {scraped}, errors {errors}")
-    return {"status": "ok", "scraped": scraped, "errors": errors, "worker": worker_id}
+    return "ok", scraped, errors
 
 
-def run_scraper_parallel(limit=None, max_pages=None, max_categories=None, num_workers=5):
-    """Main scraper with parallel category distribution."""
-    conn = get_connection()
-    ensure_tables(conn)
-    run_id = start_run(conn)
+def flush_writer(writer, worker_id):
+    """Write out whatever the worker still has buffered. Returns the error count."""
+    try:
+        writer.flush()
+        return 0
+    except Exception as e:
+        log.error("batch.error", "[Worker {worker}] ERROR flushing product batch: {error}",
+                  worker=worker_id, error=str(e))
+        return 1
+
+
+def run_scraper_parallel(limit=None, max_pages=None, max_categories=None, num_workers=5, save_tree=False,
+                         archive_dir=None, keep_runs=ARCHIVE_KEEP_RUNS, shard=None, sink="postgres", output=None):
+    """Main scraper with parallel category distribution. With a file sink the run
+    needs no database: products are exported to `output` instead."""
+    conn = None
+    catalog_index = {}
+    if sink == "postgres":
+        conn = get_connection()
+        ensure_tables(conn)
+        run_id = start_run(conn)
+    else:
+        run_id = str(uuid.uuid4())
     run_started_at = datetime.now(timezone.utc)
     
-    print(f"Scraper run started: {run_id}")
-    print(f"Using {num_workers} parallel workers\n")
+    log.info("run.start", "Scraper run started: {run}\nUsing {workers} parallel workers\n",
+             run=run_id, workers=num_workers)
+
+    archive = None
+    if archive_dir:
+        archive = PageArchive(archive_dir, run_id)
+        set_archive(archive)
+        log.info("archive.start", "Archiving raw pages to {dir}", dir=archive.run_dir)
+
+    # Shared, preloaded index so unchanged products skip the full-row rewrite
+    if conn:
+        catalog_index = load_catalog_index(conn)
+        log.info("catalog.loaded", "Loaded catalog index: {products} known products", products=len(catalog_index))
     
-    # Step 1: Get all categories once
-    all_categories = get_top_categories()
+    # Step 1: Get the category tree once; only leaves are crawled since parent
+    # listings repeat their children's products
+    tree = get_top_categories()
+    if save_tree and conn:
+        save_category_tree(conn, tree)
+    tree_index = breadcrumb_index(tree)
+    out = open_sink(sink, output, catalog_index, tree_index)
+    all_categories = select_shard(leaf_categories(tree), shard)
     if max_categories:
         all_categories = all_categories[:max_categories]
     
-    print(f"Total categories: {len(all_categories)}\n")
+    log.info("run.categories", "Leaf categories to crawl: {categories}\n", categories=len(all_categories))
     
     # Step 2: Divide categories into non-overlapping chunks
     chunk_size = (len(all_categories) + num_workers - 1) // num_workers
@@ -171,19 +249,23 @@ def run_scraper_parallel(limit=None, max_pages=None, max_categories=None, num_wo
         if start < len(all_categories):
             chunk = all_categories[start:end]
             category_chunks.append((chunk, worker_id))
-            print(f"Worker {worker_id}: categories [{start}:{end}] ({len(chunk)} categories)")
+            log.info("worker.assigned", "Worker {worker}: categories [{start}:{end}] ({categories} categories)",
+                     worker=worker_id, start=start, end=end, categories=len(chunk))
     
-    print()
     
     # Step 3: Execute workers in parallel
     total_scraped = 0
     total_errors = 0
     blocked = False
+    covered = []
+    unfinished = []
+    listings = []
     
+    log.start_progress("scrape")
     with ThreadPoolExecutor(max_workers=num_workers) as executor:
         futures = {
-            executor.submit(scrape_category_chunk, chunk, wid, max_pages, 
-                          (limit // num_workers) if limit else None): wid
+            executor.submit(scrape_category_chunk, chunk, wid, max_pages,
+                          (limit // num_workers) if limit else None, out): wid
             for chunk, wid in category_chunks
         }
         
@@ -193,33 +275,365 @@ def run_scraper_parallel(limit=None, max_pages=None, max_categories=None, num_wo
             
             total_scraped += result["scraped"]
             total_errors += result["errors"]
+            covered += result.get("covered", [])
+            unfinished += result.get("unfinished", [])
+            listings += result.get("listings", [])
             
             if result["status"] == "blocked":
-                print(f"\n⚠️  Worker {worker_id} was BLOCKED (403). Stopping all workers.")
+                log.warning("worker.blocked", "\n⚠️  Worker {worker} was BLOCKED (403). Stopping all workers.",
+                            worker=worker_id)
                 blocked = True
-                executor.shutdown(wait=False)
+                breaker.cancel()  # every other worker stops within a second
                 break
             
-            print(f"Worker {worker_id} finished\n")
+            log.info("worker.finished", "Worker {worker} finished\n", worker=worker_id)
+    log.finish_progress()
     
     # Step 4: Cleanup
+    out.close()
+    if archive:
+        set_archive(None)
+        archive.close()
+        expired = prune_runs(archive_dir, keep_runs)
+        log.info("archive.done", "\nArchived {pages} pages, pruned {pruned} old runs",
+                 pages=archive.pages, pruned=len(expired))
+
+    if conn is None:
+        log.emit("warning" if blocked else "info", "run.done",
+                 "\n{outcome}. Exported {scraped} products to {output}, Errors: {errors}",
+                 outcome="⚠️  Blocked" if blocked else "✅ Done", scraped=total_scraped, output=output,
+                 errors=total_errors)
+        sys.exit(1 if blocked else 0)
+
     if blocked:
+        refresh_search_vectors(conn)
         finish_run(conn, run_id, total_scraped, total_errors, "blocked")
         conn.close()
         sys.exit(1)
     
+    finalize_run(conn, run_id, run_started_at, total_scraped, total_errors,
+                 full_run=not limit and not max_categories and not shard,
+                 covered=covered, unfinished=unfinished, listings=listings)
+    conn.close()
+
+
+def select_shard(categories, shard):
+    """Leaf categories for shard (k, n): every n-th leaf by slug, starting at k.
+    Slug order keeps shards stable when the site reorders its menu."""
+    if not shard:
+        return categories
+    k, n = shard
+    return sorted(categories, key=lambda c: c["slug"])[k::n]
+
+
+def parse_shard(value):
+    try:
+        k, n = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected K/N, e.g. 0/4")
+    if not 0 <= k < n:
+        raise argparse.ArgumentTypeError("K must be between 0 and N-1")
+    return k, n
+
+
+def finalize_run(conn, run_id, run_started_at, total_scraped, total_errors, full_run,
+                 covered=(), unfinished=(), listings=()):
+    """End-of-run bookkeeping, done once per run by whichever process owns it.
+
+    `listings` are the (category id, external id) pairs the run found in leaf
+    listings (queue workers record theirs as they go). A partial run only retires
+    products whose known listings all lie in the categories it `covered`;
+    categories whose listing held an `unfinished` product are excluded."""
+    record_listings(conn, run_id, listings)
     stale = []
-    if not limit and not max_categories:
+    if full_run:
         stale = soft_delete_unseen(conn, run_started_at)
+        prune_listings(conn, run_id)
         if stale:
-            print(f"\nSoft-deleted {len(stale)} stale products not seen in this run")
+            log.info("run.retired", "\nSoft-deleted {stale} stale products not seen in this run", stale=len(stale))
     else:
-        print("\nPartial run — skipping soft delete")
+        scopes = record_run_scopes(conn, run_id, covered, unfinished)
+        if scopes:
+            stale = soft_delete_unseen_in_scopes(conn, run_id, run_started_at)
+            log.info("run.retired", "\nPartial run — soft-deleted {stale} stale products in {scopes} "
+                     "fully covered categories", stale=len(stale), scopes=scopes)
+        else:
+            log.info("run.retired", "\nPartial run, no category fully covered — skipping soft delete",
+                     stale=0, scopes=0)
     
-    update_category_counts(conn)
-    finish_run(conn, run_id, total_scraped, total_errors)
-    print(f"\n✅ Done. Scraped: {total_scraped}, Errors: {total_errors}, Stale: {len(stale) if stale else 0}")
+    stats = {"search_vectors": refresh_search_vectors(conn)}
+    if IMAGE_DIR:
+        # Before the category images and summaries pick up product thumbnails
+        try:
+            stats["images_localized"] = localize_images(conn, IMAGE_DIR)
+        except Exception as e:
+            conn.rollback()
+            log.error("finalize.error", "\nERROR localizing images: {error}", stage="images", error=str(e))
+    stats["stale"] = len(stale)
+    try:
+        stats["changes_pruned"] = prune_changes(conn)
+    except Exception as e:
+        conn.rollback()
+        log.error("finalize.error", "\nERROR pruning the change feed: {error}", stage="changefeed", error=str(e))
+    try:
+        stats["history_rolled_up"] = rollup_history(conn)
+    except Exception as e:
+        conn.rollback()
+        log.error("finalize.error", "\nERROR rolling up price history: {error}", stage="history", error=str(e))
+    stats.update({
+        "category_counts_changed": update_category_counts(conn),
+        "category_images_filled": fill_category_images(conn),
+    })
+    try:
+        timings = refresh_summary_views(conn)
+        stats["summary_refresh_ms"] = timings
+        if timings:
+            log.info("summary.refreshed", "Refreshed summary views: {views}",
+                     views=", ".join(f"{view} {ms}ms" for view, ms in timings.items()), timings_ms=timings)
+    except Exception as e:
+        conn.rollback()
+        log.error("finalize.error", "\nERROR refreshing summary views: {error}", stage="summary", error=str(e))
+    try:
+        stats["similar_rescored"] = update_similar_products(conn)
+    except Exception as e:
+        conn.rollback()
+        log.error("finalize.error", "\nERROR updating similar products: {error}", stage="similar", error=str(e))
+    try:
+        stats["autocomplete"] = build_autocomplete(conn)
+    except Exception as e:
+        conn.rollback()
+        log.error("finalize.error", "\nERROR building autocomplete index: {error}", stage="autocomplete",
+                  error=str(e))
+    try:
+        stats["bundle_orders_counted"] = update_bundles(conn)
+    except Exception as e:
+        conn.rollback()
+        log.error("finalize.error", "\nERROR updating co-purchase bundles: {error}", stage="bundles", error=str(e))
+    if SNAPSHOT_DIR:
+        try:
+            stats["snapshot"] = publish_snapshot(conn, SNAPSHOT_DIR)["version"]
+        except Exception as e:
+            conn.rollback()
+            log.error("finalize.error", "\nERROR publishing catalog snapshot: {error}", stage="snapshot",
+                      error=str(e))
+    finish_run(conn, run_id, total_scraped, total_errors, stats=stats)
+    log.info("run.done", "\n✅ Done. Scraped: {scraped}, Errors: {errors}, Stale: {stale}",
+             scraped=total_scraped, errors=total_errors, stale=len(stale) if stale else 0)
+
+
+def refresh_products_chunk(items, worker_id, catalog_index):
+    """Worker function for --priority: re-scrape known product URLs, keeping their stored category."""
+    conn = get_connection()
+    writer = ProductWriter(conn, catalog_index)
+    status, scraped, errors = scrape_product_list(
+        items, worker_id, writer, lambda category_id, data, i: category_id,
+    )
+    errors += flush_writer(writer, worker_id)
+    conn.close()
+    return {"status": status, "scraped": scraped, "errors": errors, "worker": worker_id}
+
+
+def run_priority_refresh(budget=REFRESH_BUDGET, num_workers=5):
+    """Spend a fixed request budget on the products that matter most: ranked by
+    order volume, order recency and price/stock churn, refreshed per tier cadence."""
+    conn = get_connection()
+    ensure_tables(conn)
+    run_id = start_run(conn)
+    run_started_at = datetime.now(timezone.utc)
+
+    candidates = load_candidates(conn)
+    due = select_due(candidates, budget)
+    tiers = Counter(c["tier"] for c in due)
+    log.info("refresh.start", "Priority refresh {run}: {due}/{candidates} products due within budget {budget} "
+             "({tiers})\n", run=run_id, due=len(due), candidates=len(candidates), budget=budget,
+             tiers=", ".join(f"tier {t + 1}: {n}" for t, n in sorted(tiers.items())))
+
+    catalog_index = load_catalog_index(conn)
+    items = [(c["external_id"], c["url"], c["category_id"]) for c in due]
+    # Round-robin so every worker starts on the top of the ranking
+    chunks = [items[w::num_workers] for w in range(num_workers) if items[w::num_workers]]
+
+    total_scraped = 0
+    total_errors = 0
+    blocked = False
+    log.start_progress("refresh", total=len(items))
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(refresh_products_chunk, chunk, wid, catalog_index)
+                   for wid, chunk in enumerate(chunks)]
+        for future in as_completed(futures):
+            result = future.result()
+            total_scraped += result["scraped"]
+            total_errors += result["errors"]
+            blocked = blocked or result["status"] == "blocked"
+    log.finish_progress()
+
+    if blocked:
+        refresh_search_vectors(conn)
+        finish_run(conn, run_id, total_scraped, total_errors, "blocked")
+        conn.close()
+        sys.exit(1)
+    finalize_run(conn, run_id, run_started_at, total_scraped, total_errors, full_run=False)
+    conn.close()
+
+
+def run_queue_coordinator(max_pages=None, max_categories=None, save_tree=False, poll_seconds=10, shard=None):
+    """Queue mode, coordinator side: start a run, queue one job per leaf category,
+    wait for workers (any number, on any machine) to drain the queue, then finalize."""
+    conn = get_connection()
+    ensure_tables(conn)
+    ensure_job_tables(conn)
+    run_id = start_run(conn)
+    run_started_at = datetime.now(timezone.utc)
+
+    tree = get_top_categories()
+    if save_tree:
+        save_category_tree(conn, tree)
+    leaves = select_shard(leaf_categories(tree), shard)
+    if max_categories:
+        leaves = leaves[:max_categories]
+
+    queued = enqueue_jobs(conn, run_id, "category", [
+        (cat["id"], {"category": cat, "max_pages": max_pages}) for cat in leaves
+    ])
+    log.info("run.start", "Scraper run started: {run} — queued {queued} category jobs\n"
+             "Start workers with: python main.py --queue worker --run-id {run}\n", run=run_id, queued=queued)
+
+    while True:
+        fail_exhausted_jobs(conn, run_id)
+        progress = run_progress(conn, run_id)
+        open_jobs = sum(n for (_, status), n in progress.items() if status in ("pending", "running"))
+        log.info("queue.progress", "  {summary}",
+                 summary=", ".join(f"{kind} {status}: {n}" for (kind, status), n in sorted(progress.items())),
+                 jobs={f"{kind}.{status}": n for (kind, status), n in progress.items()})
+        if not open_jobs:
+            break
+        time.sleep(poll_seconds)
+
+    total_scraped = progress.get(("product", "done"), 0)
+    total_errors = progress.get(("product", "failed"), 0) + progress.get(("category", "failed"), 0)
+    # A failed listing means some products were never queued, so nothing may be retired
+    full_run = not max_categories and not shard and not progress.get(("category", "failed"))
+    listed, failed = run_coverage(conn, run_id)
+    categories = CategoryResolver(conn)
+    covered = [categories.id_for(cat) for cat in listed]
+    finalize_run(conn, run_id, run_started_at, total_scraped, total_errors, full_run,
+                 covered=covered, unfinished=failed)
+    conn.close()
+
+
+def run_queue_worker(run_id=None, num_threads=1, claim_batch=10):
+    """Queue mode, worker side: claim and process jobs until the run's queue is empty."""
+    conn = get_connection()
+    ensure_job_tables(conn)
+    run_id = run_id or latest_queued_run(conn)
+    if not run_id:
+        log.info("queue.empty", "No queued run to work on")
+        conn.close()
+        return
+    catalog_index = load_catalog_index(conn)
     conn.close()
+    tree_index = breadcrumb_index(get_top_categories())
+
+    log.info("worker.start", "Working on run {run} with {threads} threads", run=run_id, threads=num_threads)
+    log.start_progress("queue")
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        futures = [executor.submit(queue_worker_loop, run_id, catalog_index, tree_index, claim_batch)
+                   for _ in range(num_threads)]
+        results = [f.result() for f in futures]
+    log.finish_progress()
+
+    log.info("worker.done", "\nWorker done. Scraped: {scraped}, Errors: {errors}",
+             scraped=sum(r["scraped"] for r in results), errors=sum(r["errors"] for r in results))
+    if any(r["status"] == "blocked" for r in results):
+        sys.exit(1)
+
+
+def queue_worker_loop(run_id, catalog_index, tree_index, claim_batch):
+    conn = get_connection()
+    writer = ProductWriter(conn, catalog_index)
+    categories = CategoryResolver(conn, tree_index)
+    worker = worker_name()
+    beat = Heartbeat(worker).start()
+    scraped = 0
+    errors = 0
+    status = "ok"
+
+    try:
+        while status == "ok":
+            jobs = claim_jobs(conn, run_id, worker, claim_batch)
+            if not jobs:
+                progress = run_progress(conn, run_id)
+                if not any(s in ("pending", "running") for (_, s) in progress):
+                    break
+                time.sleep(5)  # others still hold leases or jobs are backing off
+                continue
+
+            beat.hold(job_id for job_id, *_ in jobs)
+            done = []
+            for n, (job_id, kind, payload, attempts) in enumerate(jobs):
+                try:
+                    if kind == "category":
+                        cat = payload["category"]
+                        failed_pages = []
+                        urls = get_product_urls_from_category(cat["url"], max_pages=payload.get("max_pages"),
+                                                              failed_pages=failed_pages)
+                        enqueue_jobs(conn, run_id, "product", [
+                            (ext_id, {"external_id": ext_id, "url": url, "category": cat}) for ext_id, url in urls
+                        ])
+                        leaf_id = categories.id_for(cat)
+                        record_listings(conn, run_id, [(leaf_id, ext_id) for ext_id, _ in urls])
+                        log.info("category.listed", "[{worker}] {category}: {found} products queued",
+                                 worker=worker, category=cat["name"], found=len(urls))
+                        if failed_pages:
+                            # Retry the listing so the category can still count as covered
+                            raise TransientError(f"listing pages {sorted(failed_pages)} failed", cat["url"])
+                    else:
+                        data = scrape_product(payload["url"], payload["external_id"])
+                        if data.get("price"):
+                            writer.add(data, categories.id_for_product(payload["category"], data))
+                            scraped += 1
+                            log.sample("product.ok", "[{worker}]   OK: {name:.50} | {price} EUR",
+                                       worker=worker, url=payload["url"], name=data["name"], price=data["price"])
+                        log.progress.done(worker)
+                    done.append(job_id)
+                except Cancelled:
+                    log.warning("worker.cancelled",
+                                "[{worker}]   CANCELLED (site kept blocking us). Releasing jobs and stopping.",
+                                worker=worker)
+                    release_jobs(conn, [j[0] for j in jobs[n:]], worker)
+                    status = "blocked"
+                    break
+                except PermanentError as e:
+                    errors += 1
+                    log.progress.error(worker)
+                    log.error("job.fail", "[{worker}]   FAILED job {job}: {error}",
+                              worker=worker, job=job_id, error=str(e))
+                    fail_job(conn, job_id, worker, e)
+                except Exception as e:
+                    conn.rollback()
+                    errors += 1
+                    log.progress.error(worker)
+                    if isinstance(e, RateLimited) and e.retry_after:
+                        wait = e.retry_after
+                    else:
+                        wait = RATE_LIMIT_SECONDS * (BACKOFF_FACTOR ** (attempts - 1))
+                    log.warning("job.retry", "[{worker}]   ERROR on job {job} (attempt {attempt}), retry in {wait:.0f}s: {error}",
+                                worker=worker, job=job_id, attempt=attempts, wait=wait, error=str(e))
+                    fail_job(conn, job_id, worker, e, retry_in=wait)
+
+            # Rows must be written before their jobs are marked done
+            if flush_writer(writer, worker):
+                errors += 1
+                for job_id in done:
+                    fail_job(conn, job_id, worker, "batch write failed", retry_in=RATE_LIMIT_SECONDS)
+            else:
+                complete_jobs(conn, done, worker)
+            beat.drop(job_id for job_id, *_ in jobs)
+    finally:
+        beat.stop()
+        conn.close()
+
+    return {"status": status, "scraped": scraped, "errors": errors}
 
 
 if __name__ == "__main__":
@@ -227,6 +641,55 @@ if __name__ == "__main__":
     parser.add_argument("--limit", type=int, help="Max products to scrape")
     parser.add_argument("--max-pages", type=int, help="Max pages per category (default: all)")
     parser.add_argument("--max-categories", type=int, help="Max categories to crawl (default: all)")
+    parser.add_argument("--shard", type=parse_shard, metavar="K/N",
+                        help="Crawl only shard K of N of the leaf categories; stale products are retired per covered category")
     parser.add_argument("--workers", type=int, default=5, help="Number of parallel workers (default: 5)")
+    parser.add_argument("--save-tree", action="store_true", help="Persist parent categories and parent links")
+    parser.add_argument("--sink", choices=SINKS, default="postgres",
+                        help="Where products go (default: postgres); jsonl/parquet need no database")
+    parser.add_argument("--output", metavar="PATH", help="Export file for --sink jsonl/parquet (.jsonl.gz to compress)")
+    parser.add_argument("--archive", metavar="DIR", default=ARCHIVE_DIR,
+                        help="Archive raw pages under DIR (default: $ARCHIVE_DIR, off if unset)")
+    parser.add_argument("--keep-runs", type=int, default=ARCHIVE_KEEP_RUNS,
+                        help=f"Archived runs to retain (default: {ARCHIVE_KEEP_RUNS})")
+    parser.add_argument("--queue", choices=["coordinator", "worker"],
+                        help="Distributed mode: coordinate a queued run, or work on one")
+    parser.add_argument("--run-id", help="Queued run to work on (default: most recent with open jobs)")
+    parser.add_argument("--priority", action="store_true",
+                        help="Refresh known products by demand-weighted priority instead of crawling")
+    parser.add_argument("--budget", type=int, default=REFRESH_BUDGET,
+                        help=f"Max product requests for --priority (default: {REFRESH_BUDGET})")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Run continuously, revisiting each product on its own adaptive schedule")
+    parser.add_argument("--health-port", type=int, default=DAEMON_HEALTH_PORT,
+                        help=f"Health endpoint port for --daemon (default: {DAEMON_HEALTH_PORT})")
+    parser.add_argument("--bulk-load", action=argparse.BooleanOptionalAction, default=BULK_LOAD,
+                        help="Compute search vectors once at the end of the run instead of per written row "
+                             "(default: on, $BULK_LOAD=0 to turn off; never used by --daemon)")
+    parser.add_argument("--log-format", choices=["text", "json"], default=LOG_FORMAT,
+                        help=f"Worker event lines as text or JSON (default: $LOG_FORMAT or {LOG_FORMAT})")
+    parser.add_argument("--log-sample", type=int, default=LOG_SAMPLE_EVERY, metavar="N",
+                        help=f"Keep one per-product line in N (default: {LOG_SAMPLE_EVERY}); failures are always kept")
     args = parser.parse_args()
-    run_scraper_parallel(limit=args.limit, max_pages=args.max_pages, max_categories=args.max_categories, num_workers=args.workers)
+    log.configure(fmt=args.log_format, sample_every=args.log_sample)
+    if args.sink != "postgres" and not args.output:
+        parser.error(f"--sink {args.sink} needs --output")
+    if args.sink != "postgres" and (args.daemon or args.priority or args.queue):
+        parser.error("--sink only applies to a regular crawl")
+    if args.limit and (args.queue or args.daemon or args.priority):
+        parser.error("--limit only applies to a regular crawl (use --max-categories or --shard with --queue)")
+    set_bulk_load(args.bulk_load and not args.daemon)
+    if args.daemon:
+        run_daemon(health_port=args.health_port)
+    elif args.priority:
+        run_priority_refresh(budget=args.budget, num_workers=args.workers)
+    elif args.queue == "coordinator":
+        run_queue_coordinator(max_pages=args.max_pages, max_categories=args.max_categories,
+                              save_tree=args.save_tree, shard=args.shard)
+    elif args.queue == "worker":
+        run_queue_worker(run_id=args.run_id, num_threads=args.workers)
+    else:
+        run_scraper_parallel(limit=args.limit, max_pages=args.max_pages, max_categories=args.max_categories,
+                             num_workers=args.workers, save_tree=args.save_tree,
+                             archive_dir=args.archive, keep_runs=args.keep_runs, shard=args.shard,
+                             sink=args.sink, output=args.output)
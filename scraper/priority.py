@@ -0,0 +1,71 @@
+import math
+from config import REFRESH_TIERS, DEMAND_WINDOW_DAYS
+
+# Demand-weighted refresh: products people actually order (and whose price or
+# stock keeps moving) are re-scraped first and most often.
+W_VOLUME = 1.0     # log units ordered in the demand window
+W_RECENCY = 2.0    # decays with days since the product was last ordered
+W_CHURN = 0.5      # log number of observed price/stock changes
+RECENCY_HALF_LIFE_DAYS = 14
+
+
+def priority_score(units, days_since_order, changes):
+    recency = 0.0
+    if days_since_order is not None:
+        recency = 0.5 ** (days_since_order / RECENCY_HALF_LIFE_DAYS)
+    return (W_VOLUME * math.log1p(units or 0)
+            + W_RECENCY * recency
+            + W_CHURN * math.log1p(changes or 0))
+
+
+def load_candidates(conn):
+    """Every refreshable product with its demand signals, as dicts. Retired
+    products are left out: only a crawl that finds them listed again revives them."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            WITH demand AS (
+                SELECT oi.product_id, SUM(oi.quantity) AS units, MAX(o.created_at) AS last_ordered
+                FROM order_items oi
+                JOIN orders o ON o.id = oi.order_id
+                WHERE o.created_at > NOW() - make_interval(days => %s)
+                GROUP BY oi.product_id
+            )
+            SELECT p.external_id, p.source_url, p.category_id,
+                   EXTRACT(EPOCH FROM NOW() - p.last_seen_at) / 3600,
+                   COALESCE(d.units, 0),
+                   EXTRACT(EPOCH FROM NOW() - d.last_ordered) / 86400,
+                   COALESCE(p.price_stock_changes, 0)
+            FROM products p
+            LEFT JOIN demand d ON d.product_id = p.id::text
+            WHERE p.available = TRUE AND p.source_url IS NOT NULL AND p.external_id IS NOT NULL
+        """, (DEMAND_WINDOW_DAYS,))
+        rows = cur.fetchall()
+
+    return [{
+        "external_id": ext_id,
+        "url": url,
+        "category_id": category_id,
+        "hours_since_seen": float(hours) if hours is not None else None,
+        "score": priority_score(units, float(days) if days is not None else None, changes),
+    } for ext_id, url, category_id, hours, units, days, changes in rows]
+
+
+def assign_tiers(candidates):
+    """Rank by score and split into REFRESH_TIERS by cumulative share."""
+    ranked = sorted(candidates, key=lambda c: c["score"], reverse=True)
+    total = len(ranked)
+    for rank, c in enumerate(ranked):
+        share = (rank + 1) / total
+        c["tier"] = next(i for i, (upto, _) in enumerate(REFRESH_TIERS) if share <= upto or upto >= 1.0)
+    return ranked
+
+
+def select_due(candidates, budget):
+    """Products whose tier interval has elapsed, top tier (then score) first, capped at budget."""
+    due = []
+    for c in assign_tiers(candidates):
+        interval_hours = REFRESH_TIERS[c["tier"]][1]
+        if c["hours_since_seen"] is None or c["hours_since_seen"] >= interval_hours:
+            due.append(c)
+    due.sort(key=lambda c: (c["tier"], -c["score"]))
+    return due[:budget]
@@ -1,14 +1,8 @@
 import json
 import re
-import requests
 from bs4 import BeautifulSoup
-from config import HEADERS, REQUEST_TIMEOUT, STOCK_MAP, BASE_URL
-
-
-def fetch_page(url):
-    resp = requests.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT)
-    resp.raise_for_status()
-    return resp.text
+from config import STOCK_MAP, BASE_URL
+from fetch import fetch_page
 
 
 def parse_price(text):
@@ -166,7 +160,10 @@ def slugify(text):
 
 
 def scrape_product(url, external_id):
-    html = fetch_page(url)
+    return parse_product(fetch_page(url), url, external_id)
+
+
+def parse_product(html, url, external_id):
     soup = BeautifulSoup(html, "lxml")
 
     name_el = soup.select_one("h1.product-detail-name, h1[itemprop='name'], h1")
@@ -0,0 +1,146 @@
+import os
+import re
+import argparse
+import time
+from collections import Counter
+from decimal import Decimal
+from multiprocessing import Pool
+
+from product import parse_product
+from archive import ArchiveReader
+from ingest import content_hash
+from db import get_connection, ensure_tables, fetch_products, update_reparsed_products
+from config import ARCHIVE_DIR, PRODUCT_URL_PATTERN, INGEST_BATCH_SIZE
+
+# Whether a product changed is decided by its content hash, which covers the
+# parser's raw output; these fields only break the changes down in the summary.
+# The stored columns may have been normalized by clean.py since.
+DIFF_FIELDS = (
+    "name", "sku", "description", "short_desc", "price", "original_price",
+    "discount_percent", "stock_status", "images", "thumbnail", "available",
+    "brand", "weight", "tags",
+)
+
+_reader = None
+
+
+def _init_worker(archive_dir):
+    global _reader
+    _reader = ArchiveReader(archive_dir)
+
+
+def _parse_entry(entry):
+    """Runs in a pool process: read one archived page and parse it."""
+    run_id, url, segment, offset, length = entry
+    match = re.search(r"/en/(\d+)-", url)
+    if not match:
+        return None
+    try:
+        _, body = _reader.read(run_id, segment, offset, length)
+        return parse_product(body.decode("utf-8", errors="replace"), url, match.group(1))
+    except Exception as e:
+        return {"error": f"{url}: {e}"}
+
+
+def _normalize(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return value
+
+
+def diff_fields(stored, data):
+    return [f for f in DIFF_FIELDS if _normalize(stored.get(f)) != _normalize(data.get(f))]
+
+
+def reparse_run(archive_dir, run_id=None, workers=None, dry_run=False, batch_size=INGEST_BATCH_SIZE):
+    reader = ArchiveReader(archive_dir)
+    run_id = run_id or reader.latest_run()
+    if not run_id:
+        print(f"No archived runs in {archive_dir}")
+        return
+    latest = {}
+    for url, segment, offset, length in reader.entries(run_id):
+        if re.search(PRODUCT_URL_PATTERN, url):
+            latest[url] = (run_id, url, segment, offset, length)
+    reader.close()
+    entries = list(latest.values())
+    workers = workers or os.cpu_count()
+    print(f"{'DRY RUN — ' if dry_run else ''}Re-parsing {len(entries)} product pages "
+          f"from run {run_id} on {workers} processes\n")
+
+    conn = get_connection()
+    ensure_tables(conn)
+
+    changed_fields = Counter()
+    examples = {}
+    parsed = errors = missing = retired = changed = written = 0
+    started = time.monotonic()
+
+    def process(batch):
+        nonlocal missing, retired, changed, written
+        stored = fetch_products(conn, [d["external_id"] for d in batch],
+                                ("category_id", "content_hash") + DIFF_FIELDS)
+        updates = []
+        for data in batch:
+            row = stored.get(data["external_id"])
+            if row is None:
+                missing += 1  # never ingested live, so there is no category to attach it to
+                continue
+            if not row["available"]:
+                retired += 1  # soft-deleted; only a live crawl brings it back
+                continue
+            h = content_hash(data, row["category_id"])
+            if h == row["content_hash"]:
+                continue
+            changed += 1
+            fields = diff_fields(row, data)
+            changed_fields.update(fields)
+            for f in fields:
+                examples.setdefault(f, (data["external_id"], row.get(f), data.get(f)))
+            updates.append((data, h))
+        if not dry_run:
+            written += update_reparsed_products(conn, updates)
+
+    batch = []
+    with Pool(workers, initializer=_init_worker, initargs=(archive_dir,)) as pool:
+        for data in pool.imap_unordered(_parse_entry, entries, chunksize=16):
+            if data is None:
+                continue
+            if "error" in data:
+                errors += 1
+                print(f"  ERROR {data['error']}")
+                continue
+            if not data.get("price"):
+                continue
+            parsed += 1
+            batch.append(data)
+            if len(batch) >= batch_size:
+                process(batch)
+                batch = []
+                print(f"  ... parsed {parsed}/{len(entries)}, {changed} changed")
+        if batch:
+            process(batch)
+
+    conn.close()
+
+    print(f"\nParsed {parsed} products in {time.monotonic() - started:.1f}s "
+          f"({errors} errors, {missing} not in catalog, {retired} retired)")
+    print(f"{changed} products changed{' (not written)' if dry_run else f', {written} written'}")
+    for field, count in changed_fields.most_common():
+        ext_id, old, new = examples[field]
+        print(f"  {field:<18} {count:>6}   e.g. #{ext_id}: {str(old)[:40]!r} → {str(new)[:40]!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-parse archived product pages with the current parser")
+    parser.add_argument("--archive", metavar="DIR", default=ARCHIVE_DIR,
+                        help="Archive directory (default: $ARCHIVE_DIR)")
+    parser.add_argument("--run", help="Archived run id (default: latest)")
+    parser.add_argument("--workers", type=int, help="Parser processes (default: all cores)")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the diff summary")
+    args = parser.parse_args()
+    if not args.archive:
+        parser.error("--archive or ARCHIVE_DIR is required")
+    reparse_run(args.archive, run_id=args.run, workers=args.workers, dry_run=args.dry_run)
@@ -0,0 +1,265 @@
+import re
+import time
+import hashlib
+import argparse
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+import psycopg2.extras
+
+from product import STOP_WORDS
+from db import get_connection, column_type
+from events import log
+from config import SIMILAR_TOP_K, SIMILAR_MIN_SCORE, SIMILAR_BLOCK_SIZE, SIMILAR_FULL_EVERY_DAYS
+
+# Precomputed "similar products": a TF-IDF vector per available product over its
+# name words, tags, brand and category, and its top-k cosine neighbours stored in
+# product_similar so a recommendation is one indexed lookup. Incremental runs
+# rescore products whose features changed, those that had a changed or removed
+# product among their neighbours, and those a changed product now scores high
+# enough against to enter their top k. IDF weights still drift as the catalog
+# grows, so once the oldest stored neighbour list is SIMILAR_FULL_EVERY_DAYS old
+# the run rescores everything (as --full does).
+
+# Extra weight of the brand and category tokens relative to one name word
+BRAND_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.5
+
+
+def ensure_similar_tables(conn):
+    with conn.cursor() as cur:
+        # products.id is UUID when created by db.ensure_tables but TEXT under the Prisma schema
+        id_type = column_type(cur, "products", "id")
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS product_similar (
+                product_id {id_type} NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+                rank SMALLINT NOT NULL,
+                similar_id {id_type} NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+                score REAL NOT NULL,
+                PRIMARY KEY (product_id, rank)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_product_similar_similar ON product_similar (similar_id)")
+        # The feature hash each product's neighbours were last computed from
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS product_similar_sources (
+                product_id {id_type} PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+                features_hash TEXT NOT NULL,
+                computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+    conn.commit()
+    return id_type
+
+
+def product_tokens(name, brand, tags, category_id):
+    """Weighted bag of tokens for one product."""
+    tokens = Counter()
+    brand_lower = brand.lower() if brand else ""
+    for w in re.split(r"[\s\-/]+", name.lower()):
+        w = re.sub(r"[^\w]", "", w)
+        if w and w not in STOP_WORDS and len(w) > 2 and w != brand_lower and not w.isdigit():
+            tokens[w] += 1.0
+    for tag in tags or []:
+        tokens[tag] += 1.0
+    if brand_lower:
+        tokens["brand:" + brand_lower] += BRAND_WEIGHT
+    if category_id:
+        tokens["category:" + category_id] += CATEGORY_WEIGHT
+    return tokens
+
+
+def features_hash(tokens):
+    return hashlib.md5(repr(sorted(tokens.items())).encode("utf-8")).hexdigest()
+
+
+def load_products(conn):
+    """[(id, tokens)] for every available product."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id::text, name, brand, tags, category_id::text
+            FROM products WHERE available = TRUE
+            ORDER BY id
+        """)
+        return [(pid, product_tokens(name, brand, tags, cat)) for pid, name, brand, tags, cat in cur.fetchall()]
+
+
+def tfidf_matrix(docs):
+    """L2-normalized TF-IDF rows (CSR, float32) for a list of token Counters."""
+    vocab = {}
+    indptr = [0]
+    indices = []
+    data = []
+    for tokens in docs:
+        for token, weight in tokens.items():
+            indices.append(vocab.setdefault(token, len(vocab)))
+            data.append(weight)
+        indptr.append(len(indices))
+    tf = sp.csr_matrix(
+        (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+        shape=(len(docs), len(vocab)),
+    )
+    df = np.bincount(tf.indices, minlength=len(vocab))
+    idf = (np.log((1 + len(docs)) / (1 + df)) + 1).astype(np.float32)
+    matrix = tf @ sp.diags(idf)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sp.csr_matrix(sp.diags(1 / norms) @ matrix, dtype=np.float32)
+
+
+def top_neighbours(matrix, rows, k=SIMILAR_TOP_K, min_score=SIMILAR_MIN_SCORE, block_size=SIMILAR_BLOCK_SIZE):
+    """Yields (row, [(neighbour_row, score), ...]) best first, scoring `rows` against
+    the whole matrix one dense block at a time."""
+    n = matrix.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        return
+    for start in range(0, len(rows), block_size):
+        block = np.asarray(rows[start:start + block_size])
+        # sparse (n x V) @ dense (V x block) lands straight in a dense array
+        scores = np.ascontiguousarray((matrix @ matrix[block].T.toarray()).T)
+        scores[np.arange(len(block)), block] = -1  # never your own neighbour
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        for i, row in enumerate(block):
+            keep = top_scores[i] >= min_score
+            yield int(row), list(zip(top[i][keep].tolist(), top_scores[i][keep].tolist()))
+
+
+def stale_products(conn, id_type, ids, hashes, matrix, k=SIMILAR_TOP_K,
+                   min_score=SIMILAR_MIN_SCORE, block_size=SIMILAR_BLOCK_SIZE):
+    """Ids of available products whose neighbours need rescoring, and ids that
+    are no longer available (to drop)."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT product_id::text, features_hash FROM product_similar_sources")
+        stored = dict(cur.fetchall())
+        changed = [pid for pid, h in hashes.items() if stored.get(pid) != h]
+        removed = [pid for pid in stored if pid not in hashes]
+        cur.execute(f"""
+            SELECT DISTINCT product_id::text FROM product_similar
+            WHERE similar_id = ANY(%s::{id_type}[])
+        """, (changed + removed,))
+        affected = {pid for (pid,) in cur.fetchall() if pid in hashes}
+        # The score a newcomer has to beat: the k-th neighbour's, or the floor
+        # for products with fewer than k
+        cur.execute("""
+            SELECT product_id::text, CASE WHEN COUNT(*) >= %s THEN MIN(score) END
+            FROM product_similar GROUP BY product_id
+        """, (k,))
+        position = {pid: i for i, pid in enumerate(ids)}
+        bar = np.full(len(ids), min_score, dtype=np.float32)
+        for pid, score in cur.fetchall():
+            if score is not None and pid in position:
+                bar[position[pid]] = max(score, min_score)
+    # Products sharing tokens with a changed product may now rank it in their top k
+    for start in range(0, len(changed), block_size):
+        block = [position[pid] for pid in changed[start:start + block_size]]
+        best = np.asarray((matrix @ matrix[block].T).max(axis=1).todense()).ravel()
+        affected.update(ids[row] for row in np.nonzero(best >= bar)[0])
+    return sorted(affected.union(changed)), removed
+
+
+def full_rescore_due(conn, days=SIMILAR_FULL_EVERY_DAYS):
+    """True when the oldest stored neighbour list is more than `days` old."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT MIN(computed_at) < NOW() - make_interval(days => %s)
+            FROM product_similar_sources
+        """, (days,))
+        return bool(cur.fetchone()[0])
+
+
+def update_similar_products(conn, full=False, k=SIMILAR_TOP_K, block_size=SIMILAR_BLOCK_SIZE,
+                            full_every_days=SIMILAR_FULL_EVERY_DAYS):
+    """Recompute product_similar for products whose neighbours may have changed
+    (everything when `full`, or when the last full rescore is older than
+    `full_every_days`). Returns the number of products rescored."""
+    id_type = ensure_similar_tables(conn)
+    started = time.monotonic()
+    products = load_products(conn)
+    ids = [pid for pid, _ in products]
+    hashes = {pid: features_hash(tokens) for pid, tokens in products}
+    matrix = tfidf_matrix([tokens for _, tokens in products])
+
+    if not full and full_every_days and full_rescore_due(conn, full_every_days):
+        log.info("similar.full_due", "Similar products: last full rescore over {days} days ago, rescoring everything",
+                 days=full_every_days)
+        full = True
+    if full:
+        targets = ids
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                DELETE FROM product_similar_sources
+                WHERE NOT (product_id = ANY(%s::{id_type}[]))
+            """, (ids,))
+            cur.execute(f"""
+                DELETE FROM product_similar
+                WHERE NOT (product_id = ANY(%s::{id_type}[]))
+            """, (ids,))
+    else:
+        targets, removed = stale_products(conn, id_type, ids, hashes, matrix, k=k, block_size=block_size)
+        if removed:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    DELETE FROM product_similar
+                    WHERE product_id = ANY(%(ids)s::{id_type}[]) OR similar_id = ANY(%(ids)s::{id_type}[])
+                """, {"ids": removed})
+                cur.execute(f"DELETE FROM product_similar_sources WHERE product_id = ANY(%s::{id_type}[])", (removed,))
+    conn.commit()
+    if not targets:
+        return 0
+
+    position = {pid: i for i, pid in enumerate(ids)}
+    rows = [position[pid] for pid in targets]
+
+    done = 0
+    pending = []
+    for row, neighbours in top_neighbours(matrix, rows, k=k, block_size=block_size):
+        pending.append((ids[row], neighbours))
+        if len(pending) >= block_size:
+            done += _save_neighbours(conn, id_type, ids, hashes, pending)
+            pending = []
+    done += _save_neighbours(conn, id_type, ids, hashes, pending)
+    log.info("similar.done", "Similar products: rescored {done} of {products} in {seconds:.1f}s",
+             done=done, products=len(ids), seconds=time.monotonic() - started)
+    return done
+
+
+def _save_neighbours(conn, id_type, ids, hashes, pending):
+    if not pending:
+        return 0
+    product_ids = [pid for pid, _ in pending]
+    rows = [
+        (pid, rank, ids[neighbour], score)
+        for pid, neighbours in pending
+        for rank, (neighbour, score) in enumerate(neighbours, 1)
+    ]
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM product_similar WHERE product_id = ANY(%s::{id_type}[])", (product_ids,))
+        if rows:
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO product_similar (product_id, rank, similar_id, score) VALUES %s
+            """, rows, page_size=1000)
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO product_similar_sources (product_id, features_hash) VALUES %s
+            ON CONFLICT (product_id) DO UPDATE SET
+                features_hash = EXCLUDED.features_hash,
+                computed_at = NOW()
+        """, [(pid, hashes[pid]) for pid in product_ids], page_size=1000)
+    conn.commit()
+    return len(pending)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute similar products (TF-IDF over names, tags, brand, category)")
+    parser.add_argument("--full", action="store_true", help="Rescore every product, not just the changed ones")
+    parser.add_argument("--top-k", type=int, default=SIMILAR_TOP_K,
+                        help=f"Neighbours kept per product (default: {SIMILAR_TOP_K})")
+    args = parser.parse_args()
+    conn = get_connection()
+    update_similar_products(conn, full=args.full, k=args.top_k)
+    conn.close()
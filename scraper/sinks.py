@@ -0,0 +1,189 @@
+import gzip
+import json
+import threading
+from datetime import datetime, timezone
+
+from categories import CategoryResolver
+from ingest import ProductWriter
+from sitemap import deepest_category
+from db import get_connection, PRODUCT_FIELDS
+from config import INGEST_BATCH_SIZE
+
+# Where scraped products go. Every sink hands each worker its own writer with the
+# ProductWriter interface (add / flush / rollback / written / touched / failed)
+# plus category_for(listed_in, data, order) and category_id(cat). File sinks need
+# no database: rows are exported with their category slug and name, and
+# load.py COPYs them into Postgres later.
+
+SINKS = ("postgres", "jsonl", "parquet")
+
+
+class PostgresWriter(ProductWriter):
+    """ProductWriter on its own connection, resolving categories to row ids."""
+
+    def __init__(self, conn, catalog_index, tree_index=None):
+        super().__init__(conn, catalog_index)
+        self.categories = CategoryResolver(conn, tree_index)
+        self.category_for = self.categories.id_for_product
+
+    def category_id(self, cat):
+        return self.categories.id_for(cat)
+
+    def close(self):
+        self.conn.close()
+
+
+class PostgresSink:
+    def __init__(self, catalog_index, tree_index=None):
+        self.catalog_index = catalog_index
+        self.tree_index = tree_index
+
+    def open_writer(self):
+        return PostgresWriter(get_connection(), self.catalog_index, self.tree_index)
+
+    def close(self):
+        pass
+
+
+def export_record(data, category):
+    """The flat row written by file sinks."""
+    record = {field: data.get(field) for field in PRODUCT_FIELDS}
+    record["category_slug"] = category["slug"] if category else None
+    record["category_name"] = category["name"] if category else None
+    record["scraped_at"] = datetime.now(timezone.utc)
+    return record
+
+
+class FileWriter:
+    """Per-worker buffer in front of a shared file sink; hands it full batches."""
+
+    def __init__(self, sink, tree_index=None, batch_size=INGEST_BATCH_SIZE):
+        self.sink = sink
+        self.tree_index = tree_index
+        self.batch_size = batch_size
+        self.buffer = []
+        self.written = 0
+        self.touched = 0
+        self.failed = 0
+
+    def category_for(self, listed_in, data, display_order=0):
+        if self.tree_index:
+            return deepest_category(self.tree_index, listed_in, data.get("categories", []))
+        return listed_in
+
+    def category_id(self, cat):
+        return cat["slug"]
+
+    def add(self, data, category):
+        self.buffer.append(export_record(data, category))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return True  # nothing to compare against without the database
+
+    def flush(self):
+        if not self.buffer:
+            return
+        rows, self.buffer = self.buffer, []
+        try:
+            self.sink.write(rows)
+        except Exception:
+            self.failed += len(rows)
+            raise
+        self.written += len(rows)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonlSink:
+    """Newline-delimited JSON, gzipped when the path ends in .gz."""
+
+    def __init__(self, path, tree_index=None):
+        self.path = path
+        self.tree_index = tree_index
+        self.lock = threading.Lock()
+        if path.endswith(".gz"):
+            self.file = gzip.open(path, "wt", encoding="utf-8")
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+
+    def open_writer(self):
+        return FileWriter(self, self.tree_index)
+
+    def write(self, records):
+        lines = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records)
+        with self.lock:
+            self.file.write(lines)
+
+    def close(self):
+        self.file.close()
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("external_id", pa.string()),
+        ("sku", pa.string()),
+        ("name", pa.string()),
+        ("slug", pa.string()),
+        ("description", pa.string()),
+        ("short_desc", pa.string()),
+        ("price", pa.float64()),
+        ("original_price", pa.float64()),
+        ("discount_percent", pa.int32()),
+        ("currency", pa.string()),
+        ("stock_status", pa.string()),
+        ("images", pa.list_(pa.string())),
+        ("thumbnail", pa.string()),
+        ("available", pa.bool_()),
+        ("source_url", pa.string()),
+        ("brand", pa.string()),
+        ("weight", pa.float64()),
+        ("tags", pa.list_(pa.string())),
+        ("category_slug", pa.string()),
+        ("category_name", pa.string()),
+        ("scraped_at", pa.timestamp("us", tz="UTC")),
+    ])
+
+
+class ParquetSink:
+    """Parquet file, one row group per worker batch (needs pyarrow)."""
+
+    def __init__(self, path, tree_index=None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("--sink parquet needs pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.path = path
+        self.tree_index = tree_index
+        self.lock = threading.Lock()
+        self.schema = parquet_schema()
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def open_writer(self):
+        return FileWriter(self, self.tree_index)
+
+    def write(self, records):
+        table = self.pa.Table.from_pylist(records, schema=self.schema)
+        with self.lock:
+            self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+def open_sink(kind, path=None, catalog_index=None, tree_index=None):
+    if kind == "postgres":
+        return PostgresSink(catalog_index if catalog_index is not None else {}, tree_index)
+    if not path:
+        raise ValueError(f"--sink {kind} needs --output")
+    if kind == "jsonl":
+        return JsonlSink(path, tree_index)
+    if kind == "parquet":
+        return ParquetSink(path, tree_index)
+    raise ValueError(f"Unknown sink: {kind}")
@@ -1,14 +1,16 @@
 import re
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
-from config import BASE_URL, HEADERS, REQUEST_TIMEOUT, RATE_LIMIT_SECONDS, EXCLUDE_PATTERNS
+from config import (
+    BASE_URL, RATE_LIMIT_SECONDS, EXCLUDE_PATTERNS, MAX_RETRIES, BACKOFF_FACTOR,
+    LISTING_REQUESTS_PER_SECOND, PAGINATION_WORKERS,
+)
+from fetch import fetch_page, pause, RateLimiter, Cancelled, RateLimited, Blocked, TransientError
+from events import log
 
-
-def fetch_page(url):
-    resp = requests.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT)
-    resp.raise_for_status()
-    return resp.text
+# Shared by every worker thread so concurrent pagination stays within budget
+listing_limiter = RateLimiter(LISTING_REQUESTS_PER_SECOND)
 
 
 def is_excluded(url):
@@ -18,93 +20,261 @@ def is_excluded(url):
     return False
 
 
-def get_top_categories():
+CATEGORY_HREF_PATTERN = re.compile(r"/en/(\d+)-([a-z0-9-]+)$")
+
+
+def _category_link(a):
+    href = a.get("href", "").strip()
+    if not href or is_excluded(href):
+        return None
+    match = CATEGORY_HREF_PATTERN.search(href)
+    if not match:
+        return None
+    full_url = href if href.startswith("http") else BASE_URL + href
+    return match.group(1), match.group(2), full_url
+
+
+def _menu_parent_id(a, cat_id):
+    """Category id of the nearest enclosing menu item that isn't this link's own <li>."""
+    for li in a.find_parents("li"):
+        first = li.find("a", href=CATEGORY_HREF_PATTERN)
+        if not first:
+            continue
+        link = _category_link(first)
+        if link and link[0] != cat_id:
+            return link[0]
+    return None
+
+
+def get_category_tree():
+    """All homepage menu categories, with parent/children links reconstructed from
+    how the menu <li>s nest. A category appearing in several menus keeps the
+    first parent found for it."""
     html = fetch_page(f"{BASE_URL}/en/")
     soup = BeautifulSoup(html, "lxml")
-    categories = []
-    seen = set()
-
-    top_level_ids = set()
-    top_level_map = {}
+    nodes = {}
 
     for a in soup.select("a[href*='/en/']"):
-        href = a.get("href", "").strip()
         text = a.get_text(strip=True)
-        if not text or not href:
-            continue
-        match = re.search(r"/en/(\d+)-([a-z0-9-]+)$", href)
-        if not match:
-            continue
-        if is_excluded(href):
+        link = _category_link(a)
+        if not text or not link:
             continue
-        cat_id = match.group(1)
-        slug = match.group(2)
-        if cat_id in seen:
-            continue
-        seen.add(cat_id)
-        full_url = href if href.startswith("http") else BASE_URL + href
-        cat = {"id": cat_id, "slug": slug, "name": text, "url": full_url}
-        categories.append(cat)
+        cat_id, slug, full_url = link
+        node = nodes.get(cat_id)
+        if node is None:
+            node = {"id": cat_id, "slug": slug, "name": text, "url": full_url,
+                    "parent_id": None, "children": [], "depth": 0}
+            nodes[cat_id] = node
+        if node["parent_id"] is None:
+            node["parent_id"] = _menu_parent_id(a, cat_id)
+
+    for node in nodes.values():
+        if node["parent_id"] not in nodes or _is_ancestor(nodes, node["id"], node["parent_id"]):
+            node["parent_id"] = None
+    for node in nodes.values():
+        if node["parent_id"]:
+            nodes[node["parent_id"]]["children"].append(node["id"])
+        depth, parent = 0, node["parent_id"]
+        while parent:
+            depth += 1
+            parent = nodes[parent]["parent_id"]
+        node["depth"] = depth
+
+    return list(nodes.values())
+
 
-    print(f"Found {len(categories)} categories (including parents and leaves)")
+def _is_ancestor(nodes, cat_id, other_id):
+    """True if cat_id is already on other_id's parent chain (linking would cycle)."""
+    seen = set()
+    while other_id and other_id not in seen:
+        if other_id == cat_id:
+            return True
+        seen.add(other_id)
+        other_id = nodes.get(other_id, {}).get("parent_id")
+    return False
+
+
+def get_top_categories():
+    categories = get_category_tree()
+    leaves = sum(1 for c in categories if not c["children"])
+    log.info("categories.found", "Found {categories} categories ({parents} parents, {leaves} leaves)",
+             categories=len(categories), parents=len(categories) - leaves, leaves=leaves)
     return categories
 
 
+def leaf_categories(categories):
+    """Only categories without children — parent listings repeat their children's products."""
+    return [c for c in categories if not c["children"]]
+
+
+def _norm_category_name(name):
+    return re.sub(r"\s+", " ", name).strip().casefold()
+
+
+def breadcrumb_index(categories):
+    """parent_id -> {normalized child name: category}, for deepest_category()."""
+    by_parent = {}
+    for c in categories:
+        by_parent.setdefault(c["parent_id"], {})[_norm_category_name(c["name"])] = c
+    return by_parent
+
+
+def deepest_category(by_parent, listed_in, breadcrumb_names):
+    """Walk the product's breadcrumb down the tree and return the deepest category
+    it reaches, falling back to the listing the product was found in."""
+    node, parent_id = None, None
+    for name in breadcrumb_names:
+        child = by_parent.get(parent_id, {}).get(_norm_category_name(name))
+        if child is None:
+            if node is None:
+                continue  # breadcrumb may start above the menu roots
+            break
+        node, parent_id = child, child["id"]
+
+    if node is not None and node["depth"] >= listed_in.get("depth", 0):
+        return node
+    return listed_in
+
+
+PRODUCT_CARD_SELECTOR = "article.product-container, article.product-miniature, article[class*='product']"
+
+
 def has_products(url):
     try:
         html = fetch_page(url)
         soup = BeautifulSoup(html, "lxml")
-        cards = soup.select("article.product-container, article.product-miniature, article[class*='product']")
-        return len(cards) > 0
+        return len(soup.select(PRODUCT_CARD_SELECTOR)) > 0
     except Exception:
         return False
 
 
-def get_product_urls_from_category(category_url, max_pages=None):
+def parse_listing(soup):
     product_urls = []
-    page = 1
+    for card in soup.select(PRODUCT_CARD_SELECTOR):
+        link_el = card.select_one("a[href$='.html']")
+        if not link_el:
+            continue
+        href = link_el.get("href", "")
+        if not href:
+            continue
+        match = re.search(r"/en/(\d+)-", href)
+        if match:
+            ext_id = match.group(1)
+            full = href if href.startswith("http") else BASE_URL + href
+            product_urls.append((ext_id, full))
+    return product_urls
+
+
+def has_next_page(soup):
+    return soup.select_one("a.next, .pagination a[rel='next'], a[rel='next']") is not None
+
 
-    while True:
-        url = category_url if page == 1 else f"{category_url}?page={page}"
+def parse_page_count(soup):
+    """Highest page number linked from the pagination block, 1 if there is no
+    pagination at all, or None if there is one but no page number can be read."""
+    pagination = soup.select_one("nav.pagination, .pagination, ul.page-list")
+    if not pagination:
+        return None if has_next_page(soup) else 1
+    pages = []
+    for a in pagination.select("a[href]"):
+        match = re.search(r"[?&]page=(\d+)", a["href"])
+        if match:
+            pages.append(int(match.group(1)))
+        elif a.get_text(strip=True).isdigit():
+            pages.append(int(a.get_text(strip=True)))
+    return max(pages) if pages else None
+
+
+def _fetch_listing_page(category_url, page):
+    """Fetch one listing page, retrying rate limits, blocks (after the circuit
+    breaker's pause) and transient errors."""
+    url = category_url if page == 1 else f"{category_url}?page={page}"
+    for attempt in range(MAX_RETRIES + 1):
+        listing_limiter.wait()
         try:
-            html = fetch_page(url)
+            return BeautifulSoup(fetch_page(url), "lxml")
+        except (RateLimited, Blocked):
+            if attempt == MAX_RETRIES:
+                raise
+        except TransientError:
+            if attempt == MAX_RETRIES:
+                raise
+            pause(RATE_LIMIT_SECONDS * (BACKOFF_FACTOR ** attempt))
+
+
+def get_product_urls_from_category(category_url, max_pages=None, failed_pages=None):
+    """(external_id, url) pairs from every listing page. Pages that could not be
+    fetched are appended to `failed_pages` if given, so callers can tell a complete
+    listing from a partial one. Cancellation propagates."""
+    if failed_pages is None:
+        failed_pages = []
+    try:
+        soup = _fetch_listing_page(category_url, 1)
+    except Cancelled:
+        raise
+    except Exception as e:
+        log.warning("listing.page_failed", "  Page {page} fetch failed: {error}",
+                    url=category_url, page=1, error=str(e))
+        failed_pages.append(1)
+        return []
+
+    product_urls = parse_listing(soup)
+    if not product_urls or (max_pages and max_pages <= 1):
+        return product_urls
+
+    total = parse_page_count(soup)
+    if total is None:
+        return product_urls + _follow_next_pages(category_url, soup, max_pages, failed_pages)
+
+    last = min(total, max_pages) if max_pages else total
+    if last < 2:
+        return product_urls
+
+    def fetch(page):
+        try:
+            return parse_listing(_fetch_listing_page(category_url, page))
+        except Cancelled:
+            raise
         except Exception as e:
-            print(f"  Page {page} fetch failed: {e}")
-            break
+            log.warning("listing.page_failed", "  Page {page} fetch failed: {error}",
+                        url=category_url, page=page, error=str(e))
+            failed_pages.append(page)
+            return []
 
-        soup = BeautifulSoup(html, "lxml")
-        cards = soup.select("article.product-container, article.product-miniature, article[class*='product']")
+    # Page count is known up front, so fan out; the shared limiter keeps the
+    # overall request rate in budget no matter how many pages are in flight.
+    with ThreadPoolExecutor(max_workers=PAGINATION_WORKERS) as executor:
+        for page_urls in executor.map(fetch, range(2, last + 1)):
+            product_urls.extend(page_urls)
 
-        if not cards:
-            break
+    return product_urls
 
-        for card in cards:
-            link_el = card.select_one("a[href$='.html']")
-            if not link_el:
-                continue
-            href = link_el.get("href", "")
-            if not href:
-                continue
-            match = re.search(r"/en/(\d+)-", href)
-            if match:
-                ext_id = match.group(1)
-                full = href if href.startswith("http") else BASE_URL + href
-                product_urls.append((ext_id, full))
-
-        has_next = soup.select_one("a.next, .pagination a[rel='next'], a[rel='next']")
-        if not has_next:
-            break
-        if max_pages and page >= max_pages:
-            break
 
+def _follow_next_pages(category_url, soup, max_pages=None, failed_pages=None):
+    """Sequential fallback when the page count can't be read: follow rel=next."""
+    product_urls = []
+    page = 1
+    while has_next_page(soup) and not (max_pages and page >= max_pages):
         page += 1
-        time.sleep(RATE_LIMIT_SECONDS)
-
+        try:
+            soup = _fetch_listing_page(category_url, page)
+        except Cancelled:
+            raise
+        except Exception as e:
+            log.warning("listing.page_failed", "  Page {page} fetch failed: {error}",
+                        url=category_url, page=page, error=str(e))
+            if failed_pages is not None:
+                failed_pages.append(page)
+            break
+        page_urls = parse_listing(soup)
+        if not page_urls:
+            break
+        product_urls.extend(page_urls)
     return product_urls
 
 
 def get_all_product_urls(max_pages_per_cat=None, max_categories=None):
-    categories = get_top_categories()
+    categories = leaf_categories(get_top_categories())
     if max_categories:
         categories = categories[:max_categories]
 
@@ -112,10 +282,11 @@ def get_all_product_urls(max_pages_per_cat=None, max_categories=None):
     seen_ids = set()
 
     for i, cat in enumerate(categories):
-        print(f"[{i+1}/{len(categories)}] Crawling: {cat['name']} ({cat['url']})")
+        log.info("category.crawl", "[{n}/{of}] Crawling: {category} ({url})",
+                 n=i + 1, of=len(categories), category=cat["name"], url=cat["url"])
         urls = get_product_urls_from_category(cat["url"], max_pages=max_pages_per_cat)
         if not urls:
-            print(f"  No products (parent category), skipping")
+            log.info("category.empty", "  No products (parent category), skipping", category=cat["name"])
             time.sleep(RATE_LIMIT_SECONDS)
             continue
         new = 0
@@ -124,8 +295,9 @@ def get_all_product_urls(max_pages_per_cat=None, max_categories=None):
                 seen_ids.add(ext_id)
                 all_urls.append((ext_id, url, cat))
                 new += 1
-        print(f"  {new} new products (total: {len(all_urls)})")
+        log.info("category.listed", "  {new} new products (total: {total})",
+                 category=cat["name"], new=new, total=len(all_urls))
         time.sleep(RATE_LIMIT_SECONDS)
 
-    print(f"\nTotal unique products: {len(all_urls)}")
+    log.info("crawl.listed", "\nTotal unique products: {total}", total=len(all_urls))
     return all_urls
@@ -0,0 +1,163 @@
+import os
+import gzip
+import json
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import psycopg2.extras
+from db import get_connection
+from events import log
+from config import SNAPSHOT_DIR, SNAPSHOT_KEEP, SNAPSHOT_LIST_SIZE
+
+# Denormalized, read-only view of the catalog for the web tier: the data behind
+# /api/categories, /api/products/trending and /api/products/offers plus a compact
+# card for every available product. Each version is an immutable
+# catalog-<hash>.json.gz (cache it forever); latest.json names the current one.
+
+CARD_COLUMNS = """
+    p.id, p.external_id AS "externalId", p.name, p.slug,
+    p.price, p.original_price AS "originalPrice", p.discount_percent AS "discountPercent",
+    p.currency, p.stock_status AS "stockStatus", p.category_id AS "categoryId",
+    p.brand, p.thumbnail, p.available
+"""
+
+LISTED = "p.available = TRUE AND p.thumbnail IS NOT NULL AND p.price > 0"
+
+
+def title_case(name):
+    """Same display casing as the /api/categories route."""
+    words = []
+    for w in name.lower().split():
+        if w in ("&", "-"):
+            words.append(w)
+        elif len(w) <= 2:
+            words.append(w.upper())
+        else:
+            words.append(w[0].upper() + w[1:])
+    return " ".join(words)
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _rows(cur, sql, params=()):
+    cur.execute(sql, params)
+    return [dict(row) for row in cur.fetchall()]
+
+
+def build_snapshot(conn, list_size=SNAPSHOT_LIST_SIZE):
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        categories = _rows(cur, """
+            SELECT id, slug, name, icon, image_url AS "imageUrl",
+                   product_count AS "productCount", display_order AS "displayOrder"
+            FROM categories
+            WHERE product_count > 0
+            ORDER BY product_count DESC, slug
+        """)
+        trending = _rows(cur, f"""
+            SELECT {CARD_COLUMNS}, json_build_object('name', c.name) AS category
+            FROM products p LEFT JOIN categories c ON c.id = p.category_id
+            WHERE {LISTED} AND p.stock_status = 'IN_STOCK'
+            ORDER BY p.scraped_at DESC NULLS LAST, p.id
+            LIMIT %s
+        """, (list_size,))
+        offers = _rows(cur, f"""
+            SELECT {CARD_COLUMNS}, json_build_object('name', c.name) AS category
+            FROM products p LEFT JOIN categories c ON c.id = p.category_id
+            WHERE {LISTED} AND p.discount_percent > 0 AND p.discount_percent < 100
+            ORDER BY p.discount_percent DESC, p.id
+            LIMIT %s
+        """, (list_size,))
+        products = _rows(cur, f"""
+            SELECT {CARD_COLUMNS} FROM products p
+            WHERE p.available = TRUE
+            ORDER BY p.category_id, p.name, p.id
+        """)
+    for c in categories:
+        c["name"] = title_case(c["name"])
+    return {"categories": categories, "trending": trending, "offers": offers, "products": products}
+
+
+def _write_atomic(path, data):
+    """Write to a temp file in the same directory, fsync, then rename over `path`."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, "latest.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def publish_snapshot(conn, out_dir, keep=SNAPSHOT_KEEP):
+    """Build and publish a snapshot. The version is the hash of its content, so an
+    unchanged catalog publishes nothing new. Returns the manifest."""
+    os.makedirs(out_dir, exist_ok=True)
+    snapshot = build_snapshot(conn)
+    body = json.dumps(snapshot, default=_json_value, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    version = hashlib.sha256(body).hexdigest()[:16]
+
+    current = read_manifest(out_dir)
+    if current and current.get("version") == version:
+        log.info("snapshot.unchanged", "Catalog snapshot unchanged ({version})", version=version)
+        return current
+
+    filename = f"catalog-{version}.json.gz"
+    # mtime=0 keeps the gzip bytes identical for identical content
+    _write_atomic(os.path.join(out_dir, filename), gzip.compress(body, compresslevel=9, mtime=0))
+    manifest = {
+        "version": version,
+        "file": filename,
+        "sha256": hashlib.sha256(body).hexdigest(),
+        "generatedAt": datetime.now(timezone.utc).isoformat(),
+        "counts": {key: len(value) for key, value in snapshot.items()},
+    }
+    # The manifest goes last so readers never see a version whose file isn't there yet
+    _write_atomic(os.path.join(out_dir, "latest.json"), json.dumps(manifest, indent=2).encode("utf-8"))
+
+    versions = sorted(
+        (f for f in os.listdir(out_dir) if f.startswith("catalog-") and f.endswith(".json.gz")),
+        key=lambda f: os.path.getmtime(os.path.join(out_dir, f)), reverse=True,
+    )
+    for old in versions[keep:]:
+        if old != filename:
+            os.unlink(os.path.join(out_dir, old))
+
+    log.info("snapshot.published", "Published catalog snapshot {version}: {kib} KiB raw, {summary}",
+             version=version, kib=len(body) // 1024, counts=manifest["counts"],
+             summary=", ".join(f"{n} {key}" for key, n in manifest["counts"].items()))
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish a denormalized catalog snapshot for the web app")
+    parser.add_argument("--out", metavar="DIR", default=SNAPSHOT_DIR, help="Output directory (default: $SNAPSHOT_DIR)")
+    parser.add_argument("--keep", type=int, default=SNAPSHOT_KEEP,
+                        help=f"Snapshot versions to retain (default: {SNAPSHOT_KEEP})")
+    args = parser.parse_args()
+    if not args.out:
+        parser.error("--out or SNAPSHOT_DIR is required")
+    conn = get_connection()
+    publish_snapshot(conn, args.out, keep=args.keep)
+    conn.close()
@@ -0,0 +1,83 @@
+-- Precomputed home-page listings.
+--
+-- /api/products/trending and /api/products/offers used to filter, sort and
+-- join categories on every request, for data that only changes when the
+-- scraper runs. These materialized views hold the finished top-N rows with the
+-- category name already joined in; the routes read them by their unique rank
+-- index. The scraper refreshes them CONCURRENTLY at the end of each run, so
+-- readers never wait on a refresh.
+
+-- Newest in-stock products with a picture (the trending strip)
+CREATE MATERIALIZED VIEW IF NOT EXISTS product_listing_trending AS
+SELECT
+  row_number() OVER (ORDER BY p.scraped_at DESC NULLS LAST, p.id) AS rank,
+  p.id, p.external_id, p.sku, p.name, p.slug, p.description, p.short_desc,
+  p.price, p.original_price, p.discount_percent, p.currency, p.stock_status,
+  p.category_id, p.brand, p.weight, p.tags, p.images, p.thumbnail,
+  p.available, p.source_url, p.scraped_at, p.last_seen_at,
+  c.name AS category_name
+FROM products p
+LEFT JOIN categories c ON c.id = p.category_id
+WHERE p.available = true
+  AND p.stock_status = 'IN_STOCK'
+  AND p.thumbnail IS NOT NULL
+  AND p.price > 0
+ORDER BY p.scraped_at DESC NULLS LAST, p.id
+LIMIT 12;
+
+CREATE UNIQUE INDEX IF NOT EXISTS product_listing_trending_rank_idx
+  ON product_listing_trending (rank);
+
+-- Biggest discounts (the offers strip)
+CREATE MATERIALIZED VIEW IF NOT EXISTS product_listing_offers AS
+SELECT
+  row_number() OVER (ORDER BY p.discount_percent DESC, p.id) AS rank,
+  p.id, p.external_id, p.sku, p.name, p.slug, p.description, p.short_desc,
+  p.price, p.original_price, p.discount_percent, p.currency, p.stock_status,
+  p.category_id, p.brand, p.weight, p.tags, p.images, p.thumbnail,
+  p.available, p.source_url, p.scraped_at, p.last_seen_at,
+  c.name AS category_name
+FROM products p
+LEFT JOIN categories c ON c.id = p.category_id
+WHERE p.available = true
+  AND p.discount_percent > 0 AND p.discount_percent < 100
+  AND p.thumbnail IS NOT NULL
+  AND p.price > 0
+ORDER BY p.discount_percent DESC, p.id
+LIMIT 12;
+
+CREATE UNIQUE INDEX IF NOT EXISTS product_listing_offers_rank_idx
+  ON product_listing_offers (rank);
+
+-- Top 12 products per category: most units ordered in the last 90 days, then
+-- biggest discount, then most recently scraped. Read with
+-- WHERE category_id = $1 ORDER BY rank.
+CREATE MATERIALIZED VIEW IF NOT EXISTS category_top_products AS
+WITH demand AS (
+  SELECT oi.product_id, SUM(oi.quantity) AS units
+  FROM order_items oi
+  JOIN orders o ON o.id = oi.order_id
+  WHERE o.created_at > NOW() - INTERVAL '90 days'
+  GROUP BY oi.product_id
+),
+ranked AS (
+  SELECT
+    row_number() OVER (
+      PARTITION BY p.category_id
+      ORDER BY COALESCE(d.units, 0) DESC, COALESCE(p.discount_percent, 0) DESC,
+               p.scraped_at DESC NULLS LAST, p.id
+    ) AS rank,
+    COALESCE(d.units, 0) AS units_ordered,
+    p.id, p.external_id, p.name, p.slug, p.short_desc,
+    p.price, p.original_price, p.discount_percent, p.currency, p.stock_status,
+    p.category_id, p.brand, p.images, p.thumbnail, p.available
+  FROM products p
+  LEFT JOIN demand d ON d.product_id = p.id::text
+  WHERE p.available = true
+    AND p.category_id IS NOT NULL
+    AND p.price > 0
+)
+SELECT * FROM ranked WHERE rank <= 12;
+
+CREATE UNIQUE INDEX IF NOT EXISTS category_top_products_category_rank_idx
+  ON category_top_products (category_id, rank);
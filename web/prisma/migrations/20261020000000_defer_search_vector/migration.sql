@@ -0,0 +1,36 @@
+-- Deferred search_vector for bulk loads.
+--
+-- trg_products_search_vector recomputes five to_tsvector calls on every row
+-- the scraper or the cleaning pipeline writes. A session that sets
+-- yachtdrop.defer_search_vector = on (the scraper's bulk-load mode) now only
+-- clears search_vector instead; the cleared rows are found through a partial
+-- index and recomputed in one UPDATE before the run finishes. Every other
+-- writer keeps the per-row behaviour.
+
+-- One definition of the vector, shared by the trigger and the batch recompute:
+-- name (A) + brand (A) + short_desc (B) + sku (A) + tags (B)
+CREATE OR REPLACE FUNCTION products_search_vector(
+  name TEXT, brand TEXT, short_desc TEXT, sku TEXT, tags TEXT[]
+) RETURNS tsvector AS $$
+  SELECT
+    setweight(to_tsvector('english', COALESCE(name, '')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(brand, '')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(short_desc, '')), 'B') ||
+    setweight(to_tsvector('english', COALESCE(sku, '')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(array_to_string(tags, ' '), '')), 'B')
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+BEGIN
+  IF current_setting('yachtdrop.defer_search_vector', true) = 'on' THEN
+    NEW.search_vector := NULL;
+  ELSE
+    NEW.search_vector := products_search_vector(NEW.name, NEW.brand, NEW.short_desc, NEW.sku, NEW.tags);
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Rows waiting for their search_vector; empty outside a bulk load
+CREATE INDEX IF NOT EXISTS idx_products_search_vector_pending
+  ON products (id) WHERE search_vector IS NULL;
@@ -0,0 +1,36 @@
+-- Keep search_vector while a deferred recompute is pending.
+--
+-- Clearing search_vector in bulk-load sessions dropped every product the run
+-- rewrote out of /api/search until the end-of-run recompute, and for good if
+-- the run died before reaching it. Deferred writes now keep the previous vector
+-- (new rows have none yet) and set search_vector_stale instead; the recompute
+-- finds flagged rows through a partial index and clears the flag, and a run
+-- that dies leaves them flagged for the next one.
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector_stale BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Rows cleared by the previous deferred mode and not recomputed yet
+UPDATE products SET search_vector_stale = TRUE WHERE search_vector IS NULL;
+
+CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+BEGIN
+  IF current_setting('yachtdrop.defer_search_vector', true) = 'on' THEN
+    IF TG_OP = 'UPDATE' THEN
+      NEW.search_vector := OLD.search_vector;
+    ELSE
+      NEW.search_vector := NULL;
+    END IF;
+    NEW.search_vector_stale := TRUE;
+  ELSE
+    NEW.search_vector := products_search_vector(NEW.name, NEW.brand, NEW.short_desc, NEW.sku, NEW.tags);
+    NEW.search_vector_stale := FALSE;
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP INDEX IF EXISTS idx_products_search_vector_pending;
+
+-- Rows waiting for their search_vector; empty outside a bulk load
+CREATE INDEX IF NOT EXISTS idx_products_search_vector_stale
+  ON products (id) WHERE search_vector_stale;
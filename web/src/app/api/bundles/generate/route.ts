@@ -8,6 +8,38 @@ export async function GET() {
     return NextResponse.json({ error: "Dev only" }, { status: 403 });
   }
 
+  // Grounded in what crews actually buy: categories co-purchased with lift > 1,
+  // precomputed from orders by scraper/bundles.py
+  try {
+    const anchors = await prisma.$queryRaw<
+      Array<{ slug: string; name: string; companions: Array<{ name: string; lift: number }> }>
+    >`
+      SELECT c.slug, c.name,
+             json_agg(json_build_object('name', s.name, 'lift', b.lift) ORDER BY b.rank) AS companions
+      FROM bundle_suggestions b
+      JOIN copurchase_items i ON i.kind = 'category' AND i.item = b.anchor
+      JOIN categories c ON c.id::text = b.anchor
+      JOIN categories s ON s.id::text = b.item
+      WHERE b.kind = 'category'
+      GROUP BY c.slug, c.name, i.orders
+      ORDER BY i.orders DESC
+      LIMIT 5
+    `;
+    if (anchors.length > 0) {
+      const data = anchors.map((a) => ({
+        id: `${a.slug}-kit`,
+        name: `${a.name} Kit`,
+        description: `Often bought with ${a.companions.map((c) => c.name).join(", ")}`,
+        icon: "\ud83d\udce6",
+        keywords: [a.name, ...a.companions.map((c) => c.name)].map((n) => n.toLowerCase()),
+        maxProducts: 6,
+      }));
+      return NextResponse.json({ data, source: "orders" });
+    }
+  } catch {
+    // Co-purchase tables not built yet — fall back to the LLM
+  }
+
   const categories = await prisma.category.findMany({
     select: { id: true, name: true },
     orderBy: { name: "asc" },
@@ -36,5 +68,5 @@ Return ONLY a JSON array, no explanation.`;
     temperature: 0.5,
   });
 
-  return NextResponse.json({ raw: result, categories, sampleCount: sampleProducts.length });
+  return NextResponse.json({ raw: result, categories, sampleCount: sampleProducts.length, source: "ai" });
 }
@@ -0,0 +1,36 @@
+import { prisma } from "@/lib/prisma";
+import { NextRequest } from "next/server";
+
+// "Frequently bought together", precomputed from orders by scraper/bundles.py
+export async function GET(
+  _request: NextRequest,
+  { params }: { params: Promise<{ id: string }> }
+) {
+  const { id } = await params;
+
+  let products: Array<Record<string, unknown>> = [];
+  try {
+    products = await prisma.$queryRaw<Array<Record<string, unknown>>>`
+      SELECT
+        p.id, p.external_id AS "externalId", p.name, p.slug,
+        p.short_desc AS "shortDesc",
+        p.price::float, p.original_price::float AS "originalPrice",
+        p.discount_percent AS "discountPercent", p.currency,
+        p.stock_status AS "stockStatus", p.category_id AS "categoryId",
+        p.brand, p.images, p.thumbnail, p.available,
+        b.orders, b.lift
+      FROM bundle_suggestions b
+      JOIN products p ON p.id = b.item
+      WHERE b.kind = 'product'
+        AND b.anchor = ${id}
+        AND p.available = true
+      ORDER BY b.rank
+    `;
+  } catch {
+    // Not computed yet — no suggestions
+  }
+
+  const res = Response.json({ data: products });
+  res.headers.set("Cache-Control", "public, s-maxage=300, stale-while-revalidate=3600");
+  return res;
+}
@@ -0,0 +1,37 @@
+import { prisma } from "@/lib/prisma";
+import { NextRequest } from "next/server";
+
+// Price/stock changes recorded by the products triggers (scraper/db.py,
+// ensure_price_history); months past retention come back as daily closes.
+export async function GET(
+  request: NextRequest,
+  { params }: { params: Promise<{ id: string }> }
+) {
+  const { id } = await params;
+  const days = Math.min(
+    730,
+    Math.max(1, Number(request.nextUrl.searchParams.get("days") ?? 90))
+  );
+
+  let history: Array<Record<string, unknown>> = [];
+  try {
+    history = await prisma.$queryRaw<Array<Record<string, unknown>>>`
+      SELECT day::timestamptz AS at, close_price::float AS price,
+             close_original_price::float AS "originalPrice",
+             close_stock_status AS "stockStatus"
+      FROM product_price_daily
+      WHERE product_id = ${id} AND day > (NOW() - make_interval(days => ${days}))::date
+      UNION ALL
+      SELECT recorded_at, price::float, original_price::float, stock_status
+      FROM product_price_history
+      WHERE product_id = ${id} AND recorded_at > NOW() - make_interval(days => ${days})
+      ORDER BY 1
+    `;
+  } catch {
+    // History not set up yet
+  }
+
+  const res = Response.json({ data: history });
+  res.headers.set("Cache-Control", "public, s-maxage=300, stale-while-revalidate=3600");
+  return res;
+}
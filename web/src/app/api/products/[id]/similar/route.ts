@@ -0,0 +1,35 @@
+import { prisma } from "@/lib/prisma";
+import { NextRequest } from "next/server";
+
+// Neighbours precomputed by the scraper (scraper/similar.py), best first
+export async function GET(
+  _request: NextRequest,
+  { params }: { params: Promise<{ id: string }> }
+) {
+  const { id } = await params;
+
+  let products: Array<Record<string, unknown>> = [];
+  try {
+    products = await prisma.$queryRaw<Array<Record<string, unknown>>>`
+      SELECT
+        p.id, p.external_id AS "externalId", p.name, p.slug,
+        p.short_desc AS "shortDesc",
+        p.price::float, p.original_price::float AS "originalPrice",
+        p.discount_percent AS "discountPercent", p.currency,
+        p.stock_status AS "stockStatus", p.category_id AS "categoryId",
+        p.brand, p.images, p.thumbnail, p.available,
+        s.score
+      FROM product_similar s
+      JOIN products p ON p.id = s.similar_id
+      WHERE s.product_id = ${id}
+        AND p.available = true
+      ORDER BY s.rank
+    `;
+  } catch {
+    // Table not built yet — no recommendations
+  }
+
+  const res = Response.json({ data: products });
+  res.headers.set("Cache-Control", "public, s-maxage=300, stale-while-revalidate=3600");
+  return res;
+}
@@ -0,0 +1,66 @@
+/**
+ * Product change feed — price, stock, availability and image changes recorded
+ * by the products triggers (scraper/db.py, ensure_changefeed).
+ *
+ * GET /api/products/changes?after=<cursor>&field=price&limit=500
+ *   → { data: Change[], cursor }  — pass `cursor` back as `after` to resume.
+ *
+ * Only transactions older than the oldest one still running are returned, so
+ * resuming from a cursor never skips a change that committed out of order.
+ * Use it to invalidate just the cache entries that changed, or with
+ * field=price for price-drop alerts.
+ */
+import { prisma } from "@/lib/prisma";
+import { NextRequest, NextResponse } from "next/server";
+
+const FIELDS = ["price", "stock_status", "available", "images"];
+
+export async function GET(request: NextRequest) {
+  const params = request.nextUrl.searchParams;
+  const after = params.get("after") ?? "0-0";
+  const field = params.get("field");
+  const limit = Math.min(1000, Math.max(1, Number(params.get("limit") ?? 500)));
+
+  const match = /^(\d+)-(\d+)$/.exec(after);
+  if (!match || (field && !FIELDS.includes(field))) {
+    return NextResponse.json(
+      { error: "Invalid cursor or field", code: "BAD_REQUEST" },
+      { status: 400 }
+    );
+  }
+  const [, txid, seq] = match;
+
+  try {
+    const rows = await prisma.$queryRaw<
+      Array<{
+        seq: bigint;
+        txid: string;
+        productId: string;
+        externalId: string | null;
+        field: string;
+        oldValue: unknown;
+        newValue: unknown;
+        changedAt: Date;
+      }>
+    >`
+      SELECT seq, txid::text, product_id AS "productId", external_id AS "externalId",
+             field, old_value AS "oldValue", new_value AS "newValue", changed_at AS "changedAt"
+      FROM product_changes
+      WHERE (txid, seq) > (${txid}::xid8, ${BigInt(seq)})
+        AND txid < pg_snapshot_xmin(pg_current_snapshot())
+        AND (${field}::text IS NULL OR field = ${field})
+      ORDER BY txid, seq
+      LIMIT ${limit}
+    `;
+
+    const last = rows[rows.length - 1];
+    const data = rows.map(({ txid: _txid, ...change }) => ({
+      ...change,
+      seq: Number(change.seq),
+    }));
+    return NextResponse.json({ data, cursor: last ? `${last.txid}-${last.seq}` : after });
+  } catch (error) {
+    console.error("Change feed error:", error);
+    return NextResponse.json({ error: "Failed to read changes" }, { status: 500 });
+  }
+}
@@ -1,7 +1,31 @@
 import { NextResponse } from "next/server";
+import { Prisma } from "@prisma/client";
 import { prisma } from "@/lib/prisma";
 
+const SUMMARY_COLUMNS = Prisma.sql`
+  id, external_id AS "externalId", sku, name, slug,
+  description, short_desc AS "shortDesc",
+  price::float, original_price::float AS "originalPrice",
+  discount_percent AS "discountPercent", currency,
+  stock_status AS "stockStatus", category_id AS "categoryId",
+  brand, weight::float, tags, images, thumbnail, available,
+  source_url AS "sourceUrl", scraped_at AS "scrapedAt", last_seen_at AS "lastSeenAt",
+  json_build_object('name', category_name) AS category
+`;
+
 export async function GET() {
+  try {
+    // Precomputed by the scraper at the end of each run
+    const rows = await prisma.$queryRaw<Array<Record<string, unknown>>>`
+      SELECT ${SUMMARY_COLUMNS} FROM product_listing_trending ORDER BY rank
+    `;
+    if (rows.length > 0) {
+      return NextResponse.json({ data: rows });
+    }
+  } catch {
+    // View not migrated yet — fall through to the live query
+  }
+
   try {
     const products = await prisma.product.findMany({
       where: {
@@ -0,0 +1,97 @@
+/**
+ * Autocomplete API — as-you-type suggestions (products, brands, SKUs, tags).
+ *
+ * Reads the prefix index the scraper compiles after each run
+ * (scraper/autocomplete.py), never the products table: one primary-key
+ * lookup per keystroke. When a prefix has no suggestions, the symmetric-delete
+ * typo index maps one-character typos back to indexed prefixes.
+ *
+ * Cache: public, s-maxage=300, stale-while-revalidate=3600
+ */
+import { prisma } from "@/lib/prisma";
+import { NextRequest, NextResponse } from "next/server";
+
+// Must match AUTOCOMPLETE_* in scraper/config.py
+const PREFIX_MAX = 12;
+const TYPO_MIN = 4;
+const TYPO_MAX = 8;
+const LIMIT = 8;
+
+interface Suggestion {
+  text: string;
+  kind: "product" | "brand" | "sku" | "tag";
+  weight: number;
+  id?: string;
+  slug?: string;
+}
+
+/** Same normalization as autocomplete.normalize in the scraper */
+function normalize(text: string) {
+  return text
+    .normalize("NFKD")
+    .replace(/[\u0300-\u036f]/g, "")
+    .toLowerCase()
+    .replace(/[^a-z0-9]+/g, " ")
+    .trim();
+}
+
+function deletes(term: string) {
+  const variants = new Set<string>();
+  for (let i = 0; i < term.length; i++) {
+    variants.add(term.slice(0, i) + term.slice(i + 1));
+  }
+  return [...variants];
+}
+
+export async function GET(request: NextRequest) {
+  const key = normalize(request.nextUrl.searchParams.get("q") ?? "");
+  if (!key) {
+    return NextResponse.json({ data: [] });
+  }
+
+  let data: Suggestion[] = [];
+  let typo = false;
+
+  try {
+    const rows = await prisma.$queryRaw<Array<{ suggestions: Suggestion[] }>>`
+      SELECT suggestions FROM search_autocomplete
+      WHERE prefix = ${key.slice(0, PREFIX_MAX).trimEnd()}
+    `;
+    data = rows[0]?.suggestions ?? [];
+    if (key.length > PREFIX_MAX) {
+      // Only the first PREFIX_MAX characters are indexed
+      data = data.filter((s) => normalize(s.text).includes(key));
+    }
+
+    if (data.length === 0 && key.length >= TYPO_MIN) {
+      const probe = key.slice(0, TYPO_MAX);
+      const variants = [probe, ...deletes(probe)];
+      const fuzzy = await prisma.$queryRaw<Array<{ suggestions: Suggestion[] }>>`
+        SELECT suggestions FROM search_autocomplete
+        WHERE prefix IN (
+          SELECT prefix FROM search_autocomplete_typos WHERE variant = ANY(${variants})
+          UNION
+          SELECT unnest(${variants}::text[])
+        )
+      `;
+      const merged = new Map<string, Suggestion>();
+      for (const row of fuzzy) {
+        for (const s of row.suggestions) {
+          merged.set(`${s.kind}:${s.id ?? s.text}`, s);
+        }
+      }
+      data = [...merged.values()].sort((a, b) => b.weight - a.weight);
+      typo = data.length > 0;
+    }
+  } catch (error) {
+    // Index not built yet — the client falls back to /api/search/combined
+    console.error("Autocomplete error:", error);
+  }
+
+  const res = NextResponse.json({ data: data.slice(0, LIMIT), typo });
+  res.headers.set(
+    "Cache-Control",
+    "public, s-maxage=300, stale-while-revalidate=3600"
+  );
+  return res;
+}